@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Accumulation des écoulements MFD dans l'ordre topologique (algorithme de Kahn)
+
+Remplace myk_cellulesDrainees : les degrés entrants sont calculés une seule
+fois, puis chaque cellule est traitée exactement une fois, quand toutes ses
+cellules amont l'ont été.
+
+Chaque poids est divisé par la somme des poids de sa cellule (sommePoids) :
+pourcentages, virgule fixe ou flottants (MFD_directions.TYPES_POIDS), la
+masse est conservée (bilanMasse : aire sortant aux cellules sans récepteur =
+nbr de cellules valides). Avec des pourcentages de somme 100, le résultat est
+celui d'une division par 100.
+
+accumulationParTuiles fait le même calcul tuile par tuile, en parallèle, puis
+propage vers l'aval les flux qui traversent les frontières des tuiles.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+from numba import njit, prange
+from concurrent.futures import ThreadPoolExecutor
+from MFD_voisinage import DX, DY, fenetres
+
+
+@njit(parallel=True)
+def degresEntrants(dataMNT, directionsEcoulement, noDataValue, degres):
+    #Nbr de cellules amont de chaque cellule : voisins dont la direction opposée (i +/- 4) est non nulle
+    dimx, dimy = dataMNT.shape
+    premier = directionsEcoulement.shape[2] - 8
+    for x in prange(dimx):
+        for y in range(dimy):
+            degres[x, y] = 0
+            if dataMNT[x, y] == noDataValue:
+                continue
+            for i in range(1, 9):
+                xv = x + DX[i]
+                yv = y + DY[i]
+                indice = i + 4 if i <= 4 else i - 4
+                if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and dataMNT[xv, yv] != noDataValue:
+                    if directionsEcoulement[xv, yv, indice - 1 + premier] > 0:
+                        degres[x, y] += 1
+
+
+@njit
+def sommePoids(directionsEcoulement, x, y, premier):
+    total = 0.0
+    for k in range(8):
+        total += directionsEcoulement[x, y, k + premier]
+    return total
+
+
+@njit
+def accumulationTopologique(dataMNT, directionsEcoulement, noDataValue, cellDrainees):
+    #cellDrainees[x, y] = 1 + somme des aires drainées amont pondérées par leurs pourcentages d'écoulement vers (x, y)
+    #directionsEcoulement : cube (dimx, dimy, 9) ou format compact (dimx, dimy, 8) de MFD_directions
+    #Retourne le nbr de cellules traitées (égal au nbr de cellules valides en l'absence de cycle dans les directions)
+    dimx, dimy = dataMNT.shape
+    premier = directionsEcoulement.shape[2] - 8
+    degres = np.empty((dimx, dimy), dtype=np.uint8)
+    degresEntrants(dataMNT, directionsEcoulement, noDataValue, degres)
+
+    file = np.empty(dimx * dimy, dtype=np.int64)
+    debut = 0
+    fin = 0
+    for x in range(dimx):
+        for y in range(dimy):
+            if dataMNT[x, y] == noDataValue:
+                cellDrainees[x, y] = 0
+                continue
+            cellDrainees[x, y] = 1
+            if degres[x, y] == 0:
+                file[fin] = x * dimy + y
+                fin += 1
+
+    while debut < fin:
+        c = file[debut]
+        debut += 1
+        x = c // dimy
+        y = c % dimy
+        total = sommePoids(directionsEcoulement, x, y, premier)
+        for i in range(1, 9):
+            pourcentage = directionsEcoulement[x, y, i - 1 + premier]
+            if pourcentage == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            cellDrainees[xv, yv] += cellDrainees[x, y] * pourcentage / total
+            degres[xv, yv] -= 1
+            if degres[xv, yv] == 0:
+                file[fin] = xv * dimy + yv
+                fin += 1
+    return fin
+
+
+@njit
+def accumulationCSR(dataMNT, offsets, recepteurs, poids, noDataValue, cellDrainees):
+    #Même calcul que accumulationTopologique, directions au format CSR de MFD_directions
+    dimx, dimy = dataMNT.shape
+    degres = np.zeros(dimx * dimy, dtype=np.uint8)
+    for c in range(dimx * dimy):
+        x = c // dimy
+        y = c % dimy
+        if dataMNT[x, y] == noDataValue:
+            continue
+        for k in range(offsets[c], offsets[c + 1]):
+            xv = x + DX[recepteurs[k]]
+            yv = y + DY[recepteurs[k]]
+            if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and dataMNT[xv, yv] != noDataValue:
+                degres[xv * dimy + yv] += 1
+
+    file = np.empty(dimx * dimy, dtype=np.int64)
+    debut = 0
+    fin = 0
+    for x in range(dimx):
+        for y in range(dimy):
+            if dataMNT[x, y] == noDataValue:
+                cellDrainees[x, y] = 0
+                continue
+            cellDrainees[x, y] = 1
+            if degres[x * dimy + y] == 0:
+                file[fin] = x * dimy + y
+                fin += 1
+
+    while debut < fin:
+        c = file[debut]
+        debut += 1
+        x = c // dimy
+        y = c % dimy
+        total = poids[offsets[c]:offsets[c + 1]].sum()
+        for k in range(offsets[c], offsets[c + 1]):
+            xv = x + DX[recepteurs[k]]
+            yv = y + DY[recepteurs[k]]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            cellDrainees[xv, yv] += cellDrainees[x, y] * poids[k] / total
+            r = xv * dimy + yv
+            degres[r] -= 1
+            if degres[r] == 0:
+                file[fin] = r
+                fin += 1
+    return fin
+
+
+@njit(nogil=True)
+def accumulationLocale(dataMNT, directionsEcoulement, noDataValue, cellDrainees, sorties, l0, l1, c0, c1):
+    #Accumulation limitée à la zone [l0, l1[ x [c0, c1[ d'une fenêtre (tuile et son halo)
+    #Les écoulements vers les cellules du halo sont cumulés dans sorties au lieu d'être propagés ; retourne le nbr de cellules traitées
+    dimx, dimy = dataMNT.shape
+    premier = directionsEcoulement.shape[2] - 8
+    degres = np.zeros((dimx, dimy), dtype=np.uint8)
+    for x in range(l0, l1):
+        for y in range(c0, c1):
+            if dataMNT[x, y] == noDataValue:
+                continue
+            for i in range(1, 9):
+                if directionsEcoulement[x, y, i - 1 + premier] == 0:
+                    continue
+                xv = x + DX[i]
+                yv = y + DY[i]
+                if xv >= l0 and yv >= c0 and xv < l1 and yv < c1 and dataMNT[xv, yv] != noDataValue:
+                    degres[xv, yv] += 1
+
+    file = np.empty((l1 - l0) * (c1 - c0), dtype=np.int64)
+    debut = 0
+    fin = 0
+    for x in range(l0, l1):
+        for y in range(c0, c1):
+            if dataMNT[x, y] == noDataValue:
+                cellDrainees[x, y] = 0
+                continue
+            cellDrainees[x, y] = 1
+            if degres[x, y] == 0:
+                file[fin] = x * dimy + y
+                fin += 1
+
+    while debut < fin:
+        c = file[debut]
+        debut += 1
+        x = c // dimy
+        y = c % dimy
+        total = sommePoids(directionsEcoulement, x, y, premier)
+        for i in range(1, 9):
+            pourcentage = directionsEcoulement[x, y, i - 1 + premier]
+            if pourcentage == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            if xv < l0 or yv < c0 or xv >= l1 or yv >= c1:
+                sorties[xv, yv] += cellDrainees[x, y] * pourcentage / total
+                continue
+            cellDrainees[xv, yv] += cellDrainees[x, y] * pourcentage / total
+            degres[xv, yv] -= 1
+            if degres[xv, yv] == 0:
+                file[fin] = xv * dimy + yv
+                fin += 1
+    return fin
+
+
+@njit
+def propagationFlux(dataMNT, directionsEcoulement, noDataValue, entreesX, entreesY, entreesV, cellDrainees):
+    #Ajoute à cellDrainees les flux entreesV reçus par les cellules (entreesX, entreesY) et tout ce qu'ils drainent vers l'aval
+    #Seules les cellules en aval des entrées sont visitées, dans l'ordre de Kahn restreint à cette zone (degré : nbr de donneurs
+    #dans la zone) : chaque cellule est traitée une seule fois, après tous ses apports, y compris sur un plat résolu où
+    #récepteur et donneur ont la même altitude
+    #Retourne le nbr de cellules visitées
+    dimx, dimy = dataMNT.shape
+    premier = directionsEcoulement.shape[2] - 8
+    indice = dict()
+    aval = [np.int64(0) for _ in range(0)]
+    for k in range(entreesX.shape[0]):
+        c = np.int64(entreesX[k]) * dimy + entreesY[k]
+        if c not in indice:
+            indice[c] = len(aval)
+            aval.append(c)
+    k = 0
+    while k < len(aval):
+        c = aval[k]
+        k += 1
+        x = c // dimy
+        y = c % dimy
+        for i in range(1, 9):
+            if directionsEcoulement[x, y, i - 1 + premier] == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            r = xv * dimy + yv
+            if r not in indice:
+                indice[r] = len(aval)
+                aval.append(r)
+
+    n = len(aval)
+    degres = np.zeros(n, dtype=np.int64)
+    apports = np.zeros(n, dtype=np.float64)
+    for k in range(entreesX.shape[0]):
+        apports[indice[np.int64(entreesX[k]) * dimy + entreesY[k]]] += entreesV[k]
+    for k in range(n):
+        x = aval[k] // dimy
+        y = aval[k] % dimy
+        for i in range(1, 9):
+            if directionsEcoulement[x, y, i - 1 + premier] == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            degres[indice[xv * dimy + yv]] += 1
+    file = [np.int64(0) for _ in range(0)]
+    for k in range(n):
+        if degres[k] == 0:
+            file.append(k)
+    debut = 0
+    while debut < len(file):
+        k = file[debut]
+        debut += 1
+        x = aval[k] // dimy
+        y = aval[k] % dimy
+        cellDrainees[x, y] += apports[k]
+        total = sommePoids(directionsEcoulement, x, y, premier)
+        for i in range(1, 9):
+            pourcentage = directionsEcoulement[x, y, i - 1 + premier]
+            if pourcentage == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            r = indice[xv * dimy + yv]
+            apports[r] += apports[k] * pourcentage / total
+            degres[r] -= 1
+            if degres[r] == 0:
+                file.append(r)
+    return debut
+
+
+def accumulationParTuiles(dataMNT, directionsEcoulement, noDataValue, cellDrainees, tailleTuile=1024, nbrThreads=None):
+    #Même résultat que accumulationTopologique (aux arrondis de sommation près), dataMNT étant le MNT comblé des directions :
+    #1. accumulation locale de chaque tuile en parallèle, les flux sortant vers les tuiles voisines étant mis de côté ;
+    #2. les flux aux frontières sont propagés vers l'aval en une seule passe (propagationFlux), qui ne visite que les cellules
+    #   en aval d'une frontière et corrige leur aire drainée. Un écoulement peut traverser plusieurs fois la même frontière
+    #   (écoulements divergents le long d'une frontière) : une propagation tuile par tuile demanderait autant d'échanges.
+    #Retourne le nbr de cellules corrigées à l'étape 2
+    dim1, dim2 = dataMNT.shape
+
+    def locale(tuile):
+        (l0, l1, c0, c1), (hl0, hl1, hc0, hc1) = tuile
+        fenetre = (slice(hl0, hl1), slice(hc0, hc1))
+        locales = np.zeros((hl1 - hl0, hc1 - hc0), dtype=np.float64)
+        sorties = np.zeros_like(locales)
+        accumulationLocale(dataMNT[fenetre], directionsEcoulement[fenetre], noDataValue, locales, sorties,
+                           l0 - hl0, l1 - hl0, c0 - hc0, c1 - hc0)
+        cellDrainees[l0:l1, c0:c1] = locales[l0 - hl0:l1 - hl0, c0 - hc0:c1 - hc0] #zones utiles disjointes : pas de conflit entre threads
+        x, y = np.nonzero(sorties)
+        return x + hl0, y + hc0, sorties[x, y]
+
+    with ThreadPoolExecutor(max_workers=nbrThreads) as pool:
+        flux = list(pool.map(locale, fenetres(dim1, dim2, tailleTuile)))
+    x = np.concatenate([f[0] for f in flux])
+    y = np.concatenate([f[1] for f in flux])
+    v = np.concatenate([f[2] for f in flux])
+    return propagationFlux(dataMNT, directionsEcoulement, noDataValue, x, y, v, cellDrainees)
+
+
+def bilanMasse(dataMNT, directionsEcoulement, noDataValue, cellDrainees):
+    #Contrôle de conservation : (aire totale sortant aux cellules valides sans récepteur, nbr de cellules valides), égales aux
+    #arrondis de sommation près ; directionsEcoulement : cube, tableau compact ou triplet CSR
+    valides = dataMNT != noDataValue
+    if isinstance(directionsEcoulement, tuple):
+        offsets = directionsEcoulement[0]
+        sansRecepteur = (offsets[1:] == offsets[:-1]).reshape(dataMNT.shape)
+    else:
+        sansRecepteur = ~directionsEcoulement[:, :, directionsEcoulement.shape[2] - 8:].any(axis=2)
+    return float(cellDrainees[valides & sansRecepteur].sum(dtype=np.float64)), int(valides.sum())
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Générateur de bruit à compteur pour le bruitage du MNT
+
+Le bruit d'une cellule est une fonction de hachage de (graine, réalisation,
+x, y) : il ne dépend ni de la géométrie de lancement (tpb, bpg), ni du
+découpage en tuiles, ni du moteur (CPU ou GPU), et deux cellules voisines
+reçoivent des valeurs indépendantes. Une réalisation peut ainsi être
+recalculée seule, sur une seule tuile.
+
+Hachage : finaliseur splitmix64, appliqué successivement à chaque composante.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+from numba import cuda, njit
+
+GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+MULT1 = np.uint64(0xBF58476D1CE4E5B9)
+MULT2 = np.uint64(0x94D049BB133111EB)
+
+
+def _generateur(jit):
+    #Compile les fonctions du générateur pour une cible : njit (CPU) ou cuda.jit(device=True) (GPU)
+    @jit
+    def melange(z):
+        z = (z ^ (z >> np.uint64(30))) * MULT1
+        z = (z ^ (z >> np.uint64(27))) * MULT2
+        return z ^ (z >> np.uint64(31))
+
+    @jit
+    def uniforme(seed, realisation, x, y, flux):
+        #Tirage uniforme float32 dans [0, 1) pour la cellule (x, y) ; flux distingue plusieurs tirages d'une même cellule
+        h = melange(np.uint64(seed) + GOLDEN)
+        h = melange(h ^ (np.uint64(realisation) + GOLDEN))
+        h = melange(h ^ (np.uint64(x) + GOLDEN))
+        h = melange(h ^ (np.uint64(y) + GOLDEN))
+        h = melange(h ^ (np.uint64(flux) + GOLDEN))
+        return np.float32(h >> np.uint64(40)) * np.float32(1.0 / 16777216.0)
+
+    @jit
+    def bruitCellule(seed, realisation, x, y, amplitudeBruit):
+        #Même loi que myk_bruitageMNT (somme de deux uniformes, entre -amplitudeBruit et +amplitudeBruit)
+        u1 = uniforme(seed, realisation, x, y, 0)
+        u2 = uniforme(seed, realisation, x, y, 1)
+        return int(amplitudeBruit * (u1 + u2) - amplitudeBruit)
+
+    return melange, uniforme, bruitCellule
+
+
+melange, uniforme, bruitCellule = _generateur(njit)
+melangeDevice, uniformeDevice, bruitCelluleDevice = _generateur(cuda.jit(device=True))
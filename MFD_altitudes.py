@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Codage des altitudes du MNT à précision configurable
+
+Les scripts convertissaient le MNT en centimètres entiers de trois façons
+(uint32 dans MFD_v3.py, uint16 dans MFD_v2.py qui déborde au-dessus de 655 m,
+np.int avec un voisinage int8 dans MFD.py) et repéraient les cellules valides
+par le test "> 0". Ici :
+- un Codage décrit le type entier (uint16, int32 ou uint32), l'échelle
+  (unités par mètre) et le décalage (altitude en m de la valeur 0) :
+  valeur = (altitude - decalage) * echelle ;
+- codageMNT choisit le plus petit type entier sûr pour l'étendue du MNT, en
+  gardant une marge pour le bruitage et le comblement, et en plaçant les
+  cellules valides au-dessus de 0 (les noyaux testent toujours "> 0") ;
+- convertirBande convertit la bande GDAL par blocs de lignes (pas de tableau
+  temporaire h_mnt * 100 de la taille du MNT) et, sur demande, remplit un
+  masque de validité séparé.
+
+Le codage CODAGE_CM reproduit la conversion de MFD_v3.py (cm, uint32,
+NoData = 4284967396). Les noyaux de calcul travaillent en uint32 avec ce
+NoData, quel que soit le codage : le type compact (uint16, int32) ne réduit
+que le stockage (fichiers, transferts). Pour le calcul, lireMNT(travail=True)
+code directement dans le tableau de travail uint32 avec l'échelle et le
+décalage choisis (Codage.travail), sans copie compacte intermédiaire ;
+versTravail élargit un MNT déjà codé sur un type compact (sans débordement
+possible, l'étendue codée tenant dans un int32). Le masque de validité n'est
+utile qu'au mode masqué de MFD_v3.py (tailleBlocMasque) : ailleurs, la
+validité est portée par la valeur NoData. Les paramètres exprimés en cm dans
+MFD_v3.py (amplitudeBruit, epsilonComblement) sont en unités du codage, soit
+1 / echelle mètre.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+from osgeo import gdal
+
+#NoData des tableaux de travail des noyaux (uint32, lu comme un entier négatif dans le voisinage int32)
+NODATA_TRAVAIL = 4284967396
+#Types entiers candidats, du plus petit au plus grand, et valeur NoData réservée (maximum du type)
+TYPES_ENTIERS = [np.uint16, np.int32]
+
+
+class Codage:
+    """Codage des altitudes : valeur = (altitude - decalage) * echelle, noData réservé aux cellules invalides"""
+    def __init__(self, typeAltitudes, echelle=100, decalage=0.0, noData=None):
+        self.type = np.dtype(typeAltitudes)
+        if self.type.kind not in "ui":
+            raise ValueError("Les altitudes sont codées sur un type entier : " + self.type.name)
+        self.echelle = echelle
+        self.decalage = decalage
+        if noData is None:
+            noData = np.iinfo(self.type).max
+        self.noData = noData
+
+    def __repr__(self):
+        return "Codage(%s, echelle=%g, decalage=%g, noData=%s)" % (self.type.name, self.echelle, self.decalage, self.noData)
+
+    def encoder(self, altitudes, valide, sortie):
+        #altitudes (m) -> sortie, sans autre tableau intermédiaire que le bloc lu
+        if self.decalage == 0 and self.echelle == 100:
+            #Même conversion que np.ascontiguousarray(h_mnt * 100, dtype=np.uint32) (MFD_tuiles.metresVersCm), troncature comprise
+            np.copyto(sortie, (altitudes * 100).astype(np.int64), casting="unsafe")
+        else:
+            altitudes = altitudes.astype(np.float64)
+            altitudes -= self.decalage
+            altitudes *= self.echelle
+            np.copyto(sortie, np.rint(altitudes, out=altitudes), casting="unsafe")
+        sortie[~valide] = self.noData
+        return sortie
+
+    def metres(self, valeurs, valide=None, noData=np.nan):
+        #Décodage en mètres (float32) ; cellules invalides (masque, ou valeur noData du codage) -> noData
+        if valide is None:
+            valide = valeurs != self.noData
+        altitudes = np.asarray(valeurs, dtype=np.float32) / np.float32(self.echelle) + np.float32(self.decalage)
+        altitudes[~valide] = noData
+        return altitudes
+
+    def unites(self, metres):
+        #Conversion d'une distance verticale en unités du codage (amplitude du bruit, epsilon de comblement...)
+        return int(round(metres * self.echelle))
+
+    def travail(self):
+        #Même échelle et même décalage sur le tableau de travail des noyaux (uint32, NoData = NODATA_TRAVAIL)
+        if self.type == np.uint32 and self.noData == NODATA_TRAVAIL:
+            return self
+        return Codage(np.uint32, self.echelle, self.decalage, NODATA_TRAVAIL)
+
+
+CODAGE_CM = Codage(np.uint32, 100, 0.0, NODATA_TRAVAIL)
+
+
+def codageMNT(mini, maxi, precision=0.01, typeAltitudes="auto", marge=1000):
+    #Codage de l'étendue [mini, maxi] (m) à precision (m) près ; marge : unités réservées de part et d'autre (bruit, comblement)
+    #typeAltitudes : "auto" (plus petit type entier sûr), "uint16", "int32" ou "cm" (CODAGE_CM)
+    if typeAltitudes == "cm":
+        return CODAGE_CM
+    echelle = 1 / precision
+    decalage = mini - (marge + 1) / echelle #valeur minimale marge + 1 : valide (> 0) même après bruitage
+    etendue = int(np.ceil((maxi - mini) * echelle)) + 2 * marge + 2
+    types = TYPES_ENTIERS if typeAltitudes == "auto" else [np.dtype(typeAltitudes).type]
+    if np.dtype(types[0]).kind not in "ui":
+        raise ValueError("Les noyaux de calcul travaillent sur des altitudes entières : typeAltitudes " + typeAltitudes)
+    for t in types:
+        if etendue < np.iinfo(t).max:
+            return Codage(t, echelle, decalage)
+    raise ValueError("Etendue du MNT (%g m à %g m) trop grande pour le type %s à %g m près" % (mini, maxi, typeAltitudes, precision))
+
+
+def convertirBande(bande, codage, sortie=None, valide=None, nbrLignesBloc=1024, masque=True):
+    #Lecture et codage de la bande par blocs de lignes ; retourne (altitudes codées, masque de validité ou None si not masque)
+    dim1, dim2 = bande.YSize, bande.XSize
+    NDV = bande.GetNoDataValue()
+    if sortie is None:
+        sortie = np.empty((dim1, dim2), dtype=codage.type)
+    if valide is None and masque:
+        valide = np.empty((dim1, dim2), dtype=np.bool_)
+    for l0 in range(0, dim1, nbrLignesBloc):
+        l1 = min(l0 + nbrLignesBloc, dim1)
+        bloc = bande.ReadAsArray(0, l0, dim2, l1 - l0)
+        valideBloc = ~np.isnan(bloc) if bloc.dtype.kind == "f" else np.ones(bloc.shape, dtype=np.bool_)
+        if NDV is not None:
+            valideBloc &= bloc != NDV
+        if valide is not None:
+            valide[l0:l1] = valideBloc
+        codage.encoder(bloc, valideBloc, sortie[l0:l1])
+    return sortie, valide
+
+
+def lireMNT(fichier, precision=0.01, typeAltitudes="auto", marge=1000, nbrLignesBloc=1024, travail=False, masque=True):
+    #Retourne (dataset GDAL, altitudes codées, masque de validité, Codage) ; l'étendue est lue dans les statistiques GDAL (NoData exclu)
+    #travail : codage directement dans le tableau de travail uint32 des noyaux (Codage.travail) ; masque : False, masque non conservé (None)
+    fichier_mnt = gdal.Open(fichier)
+    if fichier_mnt is None:
+        raise IOError("Ouverture impossible : " + fichier)
+    bande = fichier_mnt.GetRasterBand(1)
+    mini, maxi = (0.0, 0.0) if typeAltitudes == "cm" else bande.ComputeRasterMinMax(False)
+    codage = codageMNT(mini, maxi, precision, typeAltitudes, marge)
+    if travail:
+        codage = codage.travail()
+    mnt, valide = convertirBande(bande, codage, nbrLignesBloc=nbrLignesBloc, masque=masque)
+    return fichier_mnt, mnt, valide, codage
+
+
+def versTravail(mnt, codage, sortie=None, nbrLignesBloc=1024):
+    #Tableau de travail uint32 des noyaux (NoData = NODATA_TRAVAIL) à partir d'altitudes codées sur un type entier, par blocs de lignes
+    if sortie is None:
+        sortie = np.empty(mnt.shape, dtype=np.uint32)
+    for l0 in range(0, mnt.shape[0], nbrLignesBloc):
+        bloc = mnt[l0:l0 + nbrLignesBloc]
+        np.copyto(sortie[l0:l0 + nbrLignesBloc], bloc, casting="unsafe")
+        sortie[l0:l0 + nbrLignesBloc][bloc == codage.noData] = NODATA_TRAVAIL
+    return sortie
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Délimitation des bassins versants d'exutoires multiples (ouvrages, parcelles, drains)
+
+- index des donneurs calculé une fois à partir des directions d'écoulement :
+  1 octet par cellule, bit i - 1 à 1 si le voisin i envoie une part de son
+  écoulement vers la cellule (les pourcentages restent lus dans les
+  directions) ;
+- requêtes par lots de 64 exutoires : une seule remontée depuis tous les
+  exutoires du lot parcourt la réunion de leurs bassins, puis les exutoires
+  atteints par chaque cellule (bits d'un uint64) sont propagés de l'aval
+  vers l'amont dans l'ordre topologique ; chaque cellule est parcourue une
+  fois par lot, quel que soit le nbr d'exutoires emboîtés qui la drainent
+  (en MFD, les bassins emboîtés ou voisins se recouvrent largement) ;
+- deux critères : seuil de contribution (pourcentage minimal envoyé vers
+  l'aval pour qu'une cellule soit retenue, 1 : toute contribution) ou
+  fractions MFD (part de l'écoulement de chaque cellule qui atteint
+  l'exutoire, calculée dans l'ordre topologique sur le bassin seul) ;
+- sorties : cellules, masque ou polygones GeoPackage (gdal.Polygonize sur
+  l'emprise du bassin).
+
+Les exutoires sont donnés en (ligne, colonne) ; les bassins sont identifiés
+par leur rang dans la liste des exutoires.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import os
+import numpy as np
+from numba import njit, prange
+from osgeo import gdal, ogr, osr
+from MFD_directions import echellePoids
+from MFD_voisinage import DX, DY
+
+
+@njit(parallel=True)
+def indexDonneurs(directionsEcoulement, donneurs):
+    #donneurs[x, y] : bit i - 1 à 1 si le voisin i de (x, y) lui envoie une part de son écoulement (direction opposée non nulle)
+    #directionsEcoulement : cube (dimx, dimy, 9) ou format compact (dimx, dimy, 8) de MFD_directions
+    dimx, dimy = donneurs.shape
+    premier = directionsEcoulement.shape[2] - 8
+    for x in prange(dimx):
+        for y in range(dimy):
+            bits = 0
+            for i in range(1, 9):
+                xv = x + DX[i]
+                yv = y + DY[i]
+                indice = i + 4 if i <= 4 else i - 4
+                if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and directionsEcoulement[xv, yv, indice - 1 + premier] > 0:
+                    bits |= 1 << (i - 1)
+            donneurs[x, y] = bits
+
+
+@njit
+def regionsAmont(donneurs, directionsEcoulement, exutoires, seuil, rang, pile):
+    #Remontée commune depuis au plus 64 exutoires (indices x * dimy + y) par les liaisons d'au moins seuil % : cellules du lot
+    #de bassins, puis bits[j] = exutoires atteints par cellules[j] (bit k : exutoire k), propagés de l'aval vers l'amont (Kahn)
+    #rang : tableau aplati (dimx * dimy) à -1, rang de chaque cellule vue dans pile, remis à -1 en sortie
+    dimx, dimy = donneurs.shape
+    premier = directionsEcoulement.shape[2] - 8
+    n = 0
+    for k in range(exutoires.shape[0]):
+        if rang[exutoires[k]] < 0:
+            rang[exutoires[k]] = n
+            pile[n] = exutoires[k]
+            n += 1
+    debut = 0
+    while debut < n:
+        c = pile[debut]
+        debut += 1
+        x = c // dimy
+        y = c % dimy
+        bits = donneurs[x, y]
+        for i in range(1, 9):
+            if (bits >> (i - 1)) & 1 == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            indice = i + 4 if i <= 4 else i - 4
+            if rang[xv * dimy + yv] >= 0 or directionsEcoulement[xv, yv, indice - 1 + premier] < seuil:
+                continue
+            rang[xv * dimy + yv] = n
+            pile[n] = xv * dimy + yv
+            n += 1
+    cellules = pile[:n].copy()
+
+    atteints = np.zeros(n, dtype=np.uint64)
+    for k in range(exutoires.shape[0]):
+        atteints[rang[exutoires[k]]] |= np.uint64(1) << np.uint64(k)
+    restants = np.zeros(n, dtype=np.int32)
+    for j in range(n):
+        x = cellules[j] // dimy
+        y = cellules[j] % dimy
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and directionsEcoulement[x, y, i - 1 + premier] >= seuil and rang[xv * dimy + yv] >= 0:
+                restants[j] += 1
+    file = np.empty(n, dtype=np.int64)
+    fin = 0
+    for j in range(n):
+        if restants[j] == 0:
+            file[fin] = j
+            fin += 1
+    debut = 0
+    while debut < fin:
+        j = file[debut]
+        debut += 1
+        x = cellules[j] // dimy
+        y = cellules[j] % dimy
+        bits = donneurs[x, y]
+        for i in range(1, 9):
+            if (bits >> (i - 1)) & 1 == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            indice = i + 4 if i <= 4 else i - 4
+            d = rang[xv * dimy + yv]
+            if d < 0 or directionsEcoulement[xv, yv, indice - 1 + premier] < seuil:
+                continue
+            atteints[d] |= atteints[j]
+            restants[d] -= 1
+            if restants[d] == 0:
+                file[fin] = d
+                fin += 1
+    for j in range(n):
+        rang[cellules[j]] = -1
+    return cellules, atteints
+
+
+@njit
+def fractionsAmont(donneurs, directionsEcoulement, cellules, exutoire, rang):
+    #Part de l'écoulement de chaque cellule du bassin (indices x * dimy + y, bassin complet de seuil 1) qui atteint l'exutoire
+    #Ordre topologique de l'aval vers l'amont : une cellule est traitée quand tous ses récepteurs du bassin l'ont été
+    #rang : comme pour regionsAmont
+    dimx, dimy = donneurs.shape
+    premier = directionsEcoulement.shape[2] - 8
+    n = cellules.shape[0]
+    for j in range(n):
+        rang[cellules[j]] = j
+    restants = np.zeros(n, dtype=np.int32)
+    for j in range(n):
+        x = cellules[j] // dimy
+        y = cellules[j] % dimy
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if directionsEcoulement[x, y, i - 1 + premier] == 0 or xv < 0 or yv < 0 or xv >= dimx or yv >= dimy:
+                continue
+            if rang[xv * dimy + yv] >= 0:
+                restants[j] += 1
+    fractions = np.zeros(n, dtype=np.float64)
+    j0 = rang[exutoire]
+    fractions[j0] = 1
+    file = np.empty(n, dtype=np.int64)
+    file[0] = j0
+    fin = 1
+    debut = 0
+    while debut < fin:
+        j = file[debut]
+        debut += 1
+        x = cellules[j] // dimy
+        y = cellules[j] % dimy
+        bits = donneurs[x, y]
+        for i in range(1, 9):
+            if (bits >> (i - 1)) & 1 == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            k = rang[xv * dimy + yv]
+            if k < 0:
+                continue
+            total = 0
+            for l in range(8):
+                total += directionsEcoulement[xv, yv, l + premier]
+            indice = i + 4 if i <= 4 else i - 4
+            fractions[k] += fractions[j] * directionsEcoulement[xv, yv, indice - 1 + premier] / total
+            restants[k] -= 1
+            if restants[k] == 0:
+                file[fin] = k
+                fin += 1
+    for j in range(n):
+        rang[cellules[j]] = -1
+    return fractions
+
+
+#Nbr d'exutoires traités par remontée commune (bits d'un uint64)
+TAILLE_LOT = 64
+
+
+class Delimitation:
+    """Bassins versants d'exutoires multiples sur une grille de directions d'écoulement (cube ou format compact)"""
+    def __init__(self, directionsEcoulement):
+        self.directions = directionsEcoulement
+        self.forme = directionsEcoulement.shape[:2]
+        self.donneurs = np.empty(self.forme, dtype=np.uint8)
+        indexDonneurs(directionsEcoulement, self.donneurs)
+        #Tableaux de travail réutilisés d'une requête à l'autre (rang remis à -1 après chaque remontée)
+        self.rang = np.full(self.forme[0] * self.forme[1], -1, dtype=np.int64)
+        self.pile = np.empty(self.forme[0] * self.forme[1], dtype=np.int64)
+
+    def bassins(self, exutoires, seuil=1):
+        #exutoires : (ligne, colonne) par exutoire ; seuil : pourcentage minimal envoyé vers l'aval (1 : toute contribution), quel
+        #que soit le type des poids des directions (MFD_directions.TYPES_POIDS)
+        #Une remontée par lot de TAILLE_LOT exutoires ; retourne un dictionnaire : lots (cellules de la réunion des bassins
+        #du lot et bits des exutoires atteints par chacune), exutoires (indices x * dimy + y), seuil
+        exutoires = np.asarray(exutoires, dtype=np.int64).reshape(-1, 2)
+        exutoires = exutoires[:, 0] * self.forme[1] + exutoires[:, 1]
+        seuilPoids = seuil * echellePoids(self.directions.dtype) / 100 if seuil > 1 else np.finfo(np.float32).tiny
+        lots = []
+        for k in range(0, exutoires.shape[0], TAILLE_LOT):
+            lots.append(regionsAmont(self.donneurs, self.directions, exutoires[k:k + TAILLE_LOT], seuilPoids, self.rang, self.pile))
+        return {"lots": lots, "exutoires": exutoires, "seuil": seuil}
+
+    def cellules(self, bassins, k):
+        #Cellules (indices x * dimy + y, de l'aval vers l'amont) du bassin de l'exutoire k
+        cellules, atteints = bassins["lots"][k // TAILLE_LOT]
+        return cellules[(atteints >> np.uint64(k % TAILLE_LOT)) & np.uint64(1) == 1]
+
+    def fractions(self, bassins, k):
+        #(cellules, fractions) : part de l'écoulement de chaque cellule du bassin k qui atteint l'exutoire (bassins de seuil 1)
+        if bassins["seuil"] > 1:
+            raise ValueError("Les fractions MFD demandent le bassin complet (seuil 1) : seuil %d" % bassins["seuil"])
+        cellules = self.cellules(bassins, k)
+        return cellules, fractionsAmont(self.donneurs, self.directions, cellules, bassins["exutoires"][k], self.rang).astype(np.float32)
+
+    def masque(self, bassins, k, fractionMin=None):
+        #Masque booléen du bassin k ; fractionMin : cellules dont au moins cette part de l'écoulement atteint l'exutoire
+        if fractionMin is None:
+            cellules = self.cellules(bassins, k)
+        else:
+            cellules, fractions = self.fractions(bassins, k)
+            cellules = cellules[fractions >= fractionMin]
+        masque = np.zeros(self.forme, dtype=np.bool_)
+        masque.reshape(-1)[cellules] = True
+        return masque
+
+
+def ecrireBassins(fichier, fichier_mnt, delimitation, bassins, fractionMin=None, nomCouche="bassins"):
+    #Polygones des bassins en GeoPackage (champ exutoire : rang dans la liste des exutoires), vectorisés sur l'emprise de chaque bassin
+    dimy = delimitation.forme[1]
+    gt = fichier_mnt.GetGeoTransform()
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(fichier):
+        driver.DeleteDataSource(fichier)
+    source = driver.CreateDataSource(fichier)
+    srs = None
+    if fichier_mnt.GetProjection():
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(fichier_mnt.GetProjection())
+    couche = source.CreateLayer(nomCouche, srs, ogr.wkbPolygon)
+    couche.CreateField(ogr.FieldDefn("exutoire", ogr.OFTInteger64))
+    memoire = gdal.GetDriverByName("MEM")
+    couche.StartTransaction()
+    for k in range(bassins["exutoires"].shape[0]):
+        if fractionMin is None:
+            cellules = delimitation.cellules(bassins, k)
+        else:
+            cellules, fractions = delimitation.fractions(bassins, k)
+            cellules = cellules[fractions >= fractionMin]
+        lignes, colonnes = cellules // dimy, cellules % dimy
+        l0, c0 = lignes.min(), colonnes.min()
+        hauteur, largeur = lignes.max() - l0 + 1, colonnes.max() - c0 + 1
+        valeurs = memoire.Create("", int(largeur), int(hauteur), 1, gdal.GDT_Int32)
+        masque = memoire.Create("", int(largeur), int(hauteur), 1, gdal.GDT_Byte)
+        for d in (valeurs, masque):
+            d.SetGeoTransform((gt[0] + c0 * gt[1] + l0 * gt[2], gt[1], gt[2], gt[3] + c0 * gt[4] + l0 * gt[5], gt[4], gt[5]))
+        valeurs.GetRasterBand(1).Fill(k)
+        tuile = np.zeros((hauteur, largeur), dtype=np.uint8)
+        tuile[lignes - l0, colonnes - c0] = 1
+        masque.GetRasterBand(1).WriteArray(tuile)
+        gdal.Polygonize(valeurs.GetRasterBand(1), masque.GetRasterBand(1), couche, 0, ["8CONNECTED=8"])
+    couche.CommitTransaction()
+    source = None
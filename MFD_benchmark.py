@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Banc d'essai des étapes du calcul sur MNT synthétiques (CPU uniquement)
+
+Terrains générés, de taille et de difficulté contrôlées (altitudes en cm,
+uint32, NoData = 4284967396 comme dans MFD_v3.py) :
+- plan : plan incliné, sans dépression ;
+- cuvettes : cuvettes imbriquées (anneaux concentriques de profondeur croissante) ;
+- fractal : relief fractal (somme d'octaves de bruit interpolé) ;
+- plat : grandes zones parfaitement plates ;
+- trous : relief fractal percé de trous de NoData.
+
+Chaque étape (myk_comblementDepressions, crete, cretesVectorisees,
+myk_directionsEcoulement, myk_cellulesDrainees, accumulationTopologique) est chronométrée pour chaque
+taille et chaque terrain ; le rapport donne le débit en cellules par seconde
+et l'efficacité du passage à l'échelle par rapport à la plus petite taille.
+Avec --reference, le script échoue si un débit baisse de plus de --tolerance
+par rapport à un rapport JSON précédent (contrôle des régressions).
+
+Exemple : python MFD_benchmark.py --tailles 1000 2000 5000 --rapport bench
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from numba import njit, prange
+import MFD_cpu
+import MFD_accumulation
+import MFD_cretes
+import MFD_directions
+import MFD_profil
+from MFD_voisinage import voisins
+
+NODATA = 4284967396
+TERRAINS = ["plan", "cuvettes", "fractal", "plat", "trous"]
+ETAPES = ["depressions", "crete", "cretesTable", "directions", "cellulesDrainees", "accumulation"]
+
+
+def planIncline(n, pente=(3, 2), base=10000):
+    x, y = np.ogrid[0:n, 0:n]
+    return (base + pente[0] * x + pente[1] * y).astype(np.uint32)
+
+
+def cuvettesImbriquees(n, nbrAnneaux=8, profondeur=200, base=100000):
+    #Anneaux concentriques alternativement en creux et en crête : chaque cuvette en contient une autre
+    x, y = np.ogrid[0:n, 0:n]
+    r = np.hypot(x - n / 2, y - n / 2) / (n / 2)
+    anneau = np.floor(r * nbrAnneaux)
+    relief = base + profondeur * anneau + (profondeur // 2) * np.cos(np.pi * r * nbrAnneaux * 2)
+    return relief.astype(np.uint32)
+
+
+def terrainFractal(n, seed=1, octaves=7, rugosite=0.55, amplitude=50000, base=100000):
+    #Somme d'octaves de bruit aléatoire interpolé (bilinéaire), fréquence doublée et amplitude multipliée par rugosite à chaque octave
+    rng = np.random.default_rng(seed)
+    relief = np.zeros((n, n), dtype=np.float32)
+    a = float(amplitude)
+    for o in range(octaves):
+        m = 2 ** (o + 1) + 1
+        grille = rng.random((m, m), dtype=np.float32)
+        t = np.linspace(0, m - 1, n, dtype=np.float32)
+        i = np.minimum(t.astype(np.int64), m - 2)
+        f = t - i
+        lignes = grille[i] * (1 - f)[:, None] + grille[i + 1] * f[:, None]
+        relief += a * (lignes[:, i] * (1 - f)[None, :] + lignes[:, i + 1] * f[None, :])
+        a *= rugosite
+    return (base + relief).astype(np.uint32)
+
+
+def zonesPlates(n, tailleZone=None, base=10000):
+    #Terrasses : marches de tailleZone x tailleZone cellules d'altitude constante
+    tailleZone = tailleZone or max(n // 8, 2)
+    x, y = np.ogrid[0:n, 0:n]
+    return (base + 100 * (x // tailleZone) + 50 * (y // tailleZone)).astype(np.uint32)
+
+
+def trousNoData(mnt, fraction=0.05, rayon=None, seed=1):
+    #Perce des disques de NoData jusqu'à couvrir environ fraction du MNT
+    n = mnt.shape[0]
+    rayon = rayon or max(n // 50, 2)
+    rng = np.random.default_rng(seed)
+    nbrTrous = max(int(fraction * n * n / (np.pi * rayon * rayon)), 1)
+    for cx, cy in rng.integers(0, n, (nbrTrous, 2)):
+        x0, x1, y0, y1 = max(cx - rayon, 0), min(cx + rayon, n), max(cy - rayon, 0), min(cy + rayon, n)
+        x, y = np.ogrid[x0:x1, y0:y1]
+        mnt[x0:x1, y0:y1][(x - cx) ** 2 + (y - cy) ** 2 <= rayon * rayon] = NODATA
+    return mnt
+
+
+def genererMNT(terrain, n, seed=1):
+    if terrain == "plan":
+        return planIncline(n)
+    if terrain == "cuvettes":
+        return cuvettesImbriquees(n)
+    if terrain == "fractal":
+        return terrainFractal(n, seed)
+    if terrain == "plat":
+        return zonesPlates(n)
+    if terrain == "trous":
+        return trousNoData(terrainFractal(n, seed), seed=seed)
+    raise ValueError("Terrain inconnu : " + terrain)
+
+
+@njit(parallel=True)
+def cretes(dataMNT, mnt_alt_cretes):
+    #crete seule, hors de myk_comblementDepressions
+    dimx, dimy = dataMNT.shape
+    for pos_x in prange(dimx):
+        voisinage = np.zeros(10, dtype=np.int32)
+        voisinage_tourne = np.zeros(10, dtype=np.int32)
+        for pos_y in range(dimy):
+            voisins(dataMNT, pos_x, pos_y, dimx, dimy, voisinage)
+            mnt_alt_cretes[pos_x, pos_y] = MFD_cpu.crete(voisinage, voisinage_tourne)
+
+
+def _etapes(mnt):
+    #Tableaux de travail alloués une fois, puis une fonction sans argument par étape
+    dimx, dimy = mnt.shape
+    filled = np.empty_like(mnt)
+    codes = np.zeros_like(mnt)
+    ind = np.empty_like(mnt)
+    indTot = np.empty_like(mnt)
+    altCretes = np.empty_like(mnt)
+    motifs = np.empty(mnt.shape, dtype=np.uint8)
+    traitees = np.empty(mnt.shape, dtype=np.bool_)
+    directions = MFD_directions.directionsCompactes(dimx, dimy)
+    cellDrainees = np.zeros(mnt.shape, dtype=np.float64)
+    MFD_cpu.myk_directionsEcoulement(mnt.copy(), directions, 27108)
+    #myk_directionsEcoulement réécrit le MNT (27108 -> 99999) et myk_cellulesDrainees lit le cube à 9 cases : copies propres à ces étapes
+    mntDirections = mnt.copy()
+    mntCellules = mnt.copy()
+    cube = np.zeros((dimx, dimy, 9), dtype=np.uint8)
+    MFD_cpu.myk_directionsEcoulement(mnt.copy(), cube, 27108)
+    return {"depressions": lambda: MFD_cpu.myk_comblementDepressions(mnt, filled, codes, NODATA, ind, indTot, altCretes, traitees),
+            "crete": lambda: cretes(mnt, altCretes),
+            "cretesTable": lambda: MFD_cretes.cretesVectorisees(mnt, altCretes.view(np.int32), motifs),
+            "directions": lambda: MFD_cpu.myk_directionsEcoulement(mntDirections, directions, 27108),
+            "cellulesDrainees": lambda: MFD_cpu.myk_cellulesDrainees(mntCellules, cube, NODATA, cellDrainees, traitees),
+            "accumulation": lambda: MFD_accumulation.accumulationTopologique(mnt, directions, NODATA, cellDrainees)}
+
+
+def benchmark(tailles, terrains=TERRAINS, etapes=ETAPES, repetitions=3, seed=1):
+    #Retourne un Profil : une mesure par (terrain, étape, taille), meilleur temps sur repetitions
+    for fonction in _etapes(genererMNT("fractal", 64, seed)).values():
+        fonction() #compilation JIT hors mesure
+    profil = MFD_profil.Profil()
+    for n in tailles:
+        for terrain in terrains:
+            mnt = genererMNT(terrain, n, seed)
+            fonctions = _etapes(mnt)
+            for etape in etapes:
+                meilleur = None
+                for r in range(repetitions):
+                    t0 = time.perf_counter()
+                    fonctions[etape]()
+                    duree = time.perf_counter() - t0
+                    meilleur = duree if meilleur is None else min(meilleur, duree)
+                profil.mesures.append({"etape": terrain + ":" + etape, "iteration": n, "debut": 0.0, "duree": meilleur,
+                                       "octets": int(mnt.nbytes), "cellules": n * n,
+                                       "cellulesParSeconde": n * n / meilleur, "octetsParSeconde": mnt.nbytes / meilleur})
+                print("...%-9s %-17s %6d^2 : %8.3f s, %8.2f Mcellules/s" % (terrain, etape, n, meilleur, n * n / meilleur / 1e6))
+            del mnt, fonctions
+    return profil
+
+
+def passageEchelle(profil):
+    #Efficacité par rapport à la plus petite taille : débit(n) / débit(n min), 1 = passage à l'échelle linéaire
+    courbes = {}
+    for m in profil.mesures:
+        courbes.setdefault(m["etape"], []).append((m["iteration"], m["cellulesParSeconde"]))
+    for etape, points in courbes.items():
+        points.sort()
+        courbes[etape] = [(n, debit, debit / points[0][1]) for n, debit in points]
+    return courbes
+
+
+def regressions(profil, fichierReference, tolerance=0.1):
+    #Liste des (étape, taille, débit de référence, débit mesuré) en baisse de plus de tolerance
+    with open(fichierReference) as f:
+        reference = {(m["etape"], m["iteration"]): m["cellulesParSeconde"] for m in json.load(f)["mesures"]}
+    return [(m["etape"], m["iteration"], reference[(m["etape"], m["iteration"])], m["cellulesParSeconde"])
+            for m in profil.mesures
+            if (m["etape"], m["iteration"]) in reference and m["cellulesParSeconde"] < (1 - tolerance) * reference[(m["etape"], m["iteration"])]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Banc d'essai CPU des étapes MFD sur MNT synthétiques")
+    parser.add_argument("--tailles", type=int, nargs="+", default=[1000, 2000, 5000, 10000, 20000])
+    parser.add_argument("--terrains", nargs="+", default=TERRAINS, choices=TERRAINS)
+    parser.add_argument("--etapes", nargs="+", default=ETAPES, choices=ETAPES)
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rapport", help="préfixe des rapports JSON, CSV et trace")
+    parser.add_argument("--reference", help="rapport JSON de référence pour le contrôle des régressions")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    profil = benchmark(args.tailles, args.terrains, args.etapes, args.repetitions, args.seed)
+    print("Passage à l'échelle (débit relatif à la plus petite taille) :")
+    for etape, points in passageEchelle(profil).items():
+        print("...%-28s " % etape + "  ".join("%d^2:%.2f" % (n, eff) for n, debit, eff in points))
+    profil.exporter(args.rapport)
+    if args.reference:
+        baisses = regressions(profil, args.reference, args.tolerance)
+        for etape, n, avant, apres in baisses:
+            print("Régression : %s %d^2 : %.2f -> %.2f Mcellules/s" % (etape, n, avant / 1e6, apres / 1e6))
+        sys.exit(1 if baisses else 0)
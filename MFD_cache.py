@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Cache disque des résultats intermédiaires (MNT comblé, codes de dépression,
+directions d'écoulement, aires drainées)
+
+Chaque entrée est adressée par son contenu : la clé est l'empreinte du MNT,
+des paramètres de l'étape (amplitudeBruit, seed, méthode et nbr de passes de
+comblement...) et de la version du code. Une entrée est un répertoire de
+fichiers .npy relus en mémoire mappée (np.load(mmap_mode="r")) : une relance
+qui ne modifie que les étapes aval repart des résultats amont sans les
+recalculer. La taille totale du cache est bornée : les entrées les moins
+récemment utilisées sont supprimées en premier (LRU).
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+import hashlib
+import os
+import shutil
+
+#A incrémenter si le format des entrées change
+CACHE_VERSION = 1
+
+
+def empreinteTableau(tableau):
+    #Empreinte du contenu d'un tableau (forme et type compris)
+    tableau = np.ascontiguousarray(tableau)
+    h = hashlib.sha256(repr((tableau.shape, tableau.dtype.str)).encode())
+    h.update(memoryview(tableau).cast("B"))
+    return h.hexdigest()
+
+
+def versionCode(*fichiers):
+    #Empreinte des sources des modules de calcul : toute modification du code invalide les entrées existantes
+    h = hashlib.sha256(str(CACHE_VERSION).encode())
+    for fichier in fichiers:
+        with open(fichier, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class CacheRaster:
+    """Cache disque LRU de tableaux numpy, borné à budget octets"""
+    def __init__(self, repertoire, budget=20 * 2**30):
+        self.repertoire = repertoire
+        self.budget = budget
+        os.makedirs(repertoire, exist_ok=True)
+
+    def cle(self, *composantes):
+        #Clé d'une entrée : empreinte des composantes (empreinte du MNT, version du code, nom de l'étape, paramètres...)
+        return hashlib.sha256(repr(composantes).encode()).hexdigest()
+
+    def charger(self, cle):
+        #Retourne le dictionnaire nom -> tableau (mémoire mappée, lecture seule) de l'entrée, None si absente
+        chemin = os.path.join(self.repertoire, cle)
+        if not os.path.isdir(chemin):
+            return None
+        os.utime(chemin) #date de dernière utilisation, pour l'éviction LRU
+        return {nom[:-4]: np.load(os.path.join(chemin, nom), mmap_mode="r") for nom in os.listdir(chemin) if nom.endswith(".npy")}
+
+    def enregistrer(self, cle, **tableaux):
+        #Ecriture dans un répertoire temporaire puis renommage : une entrée interrompue n'est jamais relue
+        chemin = os.path.join(self.repertoire, cle)
+        temporaire = chemin + ".tmp%d" % os.getpid()
+        os.makedirs(temporaire, exist_ok=True)
+        for nom, tableau in tableaux.items():
+            np.save(os.path.join(temporaire, nom + ".npy"), np.asarray(tableau))
+        if os.path.isdir(chemin):
+            shutil.rmtree(temporaire)
+        else:
+            os.rename(temporaire, chemin)
+        self.evincer(conserver=cle)
+
+    def taille(self, cle):
+        chemin = os.path.join(self.repertoire, cle)
+        return sum(os.path.getsize(os.path.join(chemin, nom)) for nom in os.listdir(chemin))
+
+    def evincer(self, conserver=None):
+        #Supprime les entrées les moins récemment utilisées jusqu'à revenir sous le budget
+        entrees = [e for e in os.listdir(self.repertoire) if ".tmp" not in e and os.path.isdir(os.path.join(self.repertoire, e))]
+        entrees.sort(key=lambda e: os.path.getmtime(os.path.join(self.repertoire, e)))
+        total = sum(self.taille(e) for e in entrees)
+        for e in entrees:
+            if total <= self.budget:
+                break
+            if e == conserver:
+                continue
+            total -= self.taille(e)
+            shutil.rmtree(os.path.join(self.repertoire, e), ignore_errors=True)
+        return total
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Comblement des dépressions par inondation prioritaire (Priority-Flood, Barnes et al. 2014)
+
+Remplace les passes successives de myk_comblementDepressions : toutes les
+dépressions sont comblées en un seul appel, en O(n log n).
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import heapq
+import numpy as np
+from numba import njit
+from MFD_voisinage import DX, DY, plansVoisins, nbrVoisinsInferieurs
+
+
+@njit
+def _priorityFlood(dataMNT, mnt_filled, noDataValue, epsilon):
+    dimx, dimy = dataMNT.shape
+    altitude = np.empty((dimx, dimy), dtype=np.int64)
+    ferme = np.zeros((dimx, dimy), dtype=np.bool_)
+    for x in range(dimx):
+        for y in range(dimy):
+            altitude[x, y] = dataMNT[x, y]
+            ferme[x, y] = dataMNT[x, y] == noDataValue
+
+    #File de priorité (altitude, indice) initialisée avec les cellules de bord du MNT ou voisines d'une cellule NoData
+    ouverte = [(np.int64(0), np.int64(0)) for _ in range(0)]
+    for x in range(dimx):
+        for y in range(dimy):
+            if ferme[x, y]:
+                continue
+            bord = False
+            for i in range(1, 9):
+                xv = x + DX[i]
+                yv = y + DY[i]
+                if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                    bord = True
+                    break
+            if bord:
+                ferme[x, y] = True
+                heapq.heappush(ouverte, (altitude[x, y], np.int64(x * dimy + y)))
+
+    #File FIFO des cellules de dépression (déjà à l'altitude de leur exutoire, pas besoin de les trier)
+    depression = np.empty(dimx * dimy, dtype=np.int64)
+    debut = 0
+    fin = 0
+    while len(ouverte) > 0 or debut < fin:
+        if debut < fin:
+            c = depression[debut]
+            debut += 1
+        else:
+            c = heapq.heappop(ouverte)[1]
+        x = c // dimy
+        y = c % dimy
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or ferme[xv, yv]:
+                continue
+            ferme[xv, yv] = True
+            if altitude[xv, yv] <= altitude[x, y] + epsilon:
+                altitude[xv, yv] = altitude[x, y] + epsilon
+                depression[fin] = xv * dimy + yv
+                fin += 1
+            else:
+                heapq.heappush(ouverte, (altitude[xv, yv], np.int64(xv * dimy + yv)))
+
+    for x in range(dimx):
+        for y in range(dimy):
+            mnt_filled[x, y] = altitude[x, y]
+    return mnt_filled
+
+
+def comblementPriorityFlood(dataMNT, mnt_filled, mnt_codes_depr, noDataValue, epsilon):
+    #epsilon = 0 : les dépressions sont comblées à plat
+    #epsilon > 0 : chaque cellule comblée est relevée de epsilon (en cm) par rapport à la cellule qui la draine, le MNT comblé s'écoule partout
+    #Retourne le tableau (1, 10) équivalent à mnt_ind_depr_tot : nbr de cellules par nbr de voisins inférieurs (0-8) / 9 : nbr de cellules valides
+    _priorityFlood(dataMNT, mnt_filled, noDataValue, epsilon)
+
+    #Codes de dépression sur le MNT comblé (nbr de voisins inférieurs, comme voisinage[9] dans myk_comblementDepressions)
+    valides = dataMNT != noDataValue
+    codes = nbrVoisinsInferieurs(plansVoisins(mnt_filled))
+    mnt_codes_depr[valides] = codes[valides]
+    ind_depr_tot = np.zeros((1, 10), dtype=np.int64)
+    ind_depr_tot[0, :9] = np.bincount(codes[valides], minlength=9)[:9]
+    ind_depr_tot[0, 9] = valides.sum()
+    return ind_depr_tot
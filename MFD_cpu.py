@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Moteur CPU multi-coeurs (numba njit/prange) des kernels de MFD_v3.py
+
+Chaque fonction myk_* reprend la signature et le calcul du kernel CUDA de même
+nom, une itération de prange jouant le rôle d'une ligne de threads.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+from numba import njit, prange
+from numba.cuda.random import xoroshiro128p_dtype, init_xoroshiro128p_states_cpu, xoroshiro128p_uniform_float32
+from MFD_voisinage import DX, DY, voisins
+from MFD_aleatoire import bruitCellule
+
+
+class lanceur:
+    """Enveloppe d'une fonction njit acceptant la syntaxe de lancement CUDA noyau[bpg, tpb](...)"""
+    def __init__(self, fonction):
+        self.fonction = fonction
+
+    def __getitem__(self, configuration):
+        return self.fonction
+
+
+def creerEtatsAleatoires(n, seed):
+    """Equivalent hôte de create_xoroshiro128p_states (mêmes états, tableau numpy)"""
+    etats = np.empty(n, dtype=xoroshiro128p_dtype)
+    init_xoroshiro128p_states_cpu(etats, seed, 0)
+    return etats
+
+
+@njit
+def tiragesAleatoires(rng_states, n):
+    #Un seul tirage par état : c'est la valeur lue par chaque thread GPU partageant le même pos_x (resp. pos_y)
+    tirages = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        tirages[i] = xoroshiro128p_uniform_float32(rng_states, i)
+    return tirages
+
+
+@njit(parallel=True)
+def bruitageTirages(mnt_source, mnt_bruite, noDataValue, amplitudeBruit, tirages_x, tirages_y, bruitageActif):
+    #tirages_x / tirages_y : tirages des lignes et colonnes couvertes par mnt_source (permet de bruiter une tuile)
+    dimx, dimy = mnt_source.shape
+    for pos_x in prange(dimx):
+        for pos_y in range(dimy):
+            bruitage = int(amplitudeBruit * (tirages_x[pos_x] + tirages_y[pos_y]) - amplitudeBruit)
+            if mnt_source[pos_x, pos_y] == noDataValue:
+                mnt_bruite[pos_x, pos_y] = noDataValue
+            else:
+                mnt_bruite[pos_x, pos_y] = mnt_source[pos_x, pos_y] + bruitageActif * bruitage
+
+
+@njit
+def myk_bruitageMNT(mnt_source, mnt_bruite, noDataValue, amplitudeBruit, rng_states_x, rng_states_y, bruitageActif):
+    dimx, dimy = mnt_source.shape
+    tirages_x = tiragesAleatoires(rng_states_x, dimx)
+    tirages_y = tiragesAleatoires(rng_states_y, dimy)
+    bruitageTirages(mnt_source, mnt_bruite, noDataValue, amplitudeBruit, tirages_x, tirages_y, bruitageActif)
+
+
+@njit(parallel=True)
+def myk_bruitageCompteur(mnt_source, mnt_bruite, noDataValue, amplitudeBruit, seed, realisation, bruitageActif, l0, c0):
+    #Bruit à compteur (MFD_aleatoire) ; l0, c0 : position de mnt_source dans le MNT complet (0, 0 hors traitement par tuiles)
+    dimx, dimy = mnt_source.shape
+    for pos_x in prange(dimx):
+        for pos_y in range(dimy):
+            if mnt_source[pos_x, pos_y] == noDataValue:
+                mnt_bruite[pos_x, pos_y] = noDataValue
+            else:
+                bruitage = bruitCellule(seed, realisation, l0 + pos_x, c0 + pos_y, amplitudeBruit)
+                mnt_bruite[pos_x, pos_y] = mnt_source[pos_x, pos_y] + bruitageActif * bruitage
+
+
+@njit(parallel=True)
+def myk_comblementDepressions(dataMNT, mnt_filled, mnt_codes_depr, noDataValue, mnt_ind_depr, mnt_ind_depr_tot, mnt_alt_cretes, celluleTraitees):
+    dimx, dimy = dataMNT.shape
+    #Comptes par ligne, sommés ensuite (remplace cuda.atomic.add sur mnt_ind_depr_tot[0, j])
+    comptes = np.zeros((dimx, 10), dtype=np.int64)
+    for pos_x in prange(dimx):
+        voisinage = np.zeros(10, dtype=np.int32) #0:centre /1-8:voisinage / 9:compte du nbr de cellules voisines inférieures au centre
+        voisinage_tourne = np.zeros(10, dtype=np.int32)
+        for pos_y in range(dimy):
+            celluleTraitees[pos_x, pos_y] = False
+            mnt_filled[pos_x, pos_y] = dataMNT[pos_x, pos_y]
+            mnt_ind_depr[pos_x, pos_y] = 0
+            mnt_ind_depr_tot[pos_x, pos_y] = 0
+
+            voisins(dataMNT, pos_x, pos_y, dimx, dimy, voisinage)
+
+            if voisinage[9] == 0:
+                mnt_filled[pos_x, pos_y] = exutoiresVoisins(voisinage)
+
+            if dataMNT[pos_x, pos_y] == noDataValue:
+                mnt_filled[pos_x, pos_y] = noDataValue
+                mnt_ind_depr[pos_x, pos_y] = 0
+                celluleTraitees[pos_x, pos_y] = True
+            else:
+                mnt_codes_depr[pos_x, pos_y] = voisinage[9]
+                mnt_ind_depr[pos_x, pos_y] = 1
+                comptes[pos_x, voisinage[9]] += 1
+                comptes[pos_x, 9] += 1
+
+            mnt_alt_cretes[pos_x, pos_y] = crete(voisinage, voisinage_tourne)
+
+    for j in range(10):
+        mnt_ind_depr_tot[0, j] = comptes[:, j].sum()
+
+
+@njit(parallel=True)
+def myk_copieMNT(mnt_source, mnt_dest):
+    for pos_x in prange(mnt_source.shape[0]):
+        for pos_y in range(mnt_source.shape[1]):
+            mnt_dest[pos_x, pos_y] = mnt_source[pos_x, pos_y]
+
+
+@njit(parallel=True)
+def myk_remplir(tableau, valeur):
+    for pos_x in prange(tableau.shape[0]):
+        for pos_y in range(tableau.shape[1]):
+            tableau[pos_x, pos_y] = valeur
+
+
+@njit(parallel=True)
+def myk_directionsEcoulement(dataMNT, directionsEcoulement, noDataValue):
+    dimx, dimy = dataMNT.shape
+    for pos_x in prange(dimx):
+        for pos_y in range(dimy):
+            if dataMNT[pos_x, pos_y] == noDataValue:
+                dataMNT[pos_x, pos_y] = 99999
+    #directionsEcoulement : cube (dimx, dimy, 9) historique ou format compact (dimx, dimy, 8) sans la case centre
+    premier = directionsEcoulement.shape[2] - 8
+    for pos_x in prange(dimx):
+        voisinage = np.zeros(10, dtype=np.int32)
+        diff = np.zeros(11, dtype=np.uint16)
+        repartition = np.zeros(9, dtype=np.uint8)
+        for pos_y in range(dimy):
+            repartitionEcoulement(dataMNT, pos_x, pos_y, dimx, dimy, voisinage, diff, repartition)
+            for i in range(1, 9):
+                directionsEcoulement[pos_x, pos_y, i - 1 + premier] = repartition[i]
+
+
+@njit
+def repartitionEcoulement(dataMNT, pos_x, pos_y, dimx, dimy, voisinage, diff, repartition):
+    #repartition[1:9] reçoit le pourcentage de l'écoulement de la cellule vers chacun de ses 8 voisins (somme = 100, ou 0 pour une cuvette)
+    voisins(dataMNT, pos_x, pos_y, dimx, dimy, voisinage)
+    diff[:] = 0 #0-8: écarts d'altitude / 9:somme des écarts / 10:nbr de cellules d'écoulement
+    repartition[:] = 0
+    for i in range(9):
+        if voisinage[i] > voisinage[0] and voisinage[i] > 0:
+            voisinage[i] = -2
+    for i in range(9):
+        if voisinage[i] > 0:
+            diff[i] = voisinage[0] - voisinage[i]
+            diff[9] += diff[i]
+            diff[10] += 1
+    somme = 0
+    for i in range(9):
+        if voisinage[i] > 0 and not (diff[9] == 0):
+            repartition[i] = valRel(diff[i], diff[9], diff[10], 1)
+            somme += int(valRel(diff[i], diff[9], diff[10], 1))
+
+    #On corrige les répartitions d'écoulement dont la somme ne fait pas 100
+    if somme != 100:
+        reste = 100 - somme
+        for passe in range(2):
+            for i in range(1, 9):
+                if repartition[i] != 0 and reste > 0:
+                    repartition[i] += 1
+                    reste -= 1
+    return repartition
+
+
+@njit(parallel=True)
+def myk_cellulesDrainees(dataMNT, directionsEcoulement, noDataValue, cellDrainees, cellTraitee):
+    dimx, dimy = dataMNT.shape
+    #Etat de cellTraitee au lancement : le résultat ne dépend pas de l'ordre de parcours
+    traiteeAvant = cellTraitee.copy()
+    for pos_x in prange(dimx):
+        for pos_y in range(dimy):
+            if dataMNT[pos_x, pos_y] == noDataValue:
+                cellDrainees[pos_x, pos_y] = 0
+                continue
+            test = True
+            aireDraineeCelluleActive = 0
+            for i in range(1, 9):
+                x = pos_x + DX[i]
+                y = pos_y + DY[i]
+                indice = i + 4 if i <= 4 else i - 4
+                if x < dimx and y < dimy and x > 0 and y > 0:
+                    test = test and (traiteeAvant[x, y] or directionsEcoulement[x, y, indice] == 0)
+                    if directionsEcoulement[x, y, indice] > 0:
+                        aireDraineeCelluleActive += directionsEcoulement[x, y, indice] * 100
+            if test:
+                cellDrainees[pos_x, pos_y] = 1 + aireDraineeCelluleActive
+                cellTraitee[pos_x, pos_y] = True
+
+
+@njit
+def tourne_voisins(voisinage, voisinage_tourne, agl): #agl représente le nombre de quart de tour de rotation dans le sens des aiguilles d'une montre
+    voisinage_tourne[0] = voisinage[0]
+    for i in range(1, 9):
+        voisinage_tourne[i] = voisinage[(i - 1 + 2 * (agl % 4)) % 8 + 1]
+    return voisinage_tourne
+
+
+@njit
+def crete(voisinage, voisinage_tourne):
+    alt_crete = 0
+    # cas croix
+    c1 = voisinage[1] < voisinage[0] and voisinage[1] < voisinage[2] and voisinage[1] < voisinage[8]
+    c7 = voisinage[7] < voisinage[0] and voisinage[7] < voisinage[6] and voisinage[7] < voisinage[8]
+    c5 = voisinage[5] < voisinage[0] and voisinage[5] < voisinage[6] and voisinage[5] < voisinage[4]
+    c3 = voisinage[3] < voisinage[0] and voisinage[3] < voisinage[2] and voisinage[3] < voisinage[4]
+    cCroix = c1 and c7 and c5 and c3
+    # cas "t"
+    cT = False
+    for i in range(4):
+        v = tourne_voisins(voisinage, voisinage_tourne, i)
+        c1 = v[1] < v[2]
+        c7 = v[7] < v[6]
+        c5 = v[5] < v[0] and v[5] < v[6] and v[5] < v[4]
+        c3 = v[3] < v[0] and v[3] < v[2] and v[3] < v[4]
+        c8 = v[8] < v[0]
+        cT = cT or (c1 and c3 and c5 and c7 and c8)
+    # cas "vertical" + "horizontal"
+    cVH = False
+    for i in range(2):
+        v = tourne_voisins(voisinage, voisinage_tourne, i)
+        c1 = v[1] < v[2]
+        c7 = v[7] < v[6]
+        c5 = v[5] < v[6]
+        c3 = v[3] < v[2]
+        c8 = v[8] < v[0]
+        c4 = v[4] < v[0]
+        cVH = cVH or (c1 and c3 and c5 and c7 and c8 and c4)
+    # cas "coin"
+    cCoin = False
+    for i in range(4):
+        v = tourne_voisins(voisinage, voisinage_tourne, i)
+        c1 = v[1] < v[2]
+        c5 = v[5] < v[4]
+        c3 = v[3] < v[0] and v[3] < v[2] and v[3] < v[4]
+        c8 = v[8] < v[0]
+        c6 = v[6] < v[0]
+        cCoin = cCoin or (c1 and c5 and c3 and c8 and c6)
+    # Conclusion
+    if cCroix or cT or cVH or cCoin:
+        alt_crete = voisinage[0]
+    return alt_crete
+
+
+@njit
+def exutoiresVoisins(voisinage):
+    #Reprise à l'identique de la fonction device de MFD_v3.py
+    mini1 = 0
+    indice_mini1 = 0
+    mini2 = 0
+    for i in range(1, 9):
+        if voisinage[i] > mini1:
+            mini1 = voisinage[i]
+            indice_mini1 = i
+    for i in range(1, 9):
+        if voisinage[i] > mini2:
+            if i != indice_mini1:
+                mini1 = voisinage[i]
+                indice_mini1 = i
+    altExut = int((mini1 + mini2) / 2) + 1
+    return altExut
+
+
+@njit
+def valRel(diff_i, diff_tot, diff_nbr, conv):
+    res = 0.0
+    if conv == 1:
+        res = (100 * diff_i) / diff_tot
+    return res
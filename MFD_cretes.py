@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Détection vectorisée des lignes de crête par table de motifs
+
+Même résultat que la fonction crete (MFD_cpu.py, MFD_v3.py), sans rotation
+du voisinage ni tests cellule par cellule :
+- les 16 comparaisons dont dépendent les motifs sont calculées sur le MNT
+  entier (plans décalés de MFD_voisinage.plansVoisins) et rangées dans un
+  masque de 16 bits par cellule :
+    bits 0 à 7  : voisin i < centre (i = 1 à 8) ;
+    bits 8 à 15 : voisin impair k < voisin pair précédent (bit 8 + k - 1) et
+                  < voisin pair suivant (bit 9 + k - 1), k = 1, 3, 5, 7 ;
+- une table de 65536 motifs, calculée une fois, donne pour chaque masque les
+  motifs reconnus (croix, "t", vertical/horizontal, coin), en un seul accès.
+
+Numérotation des voisins : cf MFD_voisinage.py.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+from MFD_voisinage import plansVoisins
+
+#Motifs reconnus (bits du code retourné, plusieurs motifs possibles pour une même cellule)
+MOTIF_CROIX = 1
+MOTIF_T = 2
+MOTIF_VH = 4
+MOTIF_COIN = 8
+MOTIFS = {"croix": MOTIF_CROIX, "t": MOTIF_T, "vh": MOTIF_VH, "coin": MOTIF_COIN}
+
+
+def _tourne(i, agl):
+    #Indice dans le voisinage d'origine du voisin i après agl quarts de tour (cf tourne_voisins)
+    return (i - 1 + 2 * (agl % 4)) % 8 + 1
+
+
+def _inferieur(bits, i, j, agl):
+    #Relation v[i] < v[j] du voisinage tourné de agl quarts de tour : j = 0 (centre) ou i impair et j pair adjacent
+    m = _tourne(i, agl)
+    if j == 0:
+        return bits[m - 1]
+    if j == i % 8 + 1:
+        return bits[9 + m - 1]
+    return bits[8 + m - 1]
+
+
+def tableMotifs():
+    #Table des 65536 masques -> code des motifs, mêmes conditions que la fonction crete
+    masques = np.arange(2**16, dtype=np.uint32)
+    bits = [(masques >> b) & 1 == 1 for b in range(16)]
+    inf = lambda i, j, agl=0: _inferieur(bits, i, j, agl)
+    # cas croix
+    cCroix = np.ones(2**16, dtype=np.bool_)
+    for k in (1, 3, 5, 7):
+        cCroix &= inf(k, 0) & inf(k, k - 1 if k > 1 else 8) & inf(k, k + 1)
+    # cas "t"
+    cT = np.zeros(2**16, dtype=np.bool_)
+    for a in range(4):
+        cT |= (inf(1, 2, a) & inf(7, 6, a) & inf(5, 0, a) & inf(5, 6, a) & inf(5, 4, a)
+               & inf(3, 0, a) & inf(3, 2, a) & inf(3, 4, a) & inf(8, 0, a))
+    # cas "vertical" + "horizontal"
+    cVH = np.zeros(2**16, dtype=np.bool_)
+    for a in range(2):
+        cVH |= inf(1, 2, a) & inf(7, 6, a) & inf(5, 6, a) & inf(3, 2, a) & inf(8, 0, a) & inf(4, 0, a)
+    # cas "coin"
+    cCoin = np.zeros(2**16, dtype=np.bool_)
+    for a in range(4):
+        cCoin |= inf(1, 2, a) & inf(5, 4, a) & inf(3, 0, a) & inf(3, 2, a) & inf(3, 4, a) & inf(8, 0, a) & inf(6, 0, a)
+    return (MOTIF_CROIX * cCroix + MOTIF_T * cT + MOTIF_VH * cVH + MOTIF_COIN * cCoin).astype(np.uint8)
+
+
+TABLE_MOTIFS = tableMotifs()
+
+
+def masqueRelations(plans, masque=None):
+    #Masque de 16 bits des comparaisons de voisinage de chaque cellule (cf en-tête) à partir des 9 plans décalés
+    centre = plans[0]
+    if masque is None:
+        masque = np.zeros(centre.shape, dtype=np.uint16)
+    else:
+        masque[...] = 0
+    for i in range(1, 9):
+        masque |= (plans[i] < centre).astype(np.uint16) << (i - 1)
+    for k in (1, 3, 5, 7):
+        masque |= (plans[k] < plans[k - 1 if k > 1 else 8]).astype(np.uint16) << (8 + k - 1)
+        masque |= (plans[k] < plans[k + 1]).astype(np.uint16) << (9 + k - 1)
+    return masque
+
+
+def cretesVectorisees(mnt, mnt_alt_cretes=None, motifs=None, nbrLignesBloc=256):
+    #Equivalent de crete sur tout le MNT : mnt_alt_cretes = altitude du centre sur les crêtes, 0 ailleurs ; motifs = code des motifs reconnus
+    #Calcul par blocs de lignes pour que les tableaux intermédiaires restent en cache ; retourne (mnt_alt_cretes, motifs)
+    plans = plansVoisins(mnt)
+    if mnt_alt_cretes is None:
+        mnt_alt_cretes = np.empty(mnt.shape, dtype=plans[0].dtype)
+    if motifs is None:
+        motifs = np.empty(mnt.shape, dtype=np.uint8)
+    masque = np.empty((min(nbrLignesBloc, mnt.shape[0]), mnt.shape[1]), dtype=np.uint16)
+    for l0 in range(0, mnt.shape[0], nbrLignesBloc):
+        l1 = min(l0 + nbrLignesBloc, mnt.shape[0])
+        bloc = [p[l0:l1] for p in plans]
+        m = masqueRelations(bloc, masque[:l1 - l0])
+        np.take(TABLE_MOTIFS, m, out=motifs[l0:l1])
+        mnt_alt_cretes[l0:l1] = np.where(motifs[l0:l1] != 0, bloc[0], 0)
+    return mnt_alt_cretes, motifs
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Formats de stockage compacts des directions d'écoulement MFD
+
+- format "compact" : tableau (dim1, dim2, 8) uint8, la case centre (toujours
+  nulle) du cube (dim1, dim2, 9) est supprimée, la case k correspond au
+  voisin k + 1 ;
+- format "csr" : liste des cellules réceptrices de chaque cellule
+  (offsets, code du voisin 1-8, pourcentage), sans stockage des voisins
+  ne recevant rien.
+
+Les pourcentages sont ceux de myk_directionsEcoulement (MFD_cpu.repartitionEcoulement).
+
+Types de poids (TYPES_POIDS) : "pourcentage" (uint8, somme 100, historique),
+"fixe16" (uint16, fractions en virgule fixe de somme 65535) ou "float32"
+(fractions de somme 1) ; les deux derniers sont produits par MFD_routage,
+normalisés en une passe. L'accumulation divise chaque poids par la somme des
+poids stockés de la cellule : le bilan de masse est exact quel que soit le
+type.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+from numba import njit, prange
+from MFD_cpu import repartitionEcoulement
+
+
+#Type numpy et valeur d'un écoulement complet de chaque type de poids
+TYPES_POIDS = {"pourcentage": (np.uint8, 100), "fixe16": (np.uint16, 65535), "float32": (np.float32, 1.0)}
+
+
+def echellePoids(dtype):
+    #Valeur d'un écoulement complet pour des poids de type dtype
+    for typePoids, echelle in TYPES_POIDS.values():
+        if np.dtype(typePoids) == np.dtype(dtype):
+            return echelle
+    raise ValueError("Type de poids non pris en charge : %s" % np.dtype(dtype))
+
+
+def directionsCompactes(dim1, dim2, typePoids="pourcentage"):
+    return np.zeros((dim1, dim2, 8), dtype=TYPES_POIDS[typePoids][0])
+
+
+@njit(parallel=True)
+def _nbrRecepteurs(dataMNT, nbr):
+    dimx, dimy = dataMNT.shape
+    for pos_x in prange(dimx):
+        voisinage = np.zeros(10, dtype=np.int32)
+        diff = np.zeros(11, dtype=np.uint16)
+        repartition = np.zeros(9, dtype=np.uint8)
+        for pos_y in range(dimy):
+            repartitionEcoulement(dataMNT, pos_x, pos_y, dimx, dimy, voisinage, diff, repartition)
+            n = 0
+            for i in range(1, 9):
+                if repartition[i] > 0:
+                    n += 1
+            nbr[pos_x * dimy + pos_y + 1] = n
+
+
+@njit(parallel=True)
+def _remplissageCSR(dataMNT, offsets, recepteurs, poids):
+    dimx, dimy = dataMNT.shape
+    for pos_x in prange(dimx):
+        voisinage = np.zeros(10, dtype=np.int32)
+        diff = np.zeros(11, dtype=np.uint16)
+        repartition = np.zeros(9, dtype=np.uint8)
+        for pos_y in range(dimy):
+            repartitionEcoulement(dataMNT, pos_x, pos_y, dimx, dimy, voisinage, diff, repartition)
+            k = offsets[pos_x * dimy + pos_y]
+            for i in range(1, 9):
+                if repartition[i] > 0:
+                    recepteurs[k] = i
+                    poids[k] = repartition[i]
+                    k += 1
+
+
+def directionsCSR(dataMNT):
+    #Calcul direct au format CSR, sans passer par le cube : les récepteurs de la cellule c sont recepteurs[offsets[c]:offsets[c + 1]]
+    dimx, dimy = dataMNT.shape
+    nbr = np.zeros(dimx * dimy + 1, dtype=np.int64)
+    _nbrRecepteurs(dataMNT, nbr)
+    total = nbr.sum()
+    offsets = np.cumsum(nbr, dtype=np.int64).astype(np.uint32 if total < 2 ** 32 else np.int64)
+    recepteurs = np.empty(total, dtype=np.uint8)
+    poids = np.empty(total, dtype=np.uint8)
+    _remplissageCSR(dataMNT, offsets, recepteurs, poids)
+    return offsets, recepteurs, poids
+
+
+def cubeVersCSR(directionsEcoulement):
+    #Conversion d'un cube (9 cases) ou d'un tableau compact (8 cases) au format CSR
+    premier = directionsEcoulement.shape[2] - 8
+    cases = directionsEcoulement[:, :, premier:].reshape(-1, 8)
+    nbr = np.count_nonzero(cases, axis=1)
+    offsets = np.zeros(len(nbr) + 1, dtype=np.int64)
+    np.cumsum(nbr, out=offsets[1:])
+    cellules, k = np.nonzero(cases)
+    offsets = offsets.astype(np.uint32 if offsets[-1] < 2 ** 32 else np.int64)
+    return offsets, (k + 1).astype(np.uint8), cases[cellules, k]
+
+
+@njit(parallel=True)
+def csrVersCompact(offsets, recepteurs, poids, directionsEcoulement, l0, l1):
+    #Décodage des lignes l0 à l1 au format compact (dimx, dimy, 8), pour l'écriture par blocs
+    dimy = directionsEcoulement.shape[1]
+    for pos_x in prange(l0, l1):
+        for pos_y in range(dimy):
+            c = pos_x * dimy + pos_y
+            for k in range(8):
+                directionsEcoulement[pos_x - l0, pos_y, k] = 0
+            for k in range(offsets[c], offsets[c + 1]):
+                directionsEcoulement[pos_x - l0, pos_y, recepteurs[k] - 1] = poids[k]
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Ensemble de Monte Carlo sur le bruitage du MNT, avec statistiques par cellule
+
+Chaque réalisation enchaîne bruitage, détection des crêtes et cuvettes,
+comblement, directions et accumulation. Les résultats ne sont pas conservés :
+ils mettent à jour des statistiques en ligne (Welford) de l'aire drainée
+(moyenne, variance) et les fréquences de crête et de cuvette de chaque
+cellule, si bien que la mémoire ne dépend pas du nombre de réalisations.
+Les réalisations sont réparties par lots sur un pool de processus : le MNT
+est transmis une fois à chaque processus, et seuls nbrProcessus lots sont en
+cours à la fois, chaque résultat étant fusionné puis libéré dès son arrivée.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+import datetime
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numba
+import MFD_cpu
+import MFD_comblement
+import MFD_accumulation
+import MFD_directions
+
+
+class StatistiquesEnsemble:
+    """Statistiques en ligne (Welford) des réalisations, fusionnables entre lots (Chan et al.)"""
+    def __init__(self, forme):
+        self.n = 0
+        self.moyenne = np.zeros(forme, dtype=np.float64)
+        self.m2 = np.zeros(forme, dtype=np.float64)
+        self.nbrCretes = np.zeros(forme, dtype=np.uint32)
+        self.nbrCuvettes = np.zeros(forme, dtype=np.uint32)
+
+    def ajouter(self, cellDrainees, cretes, cuvettes):
+        self.n += 1
+        delta = cellDrainees - self.moyenne
+        self.moyenne += delta / self.n
+        self.m2 += delta * (cellDrainees - self.moyenne)
+        self.nbrCretes += cretes
+        self.nbrCuvettes += cuvettes
+
+    def fusionner(self, autre):
+        if autre.n == 0:
+            return self
+        n = self.n + autre.n
+        delta = autre.moyenne - self.moyenne
+        self.moyenne += delta * (autre.n / n)
+        self.m2 += autre.m2 + delta * delta * (self.n * autre.n / n)
+        self.n = n
+        self.nbrCretes += autre.nbrCretes
+        self.nbrCuvettes += autre.nbrCuvettes
+        return self
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.zeros_like(self.m2)
+
+    def frequenceCretes(self):
+        return self.nbrCretes / max(self.n, 1)
+
+    def frequenceCuvettes(self):
+        return self.nbrCuvettes / max(self.n, 1)
+
+
+def realisation(mnt, noDataValue, numero, amplitudeBruit=20, seed=1, epsilon=1):
+    #Une réalisation bruitée complète ; le bruit de la réalisation numero ne dépend que de (seed, numero, x, y)
+    dimx, dimy = mnt.shape
+    mnt_bruite = np.empty_like(mnt)
+    MFD_cpu.myk_bruitageCompteur(mnt, mnt_bruite, noDataValue, amplitudeBruit, seed, numero, 1, 0, 0)
+
+    mnt_filled = np.empty_like(mnt)
+    mnt_codes_depr = np.zeros_like(mnt)
+    mnt_ind_depr = np.empty_like(mnt)
+    mnt_ind_depr_tot = np.empty_like(mnt)
+    mnt_alt_cretes = np.empty_like(mnt)
+    celluleTraitees = np.empty(mnt.shape, dtype=np.bool_)
+    MFD_cpu.myk_comblementDepressions(mnt_bruite, mnt_filled, mnt_codes_depr, noDataValue, mnt_ind_depr, mnt_ind_depr_tot, mnt_alt_cretes, celluleTraitees)
+    valides = mnt != noDataValue
+    cretes = (mnt_alt_cretes != 0) & valides
+    cuvettes = (mnt_codes_depr == 0) & valides
+
+    MFD_comblement.comblementPriorityFlood(mnt_bruite, mnt_filled, mnt_codes_depr, noDataValue, epsilon)
+    directionsEcoulement = MFD_directions.directionsCompactes(dimx, dimy)
+    MFD_cpu.myk_directionsEcoulement(mnt_filled.copy(), directionsEcoulement, 27108)
+    cellDrainees = np.zeros(mnt.shape, dtype=np.float64)
+    MFD_accumulation.accumulationTopologique(mnt_filled, directionsEcoulement, noDataValue, cellDrainees)
+    return cellDrainees, cretes, cuvettes
+
+
+_mnt = None
+_noDataValue = None
+
+
+def _initProcessus(mnt, noDataValue):
+    #Un seul thread numba par processus : le parallélisme vient du pool ; le MNT n'est transmis qu'une fois par processus
+    global _mnt, _noDataValue
+    numba.set_num_threads(1)
+    _mnt = mnt
+    _noDataValue = noDataValue
+
+
+def _lot(mnt, noDataValue, numeros, amplitudeBruit, seed, epsilon):
+    stats = StatistiquesEnsemble(mnt.shape)
+    for numero in numeros:
+        stats.ajouter(*realisation(mnt, noDataValue, numero, amplitudeBruit, seed, epsilon))
+    return stats
+
+
+def _lotProcessus(numeros, amplitudeBruit, seed, epsilon):
+    return _lot(_mnt, _noDataValue, numeros, amplitudeBruit, seed, epsilon)
+
+
+def ensemble(mnt, noDataValue, nbrRealisations, tailleLot=4, nbrProcessus=None, amplitudeBruit=20, seed=1, epsilon=1):
+    #mnt : MNT en cm (uint32) ; nbrProcessus = 1 : calcul dans le processus courant
+    stats = StatistiquesEnsemble(mnt.shape)
+    lots = [range(k, min(k + tailleLot, nbrRealisations)) for k in range(0, nbrRealisations, tailleLot)]
+    if nbrProcessus == 1:
+        for numeros in lots:
+            stats.fusionner(_lot(mnt, noDataValue, numeros, amplitudeBruit, seed, epsilon))
+        return stats
+    nbrProcessus = nbrProcessus or os.cpu_count()
+    lots = iter(lots)
+    with ProcessPoolExecutor(max_workers=nbrProcessus, initializer=_initProcessus, initargs=(mnt, noDataValue)) as pool:
+        #Fenêtre de nbrProcessus lots en cours : chaque résultat est fusionné puis libéré avant la soumission du lot suivant
+        enCours = {pool.submit(_lotProcessus, numeros, amplitudeBruit, seed, epsilon) for numeros in itertools.islice(lots, nbrProcessus)}
+        while enCours:
+            tache = next(as_completed(enCours))
+            enCours.remove(tache)
+            stats.fusionner(tache.result())
+            del tache
+            numeros = next(lots, None)
+            if numeros is not None:
+                enCours.add(pool.submit(_lotProcessus, numeros, amplitudeBruit, seed, epsilon))
+    return stats
+
+
+if __name__ == "__main__":
+    from osgeo import gdal
+    import MFD_tuiles
+
+    debut = datetime.datetime.now()
+    fichier_mnt = gdal.Open("Alti_Dpt10_AOC_Champagne.tif")
+    bande = fichier_mnt.GetRasterBand(1)
+    NDV = bande.GetNoDataValue()
+    noDataValue = MFD_tuiles.noDataCm(NDV)
+    mnt = MFD_tuiles.metresVersCm(bande.ReadAsArray(), NDV, noDataValue)
+
+    stats = ensemble(mnt, noDataValue, nbrRealisations=32)
+    for fichier, carte in (("mnt_aireDrainee_moyenne.tif", stats.moyenne), ("mnt_aireDrainee_ecartType.tif", np.sqrt(stats.variance())),
+                           ("mnt_frequenceCretes.tif", stats.frequenceCretes()), ("mnt_frequenceCuvettes.tif", stats.frequenceCuvettes())):
+        outdata = MFD_tuiles.creerSortie(fichier, fichier_mnt, 1, gdal.GDT_Float32)
+        outdata.GetRasterBand(1).WriteArray(carte.astype(np.float32))
+        outdata.FlushCache()
+    print("...Ensemble de", stats.n, "réalisations terminé en : ", datetime.datetime.now() - debut)
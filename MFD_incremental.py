@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Mise à jour locale du comblement, des directions et de l'accumulation après
+une modification du MNT (ouvrage hydraulique, remblai, route...)
+
+Seules les cellules touchées sont recalculées :
+- comblement : Priority-Flood limité à la zone modifiée et à son amont (les
+  cellules qui s'écoulaient vers elle), amorcé par l'anneau des cellules
+  voisines à leur altitude comblée actuelle ; une cellule hors zone n'est
+  reprise que si son altitude comblée baisse (nouvel exutoire par un ouvrage)
+  ou si elle ne s'écoule plus (son exutoire a été remblayé : la zone est alors
+  étendue à son amont et le comblement relancé) ;
+- directions : cellules dont l'altitude comblée a changé et leurs voisines ;
+- accumulation : cellules en aval d'une cellule dont les directions ont
+  changé (anciennes ou nouvelles directions), les autres aires drainées étant
+  inchangées.
+
+Le MNT bruité est recalculé à la volée (bruit à compteur de MFD_aleatoire,
+indépendant de l'ordre de calcul). Avec epsilon = 0, le résultat est celui
+d'un calcul complet. Avec epsilon > 0, la pente epsilon des zones comblées
+peut être construite depuis un autre exutoire que lors d'un comblement
+complet (ordre de traitement différent) : le MNT obtenu est comblé et
+s'écoule partout, et les aires drainées sont celles de ses directions.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import heapq
+import numpy as np
+from numba import njit
+from MFD_voisinage import DX, DY
+from MFD_aleatoire import bruitCellule
+from MFD_cpu import repartitionEcoulement
+
+#Indice du voisin opposé : le voisin i de (x, y) a (x, y) pour voisin OPPOSE[i]
+OPPOSE = np.array([0, 5, 6, 7, 8, 1, 2, 3, 4], dtype=np.int64)
+
+
+@njit
+def _altitudeBruitee(dataMNT, x, y, noDataValue, amplitudeBruit, seed, realisation, bruitageActif):
+    #Valeur de mnt_bruite en (x, y), comme myk_bruitageCompteur (y compris le passage en uint32)
+    if dataMNT[x, y] == noDataValue:
+        return np.int64(dataMNT[x, y])
+    return np.int64(np.uint32(np.int64(dataMNT[x, y]) + bruitageActif * bruitCellule(seed, realisation, x, y, amplitudeBruit)))
+
+
+@njit
+def amont(directionsEcoulement, mnt_filled, graines, seuil):
+    #Cellules qui s'écoulent (directement ou non, zones plates comprises) vers les graines, limitées aux cellules d'altitude comblée <= seuil ; graines comprises
+    dimx, dimy = mnt_filled.shape
+    premier = directionsEcoulement.shape[2] - 8
+    vues = set()
+    file = []
+    for c in graines:
+        if c not in vues:
+            vues.add(c)
+            file.append(c)
+    k = 0
+    while k < len(file):
+        c = file[k]
+        k += 1
+        x = c // dimy
+        y = c % dimy
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy:
+                continue
+            v = xv * dimy + yv
+            if v in vues or np.int64(mnt_filled[xv, yv]) > seuil:
+                continue
+            #Donneur, ou cellule de la même zone plate (comblement à plat, epsilon = 0 : pas de direction d'écoulement)
+            if directionsEcoulement[xv, yv, OPPOSE[i] - 1 + premier] == 0 and mnt_filled[xv, yv] != mnt_filled[x, y]:
+                continue
+            vues.add(v)
+            file.append(v)
+    return np.array(file, dtype=np.int64)
+
+
+@njit
+def comblementLocal(dataMNT, mnt_filled, noDataValue, epsilon, amplitudeBruit, seed, realisation, bruitageActif, zone):
+    #Priority-Flood (cf MFD_comblement._priorityFlood) limité à zone (indices x * dimy + y), mnt_filled mis à jour en place
+    #Retourne (cellules dont l'altitude comblée a été recalculée, cellules de l'anneau qui ne s'écoulent plus)
+    dimx, dimy = dataMNT.shape
+    ZONE, FERME, ANNEAU = 1, 2, 3
+    etat = dict()
+    ancienne = dict()
+    abaissees = set()
+    for c in zone:
+        etat[c] = ZONE
+        ancienne[c] = np.int64(mnt_filled[c // dimy, c % dimy])
+    ouverte = [(np.int64(0), np.int64(0)) for _ in range(0)]
+    depression = [np.int64(0) for _ in range(0)]
+    recalculees = [np.int64(0) for _ in range(0)]
+    for c in zone:
+        x = c // dimy
+        y = c % dimy
+        recalculees.append(c)
+        if dataMNT[x, y] == noDataValue:
+            mnt_filled[x, y] = noDataValue
+            etat[c] = FERME
+            continue
+        mnt_filled[x, y] = _altitudeBruitee(dataMNT, x, y, noDataValue, amplitudeBruit, seed, realisation, bruitageActif)
+        bord = False
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                bord = True
+                continue
+            v = xv * dimy + yv
+            if v not in etat:
+                etat[v] = ANNEAU #amorce à son altitude comblée actuelle
+                heapq.heappush(ouverte, (np.int64(mnt_filled[xv, yv]), v))
+        if bord:
+            etat[c] = FERME
+            heapq.heappush(ouverte, (np.int64(mnt_filled[x, y]), c))
+
+    debut = 0
+    while len(ouverte) > 0 or debut < len(depression):
+        if debut < len(depression):
+            c = depression[debut]
+            debut += 1
+        else:
+            a, c = heapq.heappop(ouverte)
+            if a != np.int64(mnt_filled[c // dimy, c % dimy]):
+                continue #entrée périmée d'une cellule abaissée depuis
+            if etat[c] == ANNEAU:
+                etat[c] = FERME
+        x = c // dimy
+        y = c % dimy
+        altitude = np.int64(mnt_filled[x, y])
+        abaissee = c in abaissees or (c in ancienne and altitude < ancienne[c])
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            v = xv * dimy + yv
+            e = etat.get(v, 0)
+            if e == FERME:
+                continue
+            d = _altitudeBruitee(dataMNT, xv, yv, noDataValue, amplitudeBruit, seed, realisation, bruitageActif)
+            candidate = altitude + epsilon if d <= altitude + epsilon else d
+            if e != ZONE:
+                #Hors zone : reprise seulement si la cellule est abaissée par une cellule elle-même abaissée ou recalculée
+                if not abaissee or candidate >= np.int64(mnt_filled[xv, yv]):
+                    continue
+                recalculees.append(v)
+                abaissees.add(v)
+            etat[v] = FERME
+            mnt_filled[xv, yv] = candidate
+            if d <= altitude + epsilon:
+                depression.append(v)
+            else:
+                heapq.heappush(ouverte, (candidate, v))
+
+    #Cellules de l'anneau qui n'ont plus de voisin plus bas (au moins epsilon en dessous) : leur exutoire a été relevé
+    bloquees = [np.int64(0) for _ in range(0)]
+    for c, e in etat.items():
+        if e != FERME or c in ancienne:
+            continue
+        x = c // dimy
+        y = c % dimy
+        altitude = np.int64(mnt_filled[x, y])
+        ok = False
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue or np.int64(mnt_filled[xv, yv]) + epsilon <= altitude:
+                ok = True
+                break
+        if not ok:
+            bloquees.append(c)
+    return np.array(recalculees, dtype=np.int64), np.array(bloquees, dtype=np.int64)
+
+
+@njit
+def voisinage1(cellules, dimx, dimy):
+    #Cellules et leurs 8 voisines, sans doublon
+    vues = set()
+    for c in cellules:
+        x = c // dimy
+        y = c % dimy
+        for i in range(9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy:
+                vues.add(xv * dimy + yv)
+    resultat = np.empty(len(vues), dtype=np.int64)
+    k = 0
+    for c in vues:
+        resultat[k] = c
+        k += 1
+    return resultat
+
+
+@njit
+def directionsLocales(mnt_filled, directionsEcoulement, cellules):
+    #Recalcule les directions des cellules (cf MFD_cpu.myk_directionsEcoulement, sans réécriture du MNT)
+    #Retourne (cellules dont les directions ont changé, anciennes directions (n, 8))
+    dimx, dimy = mnt_filled.shape
+    premier = directionsEcoulement.shape[2] - 8
+    voisinage = np.zeros(10, dtype=np.int32)
+    diff = np.zeros(11, dtype=np.uint16)
+    repartition = np.zeros(9, dtype=np.uint8)
+    changees = [np.int64(0) for _ in range(0)]
+    anciennes = np.zeros((cellules.shape[0], 8), dtype=np.uint8)
+    for c in cellules:
+        x = c // dimy
+        y = c % dimy
+        repartitionEcoulement(mnt_filled, x, y, dimx, dimy, voisinage, diff, repartition)
+        change = False
+        for i in range(1, 9):
+            if directionsEcoulement[x, y, i - 1 + premier] != repartition[i]:
+                change = True
+        if change:
+            for i in range(1, 9):
+                anciennes[len(changees), i - 1] = directionsEcoulement[x, y, i - 1 + premier]
+                directionsEcoulement[x, y, i - 1 + premier] = repartition[i]
+            changees.append(c)
+    return np.array(changees, dtype=np.int64), anciennes[:len(changees)]
+
+
+@njit
+def accumulationAval(dataMNT, directionsEcoulement, noDataValue, cellDrainees, graines, changees, anciennes):
+    #Recalcule l'aire drainée des graines et des cellules en aval des cellules changees (anciennes ou nouvelles directions)
+    #Les autres cellules gardent leur aire drainée : leur amont et ses directions n'ont pas changé ; retourne le nbr de cellules recalculées
+    dimx, dimy = dataMNT.shape
+    premier = directionsEcoulement.shape[2] - 8
+    ancien = dict()
+    for k in range(changees.shape[0]):
+        ancien[changees[k]] = k
+    indice = dict()
+    aval = [np.int64(0) for _ in range(0)]
+    for c in np.concatenate((graines, changees)):
+        if c not in indice:
+            indice[c] = len(aval)
+            aval.append(c)
+    k = 0
+    while k < len(aval):
+        c = aval[k]
+        k += 1
+        x = c // dimy
+        y = c % dimy
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy:
+                continue
+            recepteur = directionsEcoulement[x, y, i - 1 + premier] != 0
+            if c in ancien:
+                recepteur = recepteur or anciennes[ancien[c], i - 1] != 0
+            v = xv * dimy + yv
+            if recepteur and v not in indice:
+                indice[v] = len(aval)
+                aval.append(v)
+
+    #Kahn restreint aux cellules aval : apports des donneurs hors zone (aire inchangée) puis ordre amont-aval dans la zone
+    n = len(aval)
+    degres = np.zeros(n, dtype=np.int64)
+    aire = np.zeros(n, dtype=np.float64)
+    for k in range(n):
+        c = aval[k]
+        x = c // dimy
+        y = c % dimy
+        if dataMNT[x, y] == noDataValue:
+            continue
+        aire[k] = 1
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            pourcentage = directionsEcoulement[xv, yv, OPPOSE[i] - 1 + premier]
+            if pourcentage == 0:
+                continue
+            v = xv * dimy + yv
+            if v in indice:
+                degres[k] += 1
+            else:
+                aire[k] += cellDrainees[xv, yv] * pourcentage / 100
+    file = [np.int64(0) for _ in range(0)]
+    for k in range(n):
+        if degres[k] == 0:
+            file.append(k)
+    j = 0
+    while j < len(file):
+        k = file[j]
+        j += 1
+        c = aval[k]
+        x = c // dimy
+        y = c % dimy
+        cellDrainees[x, y] = aire[k]
+        if dataMNT[x, y] == noDataValue:
+            continue
+        for i in range(1, 9):
+            pourcentage = directionsEcoulement[x, y, i - 1 + premier]
+            if pourcentage == 0:
+                continue
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or dataMNT[xv, yv] == noDataValue:
+                continue
+            r = indice[xv * dimy + yv]
+            aire[r] += aire[k] * pourcentage / 100
+            degres[r] -= 1
+            if degres[r] == 0:
+                file.append(r)
+    return n
+
+
+@njit
+def codesLocaux(mnt_filled, mnt_codes_depr, noDataValue, cellules):
+    #Nbr de voisins valides inférieurs sur le MNT comblé (cf comblementPriorityFlood), pour les cellules données
+    dimx, dimy = mnt_filled.shape
+    for c in cellules:
+        x = c // dimy
+        y = c % dimy
+        if mnt_filled[x, y] == noDataValue:
+            mnt_codes_depr[x, y] = 0
+            continue
+        centre = np.int32(mnt_filled[x, y])
+        compte = 0
+        for i in range(1, 9):
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy:
+                v = np.int32(mnt_filled[xv, yv])
+                if v > 0 and v < centre:
+                    compte += 1
+        mnt_codes_depr[x, y] = compte
+
+
+def cellulesFenetre(l0, l1, c0, c1, dimx, dimy, marge=0):
+    #Indices x * dimy + y des cellules de la fenêtre élargie de marge (bornée au MNT)
+    x, y = np.mgrid[max(l0 - marge, 0):min(l1 + marge, dimx), max(c0 - marge, 0):min(c1 + marge, dimy)]
+    return (x * dimy + y).ravel().astype(np.int64)
+
+
+def miseAJourComblement(dataMNT, mnt_filled, directionsEcoulement, noDataValue, epsilon, bruit, l0, l1, c0, c1):
+    #Comblement local après modification de dataMNT sur [l0, l1[ x [c0, c1[ ; bruit : (amplitudeBruit, seed, realisation, bruitageActif)
+    #Retourne les cellules dont l'altitude comblée a été recalculée
+    dimx, dimy = dataMNT.shape
+    graines = cellulesFenetre(l0, l1, c0, c1, dimx, dimy, 1)
+    fenetre = dataMNT[max(l0 - 1, 0):l1 + 1, max(c0 - 1, 0):c1 + 1]
+    valides = fenetre[fenetre != noDataValue]
+    seuil = int(valides.max()) + bruit[0] + epsilon if valides.size else 0
+    zone = amont(directionsEcoulement, mnt_filled, graines, seuil)
+    while True:
+        recalculees, bloquees = comblementLocal(dataMNT, mnt_filled, noDataValue, epsilon, *bruit, zone)
+        if bloquees.size == 0:
+            return recalculees
+        #Exutoire relevé au-delà du seuil : la zone est étendue à l'amont des cellules bloquées
+        seuil = max(seuil, int(mnt_filled.ravel()[recalculees].max()) + epsilon)
+        zone = np.union1d(recalculees, amont(directionsEcoulement, mnt_filled, bloquees, seuil))
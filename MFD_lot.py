@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Traitement par lot de dalles de MNT sur un pool de processus
+
+Entrées : répertoires (toutes les dalles .tif), VRT (dalles référencées),
+listes de fichiers (.txt, un chemin par ligne) ou dalles GeoTIFF.
+Produits au choix, un GeoTIFF (COG) par dalle et par produit :
+- comble : MNT comblé (m, Float32) ;
+- directions : directions d'écoulement (8 bandes Byte, UInt16 ou Float32 selon --poids, cf MFD_tuiles.ecrireDirections) ;
+- accumulation : nbr de cellules drainées (Float32) ;
+- cretes : altitude des lignes de crête (cm, Int32, 0 hors crête ; 99999 est
+  seulement la valeur NoData déclarée du COG) ;
+- reseau : réseau hydrographique en polylignes avec ordre de Strahler
+  (GeoPackage, cf MFD_reseau ; seuil d'aire drainée --seuil-reseau).
+
+Reprise : une dalle dont tous les produits demandés existent, sont plus
+récents que le MNT et ont été calculés avec les mêmes paramètres est sautée
+(sauf --forcer) : les paramètres du calcul sont consignés à côté de chaque
+produit (fichier produit + ".parametres.json"). Les produits sont écrits
+sous un nom temporaire puis renommés, une dalle interrompue est donc
+recalculée à la relance. Une dalle en échec n'arrête pas le lot : l'erreur
+est consignée dans le journal (JSON, une ligne par dalle) du répertoire de
+sortie, et le code de retour est non nul.
+
+Chaque processus garde un ReseauDrainage (MFD_v3) dont les tableaux sont
+réutilisés d'une dalle à l'autre.
+
+Exemple : python MFD_lot.py dalles/ --sortie resultats --produits cretes accumulation -j 8
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import argparse
+import datetime
+import glob
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from osgeo import gdal
+import numba
+import MFD_altitudes
+import MFD_masque
+import MFD_raster
+import MFD_reseau
+import MFD_tuiles
+import MFD_v3
+
+PRODUITS = ["comble", "directions", "accumulation", "cretes", "reseau"]
+
+#ReseauDrainage du processus, créé par _initProcessus
+_reseau = None
+
+
+def listeDalles(entrees):
+    #Développe répertoires, VRT et listes de fichiers en une liste de dalles sans doublon, dans l'ordre
+    dalles = []
+    for entree in entrees:
+        if os.path.isdir(entree):
+            dalles += sorted(glob.glob(os.path.join(entree, "*.tif")) + glob.glob(os.path.join(entree, "*.tiff")))
+        elif entree.lower().endswith(".vrt"):
+            vrt = gdal.Open(entree)
+            dalles += [f for f in vrt.GetFileList() if os.path.abspath(f) != os.path.abspath(entree)]
+        elif entree.lower().endswith(".txt"):
+            with open(entree) as f:
+                dalles += [ligne.strip() for ligne in f if ligne.strip() and not ligne.startswith("#")]
+        else:
+            dalles.append(entree)
+    vues = set()
+    return [d for d in dalles if not (d in vues or vues.add(d))]
+
+
+def fichierProduit(repertoire, dalle, produit):
+    extension = ".gpkg" if produit == "reseau" else ".tif"
+    return os.path.join(repertoire, os.path.splitext(os.path.basename(dalle))[0] + "_" + produit + extension)
+
+
+def signatureLot(parametres, iteration=0, altitudes="cm", precision=0.01, seuilReseau=1000):
+    #Paramètres dont dépendent les produits (forme relue du JSON : listes au lieu de tuples), par produit
+    signature = json.loads(json.dumps({"parametres": parametres, "iteration": iteration, "altitudes": altitudes, "precision": precision}, sort_keys=True))
+    return {produit: dict(signature, seuilReseau=seuilReseau) if produit == "reseau" else signature for produit in PRODUITS}
+
+
+def fichierSignature(fichier):
+    return fichier + ".parametres.json"
+
+
+def aJour(dalle, repertoire, produits, signature=None):
+    #Vrai si tous les produits de la dalle existent, sont plus récents que le MNT et ont été calculés avec signature (cf signatureLot)
+    if not os.path.exists(dalle):
+        return False
+    date = os.path.getmtime(dalle)
+    for produit in produits:
+        fichier = fichierProduit(repertoire, dalle, produit)
+        if not os.path.exists(fichier) or os.path.getmtime(fichier) < date:
+            return False
+        if signature is not None:
+            try:
+                with open(fichierSignature(fichier)) as f:
+                    if json.load(f) != signature[produit]:
+                        return False
+            except (OSError, ValueError):
+                return False
+    return True
+
+
+def _initProcessus(parametres, nbrThreads):
+    global _reseau
+    if nbrThreads:
+        numba.set_num_threads(nbrThreads)
+    _reseau = MFD_v3.ReseauDrainage(**parametres)
+
+
+def _ecrire(fichier, ecriture, signature=None):
+    #Ecriture sous un nom temporaire puis renommage : un produit présent est toujours complet
+    #signature : paramètres du calcul, consignés après le produit (un produit sans signature à jour est recalculé)
+    racine, extension = os.path.splitext(fichier)
+    temporaire = racine + ".tmp" + extension
+    ecriture(temporaire) #le dataset GDAL retourné n'est pas conservé : il est fermé, donc écrit, avant le renommage
+    os.replace(temporaire, fichier)
+    if signature is not None:
+        with open(fichierSignature(fichier) + ".tmp", "w") as f:
+            json.dump(signature, f, sort_keys=True)
+        os.replace(fichierSignature(fichier) + ".tmp", fichierSignature(fichier))
+
+
+def traiterDalle(dalle, repertoire, produits, iteration=0, altitudes="cm", precision=0.01, seuilReseau=1000, signature=None):
+    #Calcule et écrit les produits d'une dalle avec le ReseauDrainage du processus ; retourne un enregistrement du journal
+    #altitudes, precision : codage des altitudes (cf MFD_altitudes.codageMNT), "cm" : conversion de MFD_v3.py
+    #signature : paramètres consignés avec chaque produit (cf signatureLot)
+    signature = signature or {}
+    debut = datetime.datetime.now()
+    try:
+        #Codage directement dans le tableau de travail des noyaux ; masque de validité conservé pour le seul mode masqué (CPU)
+        fichier_mnt, mnt, valide, codage = MFD_altitudes.lireMNT(dalle, precision, altitudes, travail=True, masque=bool(_reseau.tailleBlocMasque) and _reseau.moteur == "cpu")
+        NDV = fichier_mnt.GetRasterBand(1).GetNoDataValue()
+        _reseau.charger(mnt, codage.noData, codage, MFD_masque.compacter(valide) if valide is not None else None)
+        if "comble" in produits:
+            comble = _reseau.mntComble(iteration)
+            metres = codage.metres(comble, comble != _reseau.noDataValue, NDV if NDV is not None else -99999)
+            _ecrire(fichierProduit(repertoire, dalle, "comble"),
+                    lambda f: MFD_raster.ecrireCOG(f, fichier_mnt, metres, NDV if NDV is not None else -99999), signature.get("comble"))
+        if "directions" in produits:
+            directions = _reseau.directionsEcoulement(iteration)
+            _ecrire(fichierProduit(repertoire, dalle, "directions"),
+                    lambda f: MFD_tuiles.ecrireDirections(f, fichier_mnt, directions), signature.get("directions"))
+        if "accumulation" in produits:
+            aire = _reseau.aireDrainee(iteration).astype(np.float32)
+            _ecrire(fichierProduit(repertoire, dalle, "accumulation"),
+                    lambda f: MFD_raster.ecrireCOG(f, fichier_mnt, aire, 0), signature.get("accumulation"))
+        if "cretes" in produits:
+            cretes = _reseau.cretes(iteration)
+            if codage is MFD_altitudes.CODAGE_CM:
+                cretes = cretes.view(np.int32)
+            else:
+                cretes = np.where(cretes != 0, np.rint(codage.metres(cretes) * 100), 0).astype(np.int32) #altitudes en cm comme avec le codage "cm"
+            _ecrire(fichierProduit(repertoire, dalle, "cretes"),
+                    lambda f: MFD_raster.ecrireCOG(f, fichier_mnt, cretes, 99999), signature.get("cretes"))
+        if "reseau" in produits:
+            reseau = _reseau.reseau(seuilReseau, iteration)
+            _ecrire(fichierProduit(repertoire, dalle, "reseau"), lambda f: MFD_reseau.ecrireReseau(f, fichier_mnt, reseau), signature.get("reseau"))
+        return {"dalle": dalle, "etat": "ok", "duree": (datetime.datetime.now() - debut).total_seconds()}
+    except Exception:
+        return {"dalle": dalle, "etat": "echec", "duree": (datetime.datetime.now() - debut).total_seconds(), "erreur": traceback.format_exc()}
+
+
+def traitementLot(dalles, repertoire, produits=PRODUITS, nbrProcessus=None, forcer=False, parametres=None, iteration=0, altitudes="cm", precision=0.01,
+                  seuilReseau=1000):
+    #Retourne la liste des enregistrements du journal (dalles sautées comprises)
+    os.makedirs(repertoire, exist_ok=True)
+    parametres = parametres or {}
+    journal = open(os.path.join(repertoire, "journal_MFD.jsonl"), "a")
+    resultats = []
+    signature = signatureLot(parametres, iteration, altitudes, precision, seuilReseau)
+
+    def consigner(enregistrement):
+        resultats.append(enregistrement)
+        journal.write(json.dumps(enregistrement) + "\n")
+        journal.flush()
+        print("...%-6s %s (%.1f s)" % (enregistrement["etat"], enregistrement["dalle"], enregistrement.get("duree", 0)))
+
+    aFaire = []
+    for dalle in dalles:
+        if not forcer and aJour(dalle, repertoire, produits, signature):
+            consigner({"dalle": dalle, "etat": "a_jour"})
+        else:
+            aFaire.append(dalle)
+
+    nbrProcessus = nbrProcessus or os.cpu_count()
+    nbrThreads = max(os.cpu_count() // nbrProcessus, 1)
+    if nbrProcessus == 1:
+        _initProcessus(parametres, None)
+        for dalle in aFaire:
+            consigner(traiterDalle(dalle, repertoire, produits, iteration, altitudes, precision, seuilReseau, signature))
+    else:
+        with ProcessPoolExecutor(max_workers=nbrProcessus, initializer=_initProcessus, initargs=(parametres, nbrThreads)) as pool:
+            taches = [pool.submit(traiterDalle, dalle, repertoire, produits, iteration, altitudes, precision, seuilReseau, signature) for dalle in aFaire]
+            for tache in as_completed(taches):
+                consigner(tache.result())
+    journal.close()
+    return resultats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calcul MFD par lot sur des dalles de MNT")
+    parser.add_argument("entrees", nargs="+", help="répertoires, VRT, listes de fichiers (.txt) ou dalles GeoTIFF")
+    parser.add_argument("--sortie", required=True, help="répertoire des produits et du journal")
+    parser.add_argument("--produits", nargs="+", default=["cretes"], choices=PRODUITS)
+    parser.add_argument("-j", "--processus", type=int, default=None, help="nbr de processus (défaut : nbr de coeurs ; 1 en GPU)")
+    parser.add_argument("--forcer", action="store_true", help="recalculer les dalles déjà à jour")
+    parser.add_argument("--moteur", choices=["auto", "cpu", "gpu"], default=None)
+    parser.add_argument("--amplitude", type=int, default=20, help="amplitude du bruitage (cm)")
+    parser.add_argument("--sans-bruit", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--iteration", type=int, default=0, help="numéro de la réalisation du bruit")
+    parser.add_argument("--epsilon", type=int, default=1, help="pente minimale (cm) dans les zones comblées")
+    parser.add_argument("--directions", choices=["noyau", "vectorisee"], default="noyau", help="calcul des directions (noyau ou plans décalés)")
+    parser.add_argument("--plats", action="store_true", help="directions d'écoulement sur les zones plates (utile avec --epsilon 0)")
+    parser.add_argument("--routage", choices=["lineaire", "d8", "dinf", "freeman", "quinn"], default="lineaire", help="modèle de routage des écoulements")
+    parser.add_argument("--exposant", type=float, default=1.1, help="exposant des pentes (routage freeman et quinn)")
+    parser.add_argument("--poids", choices=["pourcentage", "fixe16", "float32"], default="pourcentage",
+                        help="type des poids des directions (virgule fixe 16 bits ou float32 : normalisés en une passe)")
+    parser.add_argument("--altitudes", choices=["cm", "auto", "uint16", "int32"], default="cm",
+                        help="codage des altitudes : cm (uint32, comme MFD_v3.py) ou plus petit type sûr à --precision près")
+    parser.add_argument("--precision", type=float, default=0.01, help="précision des altitudes (m) ; amplitude et epsilon sont exprimés dans cette unité")
+    parser.add_argument("--blocs-masque", type=int, default=None, help="taille des blocs du masque NoData (multiple de 8) : blocs NoData sautés en CPU seulement, "
+                        "sans effet sur les noyaux GPU")
+    parser.add_argument("--seuil-reseau", type=float, default=1000, help="aire drainée minimale (nbr de cellules) du réseau hydrographique")
+    parser.add_argument("--format-directions", choices=["cube", "compact", "csr"], default="cube")
+    parser.add_argument("--memoire-partagee", action="store_true", help="noyaux GPU à tuiles en mémoire partagée")
+    args = parser.parse_args()
+
+    parametres = {"moteur": args.moteur, "amplitudeBruit": args.amplitude, "bruitageActif": 0 if args.sans_bruit else 1, "seed": args.seed,
+                  "epsilonComblement": args.epsilon, "formatDirections": args.format_directions,
+                  "tailleBlocMasque": args.blocs_masque, "resolutionPlats": args.plats, "methodeDirections": args.directions,
+                  "routage": args.routage, "exposantRoutage": args.exposant,
+                  "typePoids": args.poids, "memoirePartagee": args.memoire_partagee}
+    nbrProcessus = args.processus or (1 if MFD_v3.choixMoteur(args.moteur) == "gpu" else None)
+    debut = datetime.datetime.now()
+    dalles = listeDalles(args.entrees)
+    resultats = traitementLot(dalles, args.sortie, args.produits, nbrProcessus, args.forcer, parametres, args.iteration, args.altitudes, args.precision,
+                              args.seuil_reseau)
+    echecs = [r for r in resultats if r["etat"] == "echec"]
+    print("...Lot de", len(dalles), "dalles terminé en :", datetime.datetime.now() - debut, "-", len(echecs), "échec(s)")
+    sys.exit(1 if echecs else 0)
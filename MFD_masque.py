@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Masque de validité compacté (1 bit par cellule) et saut des blocs NoData
+
+Le masque est lu une fois, à partir de GetNoDataValue() de la bande source
+(masqueBande) ou de la valeur NoData du MNT en cm (masqueValidite), puis
+partagé par les étapes : 8 fois moins de mémoire qu'un masque booléen, 32
+fois moins que le MNT. Bits rangés par lignes, 8 colonnes par octet, bit de
+poids faible en premier (np.packbits(..., bitorder="little")).
+
+blocsValides résume le masque par blocs de tailleBloc x tailleBloc cellules :
+un bloc sans cellule valide est sauté par les noyaux *Blocs (remplissage
+direct du résultat), ce qui est un gain direct sur les départements côtiers
+ou frontaliers, souvent à plus de 40 % de NoData.
+
+Les noyaux *Blocs donnent le même résultat que myk_bruitageCompteur et
+myk_directionsEcoulement (MFD_cpu.py) sans modifier le MNT d'entrée : les
+cellules invalides sont exclues par le masque au lieu d'être réécrites à
+99999 (directions nulles, pas de récepteur NoData).
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+from numba import cuda, njit, prange
+from MFD_aleatoire import bruitCellule
+from MFD_cpu import repartitionEcoulement
+
+
+def compacter(valide):
+    #Masque booléen (dim1, dim2) -> masque compacté (dim1, ceil(dim2 / 8)) uint8
+    return np.packbits(valide, axis=1, bitorder="little")
+
+
+def depaqueter(masque, dim2):
+    return np.unpackbits(masque, axis=1, count=dim2, bitorder="little").view(np.bool_)
+
+
+def masqueValidite(mnt, noDataValue, nbrLignesBloc=1024):
+    #Masque compacté des cellules différentes de noDataValue, par blocs de lignes (pas de masque booléen de la taille du MNT)
+    dim1, dim2 = mnt.shape
+    masque = np.empty((dim1, (dim2 + 7) // 8), dtype=np.uint8)
+    for l0 in range(0, dim1, nbrLignesBloc):
+        masque[l0:l0 + nbrLignesBloc] = compacter(mnt[l0:l0 + nbrLignesBloc] != noDataValue)
+    return masque
+
+
+def masqueBande(bande, nbrLignesBloc=1024):
+    #Masque compacté lu directement dans la bande GDAL : cellules différentes de GetNoDataValue() et non NaN
+    dim1, dim2 = bande.YSize, bande.XSize
+    NDV = bande.GetNoDataValue()
+    masque = np.empty((dim1, (dim2 + 7) // 8), dtype=np.uint8)
+    for l0 in range(0, dim1, nbrLignesBloc):
+        bloc = bande.ReadAsArray(0, l0, dim2, min(nbrLignesBloc, dim1 - l0))
+        valide = ~np.isnan(bloc) if bloc.dtype.kind == "f" else np.ones(bloc.shape, dtype=np.bool_)
+        if NDV is not None:
+            valide &= bloc != NDV
+        masque[l0:l0 + nbrLignesBloc] = compacter(valide)
+    return masque
+
+
+def _estValide(masque, x, y):
+    return (masque[x, y >> 3] >> (y & 7)) & 1 == 1
+
+
+estValide = njit(_estValide)
+estValideDevice = cuda.jit(device=True)(_estValide)
+
+
+def blocsValides(masque, tailleBloc=256):
+    #blocs[i, j] : le bloc [i * tailleBloc, (i + 1) * tailleBloc[ x [j * tailleBloc, ...[ contient au moins une cellule valide
+    if tailleBloc % 8 != 0:
+        raise ValueError("tailleBloc doit être un multiple de 8 (colonnes compactées par octets) : %d" % tailleBloc)
+    dim1, n = masque.shape
+    octets = tailleBloc // 8
+    nbrBlocsX, nbrBlocsY = -(-dim1 // tailleBloc), -(-n // octets)
+    lignes = np.zeros((nbrBlocsX, n), dtype=np.bool_)
+    for i in range(nbrBlocsX):
+        lignes[i] = masque[i * tailleBloc:(i + 1) * tailleBloc].any(axis=0)
+    lignes = np.pad(lignes, ((0, 0), (0, nbrBlocsY * octets - n)))
+    return lignes.reshape(nbrBlocsX, nbrBlocsY, octets).any(axis=2)
+
+
+def fractionNoData(masque, dim2):
+    #Part des cellules invalides (les bits de bourrage de la dernière colonne d'octets sont à 0 : non comptés comme valides)
+    return 1 - np.unpackbits(masque, bitorder="little").sum() / (masque.shape[0] * dim2)
+
+
+@njit(parallel=True)
+def myk_bruitageBlocs(mnt_source, mnt_bruite, noDataValue, amplitudeBruit, seed, realisation, bruitageActif, masque, blocs, tailleBloc):
+    #myk_bruitageCompteur restreint aux blocs valides ; les blocs entièrement NoData sont remplis sans lecture du MNT
+    dimx, dimy = mnt_source.shape
+    nbrBlocsY = blocs.shape[1]
+    for b in prange(blocs.shape[0] * nbrBlocsY):
+        l0 = (b // nbrBlocsY) * tailleBloc
+        c0 = (b % nbrBlocsY) * tailleBloc
+        l1 = min(l0 + tailleBloc, dimx)
+        c1 = min(c0 + tailleBloc, dimy)
+        if not blocs[b // nbrBlocsY, b % nbrBlocsY]:
+            mnt_bruite[l0:l1, c0:c1] = noDataValue
+            continue
+        for pos_x in range(l0, l1):
+            for pos_y in range(c0, c1):
+                if not estValide(masque, pos_x, pos_y):
+                    mnt_bruite[pos_x, pos_y] = noDataValue
+                else:
+                    bruitage = bruitCellule(seed, realisation, pos_x, pos_y, amplitudeBruit)
+                    mnt_bruite[pos_x, pos_y] = mnt_source[pos_x, pos_y] + bruitageActif * bruitage
+
+
+@njit(parallel=True)
+def myk_directionsBlocs(dataMNT, directionsEcoulement, masque, blocs, tailleBloc):
+    #myk_directionsEcoulement restreint aux blocs valides, sans écriture dans dataMNT ; cube (dimx, dimy, 9) ou format compact (dimx, dimy, 8)
+    #Les cellules NoData doivent valoir une valeur lue négative dans le voisinage int32 (4284967396), comme dans MFD_v3.py
+    dimx, dimy = dataMNT.shape
+    premier = directionsEcoulement.shape[2] - 8
+    nbrBlocsY = blocs.shape[1]
+    for b in prange(blocs.shape[0] * nbrBlocsY):
+        l0 = (b // nbrBlocsY) * tailleBloc
+        c0 = (b % nbrBlocsY) * tailleBloc
+        l1 = min(l0 + tailleBloc, dimx)
+        c1 = min(c0 + tailleBloc, dimy)
+        if not blocs[b // nbrBlocsY, b % nbrBlocsY]:
+            directionsEcoulement[l0:l1, c0:c1, :] = 0
+            continue
+        voisinage = np.zeros(10, dtype=np.int32)
+        diff = np.zeros(11, dtype=np.uint16)
+        repartition = np.zeros(9, dtype=np.uint8)
+        for pos_x in range(l0, l1):
+            for pos_y in range(c0, c1):
+                if estValide(masque, pos_x, pos_y):
+                    repartitionEcoulement(dataMNT, pos_x, pos_y, dimx, dimy, voisinage, diff, repartition)
+                else:
+                    repartition[:] = 0
+                for i in range(1, 9):
+                    directionsEcoulement[pos_x, pos_y, i - 1 + premier] = repartition[i]
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Résolution des zones plates : directions d'écoulement sur les plateaux et les zones comblées à plat
+
+Une cellule sans voisin valide strictement inférieur reçoit des directions
+nulles dans myk_directionsEcoulement (diff[9] == 0) : après un comblement à
+plat (methodeComblement "exutoires", ou epsilonComblement = 0), les plateaux
+et les lacs comblés ne drainent rien et l'accumulation s'y arrête.
+
+Méthode de Barnes, Lehman et Mulla (2014, "An efficient assignment of
+drainage direction over flat surfaces"), en temps linéaire :
+- bords bas : cellules qui s'écoulent, voisines d'une cellule plate de même
+  altitude, et cellules plates terminales (bord du MNT ou voisines d'une
+  cellule NoData, qui drainent hors du MNT comme dans le comblement) ;
+- bords hauts : cellules plates voisines d'une cellule plus haute ;
+- chaque plat est étiqueté depuis ses bords bas (cellules de même altitude,
+  8-connexité), puis deux parcours en largeur donnent un gradient qui
+  s'éloigne des bords hauts et un gradient qui mène aux bords bas ; leur
+  combinaison (masque) décroît strictement vers les bords bas depuis toute
+  cellule plate.
+
+directionsPlats remplace les directions nulles des cellules plates par une
+répartition MFD vers les voisins du même plat de masque inférieur,
+proportionnelle aux écarts de masque (mêmes arrondis que
+repartitionEcoulement en pourcentages, MFD_routage.fractionsCellule pour les
+autres types de poids). Toute cellule valide a alors un récepteur, sauf les
+cellules terminales et les plats sans bord bas (entourés de NoData).
+
+Les cellules valides sont celles lues > 0 dans le voisinage int32 (cf
+MFD_voisinage) : NoData (4284967396) et hors MNT sont exclus.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+from numba import njit
+from MFD_directions import echellePoids
+from MFD_routage import fractionsCellule
+from MFD_voisinage import DX, DY
+
+
+@njit
+def _valide(valeur):
+    return valeur > 0 and valeur < 2147483648
+
+
+@njit
+def _plate(dataMNT, x, y, dimx, dimy):
+    #Cellule valide sans voisin valide strictement inférieur
+    z = dataMNT[x, y]
+    if not _valide(z):
+        return False
+    for i in range(1, 9):
+        xv = x + DX[i]
+        yv = y + DY[i]
+        if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and _valide(dataMNT[xv, yv]) and dataMNT[xv, yv] < z:
+            return False
+    return True
+
+
+@njit
+def _terminale(dataMNT, x, y, dimx, dimy):
+    #Cellule du bord du MNT ou voisine d'une cellule invalide
+    for i in range(1, 9):
+        xv = x + DX[i]
+        yv = y + DY[i]
+        if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or not _valide(dataMNT[xv, yv]):
+            return True
+    return False
+
+
+@njit
+def gradientsPlats(dataMNT, masque, etiquettes):
+    #masque : gradient combiné sur les plats (> 0), 0 ailleurs ; etiquettes : n° du plat (1, 2...) des cellules de même altitude
+    #reliées à un bord bas, 0 ailleurs ; retourne le nbr de plats
+    dimx, dimy = dataMNT.shape
+    plate = np.zeros((dimx, dimy), dtype=np.bool_)
+    for x in range(dimx):
+        for y in range(dimy):
+            masque[x, y] = 0
+            etiquettes[x, y] = 0
+            plate[x, y] = _plate(dataMNT, x, y, dimx, dimy)
+
+    #Bords bas et bords hauts
+    basses = np.empty(dimx * dimy, dtype=np.int64)
+    hautes = np.empty(dimx * dimy, dtype=np.int64)
+    nbrBasses = 0
+    nbrHautes = 0
+    for x in range(dimx):
+        for y in range(dimy):
+            z = dataMNT[x, y]
+            if not _valide(z):
+                continue
+            terminale = _terminale(dataMNT, x, y, dimx, dimy)
+            voisinPlat = False
+            superieur = False
+            for i in range(1, 9):
+                xv = x + DX[i]
+                yv = y + DY[i]
+                if xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or not _valide(dataMNT[xv, yv]):
+                    continue
+                if dataMNT[xv, yv] == z and plate[xv, yv]:
+                    voisinPlat = True
+                elif dataMNT[xv, yv] > z:
+                    superieur = True
+            if voisinPlat and (not plate[x, y] or terminale):
+                basses[nbrBasses] = x * dimy + y
+                nbrBasses += 1
+            elif plate[x, y] and superieur and not terminale:
+                hautes[nbrHautes] = x * dimy + y
+                nbrHautes += 1
+
+    #Etiquetage des plats depuis les bords bas
+    file = np.empty(dimx * dimy, dtype=np.int64)
+    nbrPlats = 0
+    for k in range(nbrBasses):
+        x0 = basses[k] // dimy
+        y0 = basses[k] % dimy
+        if etiquettes[x0, y0] != 0:
+            continue
+        nbrPlats += 1
+        z = dataMNT[x0, y0]
+        etiquettes[x0, y0] = nbrPlats
+        file[0] = basses[k]
+        debut = 0
+        fin = 1
+        while debut < fin:
+            x = file[debut] // dimy
+            y = file[debut] % dimy
+            debut += 1
+            for i in range(1, 9):
+                xv = x + DX[i]
+                yv = y + DY[i]
+                if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and etiquettes[xv, yv] == 0 and dataMNT[xv, yv] == z:
+                    etiquettes[xv, yv] = nbrPlats
+                    file[fin] = xv * dimy + yv
+                    fin += 1
+
+    #Gradient qui s'éloigne des bords hauts (bords hauts des plats sans bord bas ignorés), couche par couche
+    hauteur = np.zeros(nbrPlats + 1, dtype=np.int32)
+    fin = 0
+    for k in range(nbrHautes):
+        x = hautes[k] // dimy
+        y = hautes[k] % dimy
+        if etiquettes[x, y] != 0:
+            masque[x, y] = 1
+            file[fin] = hautes[k]
+            fin += 1
+    debut = 0
+    couche = 1
+    while debut < fin:
+        finCouche = fin
+        while debut < finCouche:
+            x = file[debut] // dimy
+            y = file[debut] % dimy
+            debut += 1
+            hauteur[etiquettes[x, y]] = couche
+            for i in range(1, 9):
+                xv = x + DX[i]
+                yv = y + DY[i]
+                if (xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and masque[xv, yv] == 0 and plate[xv, yv]
+                        and etiquettes[xv, yv] == etiquettes[x, y]):
+                    masque[xv, yv] = couche + 1
+                    file[fin] = xv * dimy + yv
+                    fin += 1
+        couche += 1
+
+    #Gradient qui mène aux bords bas, combiné au précédent : 2 * couche + (hauteur du plat - gradient des bords hauts)
+    atteinte = np.zeros((dimx, dimy), dtype=np.bool_)
+    fin = 0
+    for k in range(nbrBasses):
+        atteinte[basses[k] // dimy, basses[k] % dimy] = True
+        file[fin] = basses[k]
+        fin += 1
+    debut = 0
+    couche = 1
+    while debut < fin:
+        finCouche = fin
+        while debut < finCouche:
+            x = file[debut] // dimy
+            y = file[debut] % dimy
+            debut += 1
+            if masque[x, y] > 0:
+                masque[x, y] = hauteur[etiquettes[x, y]] - masque[x, y] + 2 * couche
+            else:
+                masque[x, y] = 2 * couche
+            for i in range(1, 9):
+                xv = x + DX[i]
+                yv = y + DY[i]
+                if (xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and not atteinte[xv, yv] and plate[xv, yv]
+                        and etiquettes[xv, yv] == etiquettes[x, y]):
+                    atteinte[xv, yv] = True
+                    file[fin] = xv * dimy + yv
+                    fin += 1
+        couche += 1
+    return nbrPlats
+
+
+@njit
+def directionsPlats(dataMNT, masque, etiquettes, directionsEcoulement, echelle=100):
+    #Directions des cellules plates non terminales : voisins du même plat de masque inférieur, au prorata des écarts de masque
+    #directionsEcoulement : cube (dimx, dimy, 9) ou format compact (dimx, dimy, 8) ; echelle : cf MFD_directions.TYPES_POIDS
+    #Retourne le nbr de cellules modifiées
+    dimx, dimy = dataMNT.shape
+    premier = directionsEcoulement.shape[2] - 8
+    diff = np.zeros(9, dtype=np.int64)
+    repartition = np.zeros(9, dtype=np.uint8)
+    fractions = np.zeros(9, dtype=np.float64)
+    poids = np.zeros(9, dtype=np.float64)
+    nbr = 0
+    for x in range(dimx):
+        for y in range(dimy):
+            if etiquettes[x, y] == 0 or not _plate(dataMNT, x, y, dimx, dimy) or _terminale(dataMNT, x, y, dimx, dimy):
+                continue
+            total = 0
+            for i in range(1, 9):
+                xv = x + DX[i]
+                yv = y + DY[i]
+                diff[i] = 0
+                if etiquettes[xv, yv] == etiquettes[x, y] and masque[xv, yv] < masque[x, y]:
+                    diff[i] = masque[x, y] - masque[xv, yv]
+                    total += diff[i]
+            if total == 0:
+                continue
+            nbr += 1
+            if echelle != 100:
+                for i in range(9):
+                    poids[i] = diff[i]
+                fractionsCellule(poids, echelle, echelle > 1, fractions)
+                for i in range(1, 9):
+                    directionsEcoulement[x, y, i - 1 + premier] = fractions[i]
+                continue
+            somme = 0
+            for i in range(1, 9):
+                repartition[i] = np.uint8(100 * diff[i] / total)
+                somme += repartition[i]
+            #Même correction que repartitionEcoulement pour une somme de 100
+            reste = 100 - somme
+            for passe in range(2):
+                for i in range(1, 9):
+                    if repartition[i] != 0 and reste > 0:
+                        repartition[i] += 1
+                        reste -= 1
+            for i in range(1, 9):
+                directionsEcoulement[x, y, i - 1 + premier] = repartition[i]
+    return nbr
+
+
+def resoudrePlats(dataMNT, directionsEcoulement):
+    #Gradients et directions des plats en une fois ; retourne (nbr de plats, nbr de cellules dont les directions ont été définies)
+    masque = np.empty(dataMNT.shape, dtype=np.int32)
+    etiquettes = np.empty(dataMNT.shape, dtype=np.int32)
+    nbrPlats = gradientsPlats(dataMNT, masque, etiquettes)
+    echelle = float(echellePoids(directionsEcoulement.dtype))
+    return nbrPlats, directionsPlats(dataMNT, masque, etiquettes, directionsEcoulement, echelle)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Mesure des temps par étape (lecture GDAL, transferts, bruitage, passes de
+comblement, directions, accumulation, écriture)
+
+Chaque étape enregistre sa durée, les octets déplacés et le débit en cellules
+par seconde. Le rapport est exporté en JSON et en CSV, et en option sous
+forme de chronologie Chrome (chrome://tracing ou https://ui.perfetto.dev).
+
+Activation sans modifier les scripts : variable d'environnement
+MFD_PROFIL=<préfixe> -> <préfixe>.json, <préfixe>.csv et <préfixe>.trace.json
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import csv
+import json
+import os
+import time
+from contextlib import contextmanager
+
+CHAMPS = ["etape", "iteration", "debut", "duree", "octets", "cellules", "cellulesParSeconde", "octetsParSeconde"]
+
+
+class Profil:
+    """Journal des étapes ; synchroniser : fonction appelée avant chaque mesure (cuda.synchronize en GPU)"""
+    def __init__(self, synchroniser=None):
+        self.synchroniser = synchroniser
+        self.origine = time.perf_counter()
+        self.mesures = []
+        self.enCours = []
+
+    def debut(self, etape, iteration=None):
+        if self.synchroniser is not None:
+            self.synchroniser()
+        self.enCours.append((etape, iteration, time.perf_counter()))
+
+    def fin(self, octets=0, cellules=0):
+        if self.synchroniser is not None:
+            self.synchroniser()
+        etape, iteration, t0 = self.enCours.pop()
+        duree = time.perf_counter() - t0
+        self.mesures.append({"etape": etape, "iteration": iteration, "debut": t0 - self.origine, "duree": duree,
+                             "octets": int(octets), "cellules": int(cellules),
+                             "cellulesParSeconde": cellules / duree if duree > 0 else 0.0,
+                             "octetsParSeconde": octets / duree if duree > 0 else 0.0})
+        return duree
+
+    @contextmanager
+    def etape(self, etape, iteration=None, octets=0, cellules=0):
+        self.debut(etape, iteration)
+        try:
+            yield
+        finally:
+            self.fin(octets, cellules)
+
+    def resume(self):
+        #Durée totale, nbr d'appels et octets par étape, dans l'ordre de première apparition
+        totaux = {}
+        for m in self.mesures:
+            t = totaux.setdefault(m["etape"], {"appels": 0, "duree": 0.0, "octets": 0, "cellules": 0})
+            t["appels"] += 1
+            t["duree"] += m["duree"]
+            t["octets"] += m["octets"]
+            t["cellules"] += m["cellules"]
+        return totaux
+
+    def afficher(self):
+        for etape, t in self.resume().items():
+            debit = t["cellules"] / t["duree"] / 1e6 if t["duree"] > 0 else 0.0
+            print("...%-20s : %3d appel(s), %9.3f s, %10.1f Mo, %9.3f Mcellules/s" % (etape, t["appels"], t["duree"], t["octets"] / 2**20, debit))
+
+    def ecrireJSON(self, fichier):
+        with open(fichier, "w") as f:
+            json.dump({"mesures": self.mesures, "resume": self.resume()}, f, indent=1)
+
+    def ecrireCSV(self, fichier):
+        with open(fichier, "w", newline="") as f:
+            ecrivain = csv.DictWriter(f, fieldnames=CHAMPS)
+            ecrivain.writeheader()
+            ecrivain.writerows(self.mesures)
+
+    def ecrireTrace(self, fichier):
+        #Format Chrome trace : événements complets ("X"), temps en microsecondes
+        evenements = [{"name": m["etape"], "cat": "MFD", "ph": "X", "pid": os.getpid(), "tid": 0,
+                       "ts": m["debut"] * 1e6, "dur": m["duree"] * 1e6,
+                       "args": {k: m[k] for k in ("iteration", "octets", "cellules", "cellulesParSeconde")}} for m in self.mesures]
+        with open(fichier, "w") as f:
+            json.dump({"traceEvents": evenements, "displayTimeUnit": "ms"}, f)
+
+    def exporter(self, prefixe=None):
+        #Ecrit les trois rapports si un préfixe est donné (par défaut la variable d'environnement MFD_PROFIL)
+        prefixe = prefixe or os.environ.get("MFD_PROFIL")
+        if not prefixe:
+            return
+        self.ecrireJSON(prefixe + ".json")
+        self.ecrireCSV(prefixe + ".csv")
+        self.ecrireTrace(prefixe + ".trace.json")
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Entrées / sorties raster sans copie
+
+- mntCm : MNT converti en cm (uint32) dans un fichier .npy annexe, mappé en
+  mémoire ; la conversion mètres -> cm est faite par blocs de lignes, sans
+  tableau temporaire de la taille du MNT, et n'est refaite que si le GeoTIFF
+  source est plus récent que le fichier annexe ;
+- lireEnPlace : GTiff non compressé exposé directement comme tableau numpy
+  (mémoire virtuelle GDAL), lecture ou écriture en place ;
+- ecrireCOG : écriture d'un tableau en GeoTIFF optimisé pour le cloud (COG),
+  tuilé et compressé, l'encodage des blocs étant réparti sur tous les coeurs.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+import os
+from osgeo import gdal, gdal_array
+from MFD_tuiles import noDataCm
+
+#Options du pilote COG : tuiles de 512, DEFLATE, encodage multi-thread
+OPTIONS_COG = ["BLOCKSIZE=512", "COMPRESS=DEFLATE", "NUM_THREADS=ALL_CPUS", "BIGTIFF=IF_SAFER"]
+#Repli si le pilote COG n'est pas disponible (GDAL < 3.1)
+OPTIONS_GTIFF_COG = ["TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512", "COMPRESS=DEFLATE", "NUM_THREADS=ALL_CPUS", "BIGTIFF=IF_SAFER"]
+
+
+def mntCm(fichier, nbrLignesBloc=1024, annexe=None):
+    #Retourne (dataset GDAL, MNT en cm mappé en mémoire, noDataValue en cm)
+    #annexe : fichier .npy du MNT converti, par défaut fichier + ".cm.npy"
+    fichier_mnt = gdal.Open(fichier)
+    bande = fichier_mnt.GetRasterBand(1)
+    NDV = bande.GetNoDataValue()
+    noDataValue = noDataCm(NDV)
+    annexe = annexe or fichier + ".cm.npy"
+    if os.path.exists(annexe) and os.path.getmtime(annexe) >= os.path.getmtime(fichier):
+        return fichier_mnt, np.load(annexe, mmap_mode="r"), noDataValue
+
+    dim1, dim2 = fichier_mnt.RasterYSize, fichier_mnt.RasterXSize
+    mnt = np.lib.format.open_memmap(annexe + ".tmp", mode="w+", dtype=np.uint32, shape=(dim1, dim2))
+    for l0 in range(0, dim1, nbrLignesBloc):
+        l1 = min(l0 + nbrLignesBloc, dim1)
+        bloc = bande.ReadAsArray(0, l0, dim2, l1 - l0)
+        noData = bloc == NDV if NDV is not None else None
+        #Même conversion que np.ascontiguousarray(h_mnt * 100, dtype=np.uint32), bloc par bloc
+        np.multiply(bloc, 100, out=bloc, casting="unsafe")
+        mnt[l0:l1] = bloc.astype(np.int64)
+        if noData is not None:
+            mnt[l0:l1][noData] = noDataValue
+    mnt.flush()
+    del mnt
+    os.replace(annexe + ".tmp", annexe)
+    return fichier_mnt, np.load(annexe, mmap_mode="r"), noDataValue
+
+
+def lireEnPlace(fichier, ecriture=False, numBande=1):
+    #Tableau numpy adossé au fichier (GTiff non compressé) : aucune copie, les écritures vont directement dans le fichier
+    #Le dataset retourné doit rester ouvert tant que le tableau est utilisé ; repli sur ReadAsArray si le fichier n'est pas mappable
+    dataset = gdal.Open(fichier, gdal.GA_Update if ecriture else gdal.GA_ReadOnly)
+    bande = dataset.GetRasterBand(numBande)
+    try:
+        return dataset, bande.GetVirtualMemAutoArray(gdal.GF_Write if ecriture else gdal.GF_Read)
+    except (AttributeError, RuntimeError):
+        return dataset, bande.ReadAsArray()
+
+
+def creerEnPlace(fichier, fichier_mnt, typeGDAL, noData=None):
+    #GTiff non compressé, non tuilé, de même emprise que fichier_mnt, ouvert en écriture en place (cf lireEnPlace)
+    driver = gdal.GetDriverByName("GTiff")
+    outdata = driver.Create(fichier, fichier_mnt.RasterXSize, fichier_mnt.RasterYSize, 1, typeGDAL, options=["BIGTIFF=IF_SAFER"])
+    outdata.SetGeoTransform(fichier_mnt.GetGeoTransform())
+    outdata.SetProjection(fichier_mnt.GetProjection())
+    if noData is not None:
+        outdata.GetRasterBand(1).SetNoDataValue(noData)
+    outdata = None
+    return lireEnPlace(fichier, ecriture=True)
+
+
+def ecrireCOG(fichier, fichier_mnt, tableau, noData=None):
+    #Le tableau est exposé à GDAL sans copie (dataset MEM) puis recopié en COG
+    source = gdal_array.OpenArray(np.ascontiguousarray(tableau))
+    source.SetGeoTransform(fichier_mnt.GetGeoTransform())
+    source.SetProjection(fichier_mnt.GetProjection())
+    if noData is not None:
+        source.GetRasterBand(1).SetNoDataValue(noData)
+    driver = gdal.GetDriverByName("COG")
+    if driver is not None:
+        sortie = driver.CreateCopy(fichier, source, options=OPTIONS_COG)
+    else:
+        sortie = gdal.GetDriverByName("GTiff").CreateCopy(fichier, source, options=OPTIONS_GTIFF_COG)
+    sortie.FlushCache()
+    return sortie
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Extraction et vectorisation du réseau hydrographique à partir des aires drainées
+
+- les cellules du réseau sont celles dont l'aire drainée (en nbr de cellules)
+  atteint le seuil ; chacune est reliée à son récepteur principal dans le
+  réseau (plus fort pourcentage des directions d'écoulement), indice calculé
+  une fois pour toutes (avalDominant) ;
+- ordre de Strahler par parcours amont-aval des cellules du réseau (Kahn) ;
+- tronçons : d'une source ou d'une confluence à la confluence ou à l'exutoire
+  suivant, chaque cellule n'étant parcourue qu'une fois ;
+- écriture en polylignes GeoPackage (OGR) : identifiant, ordre de Strahler,
+  tronçon aval, aire drainée à l'extrémité aval, longueur.
+
+Seules les cellules du réseau sont stockées (indices triés, recherche du
+récepteur par dichotomie) : la mémoire suit la taille du réseau, pas celle du
+MNT.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import os
+import struct
+import numpy as np
+from numba import njit, prange
+from osgeo import ogr, osr
+from MFD_voisinage import DX, DY
+
+
+@njit(parallel=True)
+def avalDominant(cellDrainees, directionsEcoulement, cellules, seuil):
+    #aval[k] : rang dans cellules (indices x * dimy + y triés) du récepteur principal de cellules[k] dans le réseau, -1 à un exutoire
+    dimx, dimy = cellDrainees.shape
+    premier = directionsEcoulement.shape[2] - 8
+    aval = np.empty(cellules.shape[0], dtype=np.int64)
+    for k in prange(cellules.shape[0]):
+        x = cellules[k] // dimy
+        y = cellules[k] % dimy
+        meilleur = 0
+        aval[k] = -1
+        for i in range(1, 9):
+            pourcentage = directionsEcoulement[x, y, i - 1 + premier]
+            xv = x + DX[i]
+            yv = y + DY[i]
+            if pourcentage <= meilleur or xv < 0 or yv < 0 or xv >= dimx or yv >= dimy or not cellDrainees[xv, yv] >= seuil:
+                continue
+            meilleur = pourcentage
+            aval[k] = np.searchsorted(cellules, xv * dimy + yv)
+    return aval
+
+
+@njit
+def strahler(aval):
+    #Ordre de Strahler de chaque cellule du réseau et nbr de donneurs (0 : source, 1 : tronçon, 2 et plus : confluence)
+    n = aval.shape[0]
+    donneurs = np.zeros(n, dtype=np.int32)
+    for k in range(n):
+        if aval[k] >= 0:
+            donneurs[aval[k]] += 1
+    ordre = np.zeros(n, dtype=np.uint8)
+    ordreMax = np.zeros(n, dtype=np.uint8)
+    nbrMax = np.zeros(n, dtype=np.uint8)
+    restants = donneurs.copy()
+    file = np.empty(n, dtype=np.int64)
+    fin = 0
+    for k in range(n):
+        if donneurs[k] == 0:
+            file[fin] = k
+            fin += 1
+    debut = 0
+    while debut < fin:
+        k = file[debut]
+        debut += 1
+        if donneurs[k] == 0:
+            ordre[k] = 1
+        elif nbrMax[k] >= 2:
+            ordre[k] = ordreMax[k] + 1
+        else:
+            ordre[k] = ordreMax[k]
+        a = aval[k]
+        if a < 0:
+            continue
+        if ordre[k] > ordreMax[a]:
+            ordreMax[a] = ordre[k]
+            nbrMax[a] = 1
+        elif ordre[k] == ordreMax[a]:
+            nbrMax[a] += 1
+        restants[a] -= 1
+        if restants[a] == 0:
+            file[fin] = a
+            fin += 1
+    return ordre, donneurs
+
+
+@njit
+def troncons(aval, donneurs):
+    #Tronçons au format CSR : sommets[offsets[t]:offsets[t + 1]] = rangs des cellules du tronçon t, de l'amont vers l'aval
+    #Un tronçon part d'une tête (source ou confluence) et s'arrête à la tête suivante (incluse) ou à l'exutoire ; lienAval : tronçon suivant
+    n = aval.shape[0]
+    numero = np.full(n, -1, dtype=np.int64)
+    nbrTroncons = 0
+    for k in range(n):
+        if donneurs[k] != 1 and aval[k] >= 0: #les têtes sans aval (cellule isolée, confluence à l'exutoire) ne forment pas de tronçon
+            numero[k] = nbrTroncons
+            nbrTroncons += 1
+    offsets = np.zeros(nbrTroncons + 1, dtype=np.int64)
+    sommets = np.empty(n + nbrTroncons, dtype=np.int64) #chaque cellule une fois, plus la tête aval de chaque tronçon
+    lienAval = np.full(nbrTroncons, -1, dtype=np.int64)
+    m = 0
+    for k in range(n):
+        t = numero[k]
+        if t < 0:
+            continue
+        c = k
+        sommets[m] = c
+        m += 1
+        while aval[c] >= 0:
+            c = aval[c]
+            sommets[m] = c
+            m += 1
+            if donneurs[c] != 1:
+                lienAval[t] = numero[c]
+                break
+        offsets[t + 1] = m
+    return sommets[:m], offsets, lienAval
+
+
+def reseauHydrographique(cellDrainees, directionsEcoulement, seuil):
+    #Retourne un dictionnaire : cellules (indices x * dimy + y des sommets, tronçon par tronçon), offsets, strahler, aval (tronçon
+    #suivant, -1 à l'exutoire) et aire (aire drainée à l'extrémité aval, en nbr de cellules) par tronçon
+    dimy = cellDrainees.shape[1]
+    cellules = np.flatnonzero(cellDrainees >= seuil)
+    aval = avalDominant(cellDrainees, directionsEcoulement, cellules, seuil)
+    ordre, donneurs = strahler(aval)
+    sommets, offsets, lienAval = troncons(aval, donneurs)
+    fins = cellules[sommets[offsets[1:] - 1]]
+    return {"cellules": cellules[sommets], "offsets": offsets, "strahler": ordre[sommets[offsets[:-1]]], "aval": lienAval,
+            "aire": cellDrainees[fins // dimy, fins % dimy]}
+
+
+def _wkbLigne(coordonnees):
+    #WKB d'une polyligne 2D (petit-boutiste) : évite un appel OGR par sommet
+    return struct.pack("<BII", 1, ogr.wkbLineString, coordonnees.shape[0]) + np.ascontiguousarray(coordonnees, dtype="<f8").tobytes()
+
+
+def ecrireReseau(fichier, fichier_mnt, reseau, nomCouche="reseau"):
+    #Polylignes en GeoPackage, coordonnées des centres de cellules dans le système du MNT
+    dimy = fichier_mnt.RasterXSize
+    gt = fichier_mnt.GetGeoTransform()
+    lignes = reseau["cellules"] // dimy + 0.5
+    colonnes = reseau["cellules"] % dimy + 0.5
+    coordonnees = np.column_stack((gt[0] + colonnes * gt[1] + lignes * gt[2], gt[3] + colonnes * gt[4] + lignes * gt[5]))
+    longueurs = np.hypot(*np.diff(coordonnees, axis=0).T)
+
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(fichier):
+        driver.DeleteDataSource(fichier)
+    source = driver.CreateDataSource(fichier)
+    srs = None
+    if fichier_mnt.GetProjection():
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(fichier_mnt.GetProjection())
+    couche = source.CreateLayer(nomCouche, srs, ogr.wkbLineString)
+    for nom, typeOGR in (("id", ogr.OFTInteger64), ("strahler", ogr.OFTInteger), ("aval", ogr.OFTInteger64), ("aire", ogr.OFTReal), ("longueur", ogr.OFTReal)):
+        couche.CreateField(ogr.FieldDefn(nom, typeOGR))
+    definition = couche.GetLayerDefn()
+    offsets = reseau["offsets"]
+    couche.StartTransaction()
+    for t in range(offsets.shape[0] - 1):
+        entite = ogr.Feature(definition)
+        entite.SetField("id", t)
+        entite.SetField("strahler", int(reseau["strahler"][t]))
+        entite.SetField("aval", int(reseau["aval"][t]))
+        entite.SetField("aire", float(reseau["aire"][t]))
+        entite.SetField("longueur", float(longueurs[offsets[t]:offsets[t + 1] - 1].sum()))
+        entite.SetGeometry(ogr.CreateGeometryFromWkb(_wkbLigne(coordonnees[offsets[t]:offsets[t + 1]])))
+        couche.CreateFeature(entite)
+    couche.CommitTransaction()
+    source = None
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Modèles de routage des écoulements, derrière une interface commune
+
+- "lineaire" : répartition de myk_directionsEcoulement (pourcentages
+  proportionnels aux dénivelées, sans distance, correction des arrondis par
+  +1 dans l'ordre des voisins) ;
+- "d8" : tout l'écoulement vers le voisin de plus forte pente (MFD.py) ;
+- "dinf" : D-infini (Tarboton, 1997) : direction de plus forte pente sur les
+  8 facettes triangulaires, écoulement partagé entre les deux voisins de la
+  facette selon l'angle ;
+- "freeman" : MFD de Freeman (1991), poids pente ** exposant ;
+- "quinn" : MFD de Quinn (1991), poids pente ** exposant x longueur de
+  contour (1/2 pour les voisins cardinaux, sqrt(2)/4 pour les diagonaux).
+
+Pentes : dénivelée / distance (1 ou sqrt(2) en taille de cellule) si
+correctionDistance, dénivelée seule sinon. Seuls les voisins valides (lus
+> 0 dans le voisinage int32, cf MFD_voisinage) et strictement inférieurs
+reçoivent de l'écoulement. Les poids sont convertis selon le type du
+tableau des directions (MFD_directions.TYPES_POIDS) :
+- pourcentages uint8 de somme 100 par la méthode des plus forts restes,
+  sans boucle de correction ;
+- fractions en virgule fixe uint16 de somme 65535 ou flottantes float32 de
+  somme 1, normalisées en une passe (fractionsCellule : en virgule fixe, le
+  reste des troncatures, moins de 8 unités, va au plus fort poids).
+Avec des poids non entiers ou en virgule fixe, le modèle "lineaire" est
+calculé par le noyau commun (poids = dénivelées).
+
+Un seul noyau (myk_routage, parallèle par lignes) calcule les poids de la
+cellule selon le modèle (poidsCellule) puis les pourcentages
+(pourcentagesCellule). Le résultat a le format des directions de
+MFD_v3.py (cube à 9 cases ou tableau compact à 8 cases) et alimente sans
+changement l'accumulation, le réseau et les bassins : on choisit par
+produit le modèle le moins coûteux suffisant (D8 pour l'extraction du
+réseau, MFD où la dispersion compte).
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import math
+import numpy as np
+from numba import njit, prange
+import MFD_cpu
+from MFD_directions import echellePoids
+from MFD_voisinage import DX, DY
+
+#Codes des modèles du noyau
+LINEAIRE = 0
+D8 = 1
+DINF = 2
+FREEMAN = 3
+QUINN = 4
+MODELES = {"lineaire": LINEAIRE, "d8": D8, "dinf": DINF, "freeman": FREEMAN, "quinn": QUINN}
+
+#Distance au voisin i (en taille de cellule) et longueur de contour de Quinn
+DISTANCES = np.array([0] + [math.sqrt(2) if i % 2 == 1 else 1.0 for i in range(1, 9)])
+CONTOURS = np.array([0] + [math.sqrt(2) / 4 if i % 2 == 1 else 0.5 for i in range(1, 9)])
+#Facettes de D-infini : voisin cardinal et voisin diagonal adjacent
+FACETTES_CARDINAL = np.array([2, 2, 4, 4, 6, 6, 8, 8], dtype=np.int64)
+FACETTES_DIAGONAL = np.array([1, 3, 3, 5, 5, 7, 7, 1], dtype=np.int64)
+
+
+@njit
+def poidsCellule(dataMNT, x, y, dimx, dimy, modele, exposant, correctionDistance, altitudes, poids):
+    #poids[1:9] : poids de l'écoulement de (x, y) vers chacun de ses voisins selon le modèle (tous nuls sans récepteur)
+    for i in range(9):
+        xv = x + DX[i]
+        yv = y + DY[i]
+        altitudes[i] = -1.0
+        if xv >= 0 and yv >= 0 and xv < dimx and yv < dimy and dataMNT[xv, yv] > 0 and dataMNT[xv, yv] < 2147483648:
+            altitudes[i] = dataMNT[xv, yv]
+        poids[i] = 0.0
+    z = altitudes[0]
+    if z < 0:
+        return poids
+
+    if modele == DINF:
+        angleMax = math.pi / 4
+        meilleure = 0.0
+        for f in range(8):
+            c = FACETTES_CARDINAL[f]
+            d = FACETTES_DIAGONAL[f]
+            if altitudes[c] < 0 or altitudes[d] < 0:
+                continue
+            s1 = z - altitudes[c]
+            s2 = altitudes[c] - altitudes[d]
+            r = math.atan2(s2, s1)
+            s = math.hypot(s1, s2)
+            if r < 0:
+                r = 0.0
+                s = s1
+            elif r > angleMax:
+                r = angleMax
+                s = (z - altitudes[d]) / math.sqrt(2)
+            if s > meilleure:
+                meilleure = s
+                for i in range(9):
+                    poids[i] = 0.0
+                poids[c] = 1 - r / angleMax
+                poids[d] = r / angleMax
+        return poids
+
+    meilleure = 0.0
+    choix = 0
+    for i in range(1, 9):
+        if altitudes[i] < 0 or altitudes[i] >= z:
+            continue
+        if modele == LINEAIRE:
+            poids[i] = z - altitudes[i]
+            continue
+        pente = (z - altitudes[i]) / DISTANCES[i] if correctionDistance else z - altitudes[i]
+        if modele == D8:
+            if pente > meilleure:
+                meilleure = pente
+                choix = i
+        else:
+            if exposant != 1:
+                pente = pente ** exposant
+            poids[i] = pente if modele == FREEMAN else pente * CONTOURS[i]
+    if modele == D8 and choix > 0:
+        poids[choix] = 1.0
+    return poids
+
+
+@njit
+def pourcentagesCellule(poids, repartition):
+    #repartition[1:9] : pourcentages entiers de somme 100 (0 sans récepteur) : parties entières, puis +1 aux plus forts restes
+    total = 0.0
+    for i in range(1, 9):
+        total += poids[i]
+    repartition[:] = 0
+    if total <= 0:
+        return repartition
+    reste = 100
+    for i in range(1, 9):
+        poids[i] = 100 * poids[i] / total
+        repartition[i] = int(poids[i])
+        poids[i] -= repartition[i]
+        reste -= repartition[i]
+    for _ in range(reste):
+        choix = 1
+        for i in range(2, 9):
+            if poids[i] > poids[choix]:
+                choix = i
+        repartition[choix] += 1
+        poids[choix] = -1.0
+    return repartition
+
+
+@njit
+def fractionsCellule(poids, echelle, entier, repartition):
+    #repartition[1:9] : poids normalisés en une passe, somme echelle (0 sans récepteur) ; entier : troncature, le reste au plus fort poids
+    total = 0.0
+    for i in range(1, 9):
+        total += poids[i]
+    repartition[:] = 0
+    if total <= 0:
+        return repartition
+    reste = echelle
+    choix = 1
+    for i in range(1, 9):
+        repartition[i] = poids[i] * echelle / total
+        if entier:
+            repartition[i] = math.floor(repartition[i])
+        reste -= repartition[i]
+        if poids[i] > poids[choix]:
+            choix = i
+    if entier:
+        repartition[choix] += reste
+    return repartition
+
+
+@njit(parallel=True)
+def myk_routage(dataMNT, directionsEcoulement, modele, exposant, correctionDistance, echelle):
+    #directionsEcoulement : cube (dimx, dimy, 9) ou format compact (dimx, dimy, 8) ; dataMNT n'est pas modifié
+    #echelle : 100 (pourcentages uint8), 65535 (virgule fixe uint16) ou 1 (float32), cf MFD_directions.TYPES_POIDS
+    dimx, dimy = dataMNT.shape
+    premier = directionsEcoulement.shape[2] - 8
+    for pos_x in prange(dimx):
+        altitudes = np.zeros(9, dtype=np.float64)
+        poids = np.zeros(9, dtype=np.float64)
+        repartition = np.zeros(9, dtype=np.float64)
+        pourcentages = np.zeros(9, dtype=np.uint8)
+        for pos_y in range(dimy):
+            poidsCellule(dataMNT, pos_x, pos_y, dimx, dimy, modele, exposant, correctionDistance, altitudes, poids)
+            if echelle == 100:
+                pourcentagesCellule(poids, pourcentages)
+                repartition[:] = pourcentages
+            else:
+                fractionsCellule(poids, echelle, echelle > 1, repartition)
+            for i in range(1, 9):
+                directionsEcoulement[pos_x, pos_y, i - 1 + premier] = repartition[i]
+
+
+def directionsRoutage(mnt, directionsEcoulement, modele="freeman", exposant=1.1, correctionDistance=True, noDataValue=4294967295):
+    #Directions d'écoulement du modèle choisi, cube (dimx, dimy, 9) ou format compact (dimx, dimy, 8)
+    #Les poids ont le type du tableau directionsEcoulement (MFD_directions.TYPES_POIDS)
+    #noDataValue : pour "lineaire" en pourcentages seulement, valeur réécrite à 99999 dans mnt par myk_directionsEcoulement
+    #(jamais atteinte par défaut)
+    if modele not in MODELES:
+        raise ValueError("Modèle de routage inconnu : %s (%s)" % (modele, ", ".join(MODELES)))
+    echelle = echellePoids(directionsEcoulement.dtype)
+    if modele == "lineaire" and echelle == 100:
+        MFD_cpu.myk_directionsEcoulement(mnt, directionsEcoulement, noDataValue)
+    else:
+        myk_routage(mnt, directionsEcoulement, MODELES[modele], exposant, correctionDistance, float(echelle))
+    return directionsEcoulement
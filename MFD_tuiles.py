@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Traitement par tuiles (fenêtres GDAL avec halo) des étapes de voisinage
+
+Bruitage, détection des dépressions, directions d'écoulement et lignes de
+crête ne dépendent que des 8 voisins immédiats : on lit le MNT par fenêtres
+avec un halo d'une cellule et on écrit chaque résultat bloc par bloc dans les
+GTiff de sortie. La mémoire utilisée dépend de la taille des tuiles et non
+plus de la taille du département.
+
+Le comblement Priority-Flood et l'accumulation restent des traitements
+globaux : en mode tuiles, les directions sont calculées sur le MNT bruité.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+import datetime
+from osgeo import gdal
+import MFD_cpu
+import MFD_directions
+from MFD_voisinage import fenetres
+
+#Options de création des GTiff de sortie : tuilés pour permettre l'écriture bloc par bloc
+OPTIONS_GTIFF = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"]
+
+
+def metresVersCm(h_mnt, NDV, noDataValue):
+    #Conversion en entiers (cm) ; les NoData reçoivent noDataValue (4284967396 pour NDV = -99999, comme dans MFD_v3.py)
+    mnt = np.ascontiguousarray(h_mnt * 100, dtype=np.int64).astype(np.uint32)
+    if NDV is not None:
+        mnt[h_mnt == NDV] = noDataValue
+    return mnt
+
+
+def noDataCm(NDV):
+    if NDV is None:
+        return 4284967396
+    return int(np.array([int(NDV * 100)], dtype=np.int64).astype(np.uint32)[0])
+
+
+def creerSortie(fichier, fichier_mnt, nbrBandes, typeGDAL, noData=None):
+    driver = gdal.GetDriverByName("GTiff")
+    outdata = driver.Create(fichier, fichier_mnt.RasterXSize, fichier_mnt.RasterYSize, nbrBandes, typeGDAL, options=OPTIONS_GTIFF)
+    outdata.SetGeoTransform(fichier_mnt.GetGeoTransform())
+    outdata.SetProjection(fichier_mnt.GetProjection())
+    if noData is not None:
+        for b in range(nbrBandes):
+            outdata.GetRasterBand(b + 1).SetNoDataValue(noData)
+    return outdata
+
+
+def ecrireDirections(fichier, fichier_mnt, directions, nbrLignesBloc=256):
+    #Ecriture des directions en 8 bandes (bande k = poids vers le voisin k : Byte en pourcentages, UInt16 en virgule fixe ou Float32,
+    #cf MFD_directions.TYPES_POIDS), par blocs de lignes
+    #directions : cube (dim1, dim2, 9), tableau compact (dim1, dim2, 8) ou triplet (offsets, recepteurs, poids) au format CSR
+    dim1, dim2 = fichier_mnt.RasterYSize, fichier_mnt.RasterXSize
+    typePoids = directions[2].dtype if isinstance(directions, tuple) else directions.dtype
+    typeGDAL = {np.dtype(np.uint8): gdal.GDT_Byte, np.dtype(np.uint16): gdal.GDT_UInt16, np.dtype(np.float32): gdal.GDT_Float32}[typePoids]
+    sortie = creerSortie(fichier, fichier_mnt, 8, typeGDAL)
+    bloc = np.empty((nbrLignesBloc, dim2, 8), dtype=typePoids)
+    for l0 in range(0, dim1, nbrLignesBloc):
+        l1 = min(l0 + nbrLignesBloc, dim1)
+        if isinstance(directions, tuple):
+            MFD_directions.csrVersCompact(directions[0], directions[1], directions[2], bloc, l0, l1)
+            cases = bloc[:l1 - l0]
+        else:
+            cases = directions[l0:l1, :, directions.shape[2] - 8:]
+        for k in range(8):
+            sortie.GetRasterBand(k + 1).WriteArray(np.ascontiguousarray(cases[:, :, k]), 0, l0)
+    sortie.FlushCache()
+
+
+def traitementParTuiles(fichierMNT, fichierCretes, fichierCodes=None, fichierDirections=None, tailleTuile=2048,
+                        amplitudeBruit=20, bruitageActif=1, seed=1, realisation=0):
+    #Retourne le nbr de cellules par code de dépression (0-8) et le nbr de cellules valides (9), comme mnt_ind_depr_tot
+    fichier_mnt = gdal.Open(fichierMNT)
+    bande = fichier_mnt.GetRasterBand(1)
+    NDV = bande.GetNoDataValue()
+    noDataValue = noDataCm(NDV)
+    dim1, dim2 = fichier_mnt.RasterYSize, fichier_mnt.RasterXSize
+
+    sortieCretes = creerSortie(fichierCretes, fichier_mnt, 1, gdal.GDT_Int32, 99999)
+    sortieCodes = creerSortie(fichierCodes, fichier_mnt, 1, gdal.GDT_Byte) if fichierCodes else None
+    sortieDirections = creerSortie(fichierDirections, fichier_mnt, 8, gdal.GDT_Byte) if fichierDirections else None
+
+    ind_depr_tot = np.zeros(10, dtype=np.int64)
+    debut = datetime.datetime.now()
+    for (l0, l1, c0, c1), (hl0, hl1, hc0, hc1) in fenetres(dim1, dim2, tailleTuile):
+        h_mnt = bande.ReadAsArray(hc0, hl0, hc1 - hc0, hl1 - hl0)
+        mnt = metresVersCm(h_mnt, NDV, noDataValue)
+        mnt_bruite = np.empty_like(mnt)
+        #Bruit à compteur en coordonnées globales : le bruit d'une cellule ne dépend pas du découpage
+        MFD_cpu.myk_bruitageCompteur(mnt, mnt_bruite, noDataValue, amplitudeBruit, seed, realisation, bruitageActif, hl0, hc0)
+
+        mnt_filled = np.empty_like(mnt)
+        mnt_codes_depr = np.zeros_like(mnt)
+        mnt_ind_depr = np.empty_like(mnt)
+        mnt_ind_depr_tot = np.empty_like(mnt)
+        mnt_alt_cretes = np.empty_like(mnt)
+        celluleTraitees = np.empty(mnt.shape, dtype=np.bool_)
+        MFD_cpu.myk_comblementDepressions(mnt_bruite, mnt_filled, mnt_codes_depr, noDataValue, mnt_ind_depr, mnt_ind_depr_tot, mnt_alt_cretes, celluleTraitees)
+
+        #Zone utile de la tuile dans les tableaux lus avec halo
+        utile = (slice(l0 - hl0, l1 - hl0), slice(c0 - hc0, c1 - hc0))
+        codes = mnt_codes_depr[utile]
+        valides = mnt_bruite[utile] != noDataValue
+        ind_depr_tot[:9] += np.bincount(codes[valides], minlength=9)[:9]
+        ind_depr_tot[9] += valides.sum()
+
+        sortieCretes.GetRasterBand(1).WriteArray(mnt_alt_cretes[utile].astype(np.int32), c0, l0)
+        if sortieCodes is not None:
+            sortieCodes.GetRasterBand(1).WriteArray(codes.astype(np.uint8), c0, l0)
+        if sortieDirections is not None:
+            directionsEcoulement = MFD_directions.directionsCompactes(hl1 - hl0, hc1 - hc0)
+            MFD_cpu.myk_directionsEcoulement(mnt_bruite, directionsEcoulement, 27108)
+            for k in range(8):
+                sortieDirections.GetRasterBand(k + 1).WriteArray(np.ascontiguousarray(directionsEcoulement[utile + (k,)]), c0, l0)
+
+    for sortie in (sortieCretes, sortieCodes, sortieDirections):
+        if sortie is not None:
+            sortie.FlushCache()
+    print("...Traitement par tuiles terminé en : ", datetime.datetime.now() - debut)
+    return ind_depr_tot
+
+
+if __name__ == "__main__":
+    ind_depr_tot = traitementParTuiles("Alti_Dpt10_AOC_Champagne.tif", "mnt_lignesCretes4.tif", "mnt_codes_depr.tif")
+    for i in range(10):
+        print("Nombre de cellules d'écoulement : ", i, " : ", ind_depr_tot[i])
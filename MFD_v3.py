@@ -8,12 +8,32 @@ Cerema / Laboratoire de Nancy / ERTD
 
 from __future__ import division
 import numpy as np
-from numba import cuda, njit, prange
+from numba import cuda
 from numba.cuda.random import create_xoroshiro128p_states, xoroshiro128p_uniform_float32
 import numba
 import math
 import datetime
-from osgeo import gdal
+import os
+import MFD_cpu
+from MFD_voisinage import DX, DY, voisinsDevice as voisins
+from MFD_aleatoire import bruitCelluleDevice
+import MFD_comblement
+import MFD_accumulation
+import MFD_directions
+import MFD_tuiles
+import MFD_cache
+import MFD_raster
+import MFD_profil
+import MFD_voisinage
+import MFD_aleatoire
+import MFD_altitudes
+import MFD_masque
+import MFD_incremental
+import MFD_cretes
+import MFD_reseau
+import MFD_bassins
+import MFD_plats
+import MFD_routage
 
 @cuda.jit
 def myk_bruitageMNT(mnt_source, mnt_bruite, noDataValue, amplitudeBruit, rng_states_x, rng_states_y, bruitageActif):
@@ -24,52 +44,74 @@ def myk_bruitageMNT(mnt_source, mnt_bruite, noDataValue, amplitudeBruit, rng_sta
     if mnt_source[pos_x, pos_y] == noDataValue:
         mnt_bruite[pos_x, pos_y] = noDataValue
     else:
-        mnt_bruite[pos_x, pos_y] = mnt_source[pos_x, pos_y] + bruitageActif * bruitage
+        mnt_bruite[pos_x, pos_y] = numba.int64(mnt_source[pos_x, pos_y]) + bruitageActif * bruitage
+
+@cuda.jit
+def myk_bruitageCompteur(mnt_source, mnt_bruite, noDataValue, amplitudeBruit, seed, realisation, bruitageActif, l0, c0):
+    #Bruit indépendant par cellule, fonction de (seed, realisation, x, y) seulement (cf MFD_aleatoire.py)
+    pos_x, pos_y = cuda.grid(2)
+    if pos_x < mnt_source.shape[0] and pos_y < mnt_source.shape[1]:
+        if mnt_source[pos_x, pos_y] == noDataValue:
+            mnt_bruite[pos_x, pos_y] = noDataValue
+        else:
+            bruitage = bruitCelluleDevice(seed, realisation, l0 + pos_x, c0 + pos_y, amplitudeBruit)
+            mnt_bruite[pos_x, pos_y] = numba.int64(mnt_source[pos_x, pos_y]) + bruitageActif * bruitage
 
 @cuda.jit
 def myk_comblementDepressions(dataMNT, mnt_filled, mnt_codes_depr, noDataValue, mnt_ind_depr, mnt_ind_depr_tot, mnt_alt_cretes, celluleTraitees):
+    #Les cellules hors du MNT (grille plus grande que le MNT) ne font rien ; mnt_ind_depr_tot[0, 0:10], où s'ajoutent les comptes,
+    #est remis à zéro avant le lancement et non par les threads (cf myk_comblementDepressionsPartage)
     pos_x, pos_y = cuda.grid(2)
     dimx, dimy = dataMNT.shape
-    celluleTraitees[pos_x, pos_y] = False
-    
-    voisinage = cuda.local.array(shape = 10,dtype = numba.int32) #0:centre /1-8:voisinage / 9:compte du nbr de cellules voisines inférieures au centre
-    voisinage_tourne = cuda.local.array(shape = 10,dtype = numba.int32)
+    if pos_x < dimx and pos_y < dimy:
+        celluleTraitees[pos_x, pos_y] = False
 
-    mnt_filled[pos_x, pos_y] = dataMNT[pos_x, pos_y]
-    mnt_ind_depr[pos_x, pos_y] = 0
-    mnt_ind_depr_tot[pos_x, pos_y] = 0
-    
-    #On gère les différents cas des bords et coins
-    voisinage = voisins(dataMNT, pos_x, pos_y, dimx, dimy, voisinage)
-    
-    if voisinage[9] == 0:
-        altExut = exutoiresVoisins(voisinage)
-        mnt_filled[pos_x, pos_y] = altExut
-     
-    #Visualisation de la répartition du nombre de cellules d'écoulement
-    if dataMNT[pos_x, pos_y]  == noDataValue:
-        mnt_filled[pos_x, pos_y] = noDataValue
+        voisinage = cuda.local.array(shape = 10,dtype = numba.int32) #0:centre /1-8:voisinage / 9:compte du nbr de cellules voisines inférieures au centre
+        voisinage_tourne = cuda.local.array(shape = 10,dtype = numba.int32)
+
+        mnt_filled[pos_x, pos_y] = dataMNT[pos_x, pos_y]
         mnt_ind_depr[pos_x, pos_y] = 0
-        celluleTraitees[pos_x, pos_y] = True
-    elif dataMNT[pos_x, pos_y]  != noDataValue: #¨On élimine les valeurs NoData et bords
-        for j in range(10):
+        if pos_x > 0 or pos_y >= 10:
+            mnt_ind_depr_tot[pos_x, pos_y] = 0
+
+        #On gère les différents cas des bords et coins
+        voisinage = voisins(dataMNT, pos_x, pos_y, dimx, dimy, voisinage)
+
+        if voisinage[9] == 0:
+            altExut = exutoiresVoisins(voisinage)
+            mnt_filled[pos_x, pos_y] = altExut
+
+        #Visualisation de la répartition du nombre de cellules d'écoulement
+        if dataMNT[pos_x, pos_y]  == noDataValue:
+            mnt_filled[pos_x, pos_y] = noDataValue
             mnt_ind_depr[pos_x, pos_y] = 0
-            if voisinage[9] == j:
-                mnt_codes_depr[pos_x, pos_y] = j
-                mnt_ind_depr[pos_x, pos_y] = 1
-                
-            if j == 9:
-                mnt_ind_depr[pos_x, pos_y] = 1
-        
-            cuda.atomic.add(mnt_ind_depr_tot, (0, j), mnt_ind_depr[pos_x, pos_y])
-    
-    #Visualisation des points de crête
-    mnt_alt_cretes[pos_x, pos_y] = crete(voisinage, voisinage_tourne)
-    
+            celluleTraitees[pos_x, pos_y] = True
+        elif dataMNT[pos_x, pos_y]  != noDataValue: #¨On élimine les valeurs NoData et bords
+            for j in range(10):
+                mnt_ind_depr[pos_x, pos_y] = 0
+                if voisinage[9] == j:
+                    mnt_codes_depr[pos_x, pos_y] = j
+                    mnt_ind_depr[pos_x, pos_y] = 1
+
+                if j == 9:
+                    mnt_ind_depr[pos_x, pos_y] = 1
+
+                cuda.atomic.add(mnt_ind_depr_tot, (0, j), mnt_ind_depr[pos_x, pos_y])
+
+        #Visualisation des points de crête
+        mnt_alt_cretes[pos_x, pos_y] = crete(voisinage, voisinage_tourne)
+
 @cuda.jit
 def myk_copieMNT(mnt_source, mnt_dest):
     pos_x, pos_y = cuda.grid(2)
-    mnt_dest[pos_x, pos_y] = mnt_source[pos_x, pos_y]
+    if pos_x < mnt_source.shape[0] and pos_y < mnt_source.shape[1]:
+        mnt_dest[pos_x, pos_y] = mnt_source[pos_x, pos_y]
+
+@cuda.jit
+def myk_remplir(tableau, valeur):
+    pos_x, pos_y = cuda.grid(2)
+    if pos_x < tableau.shape[0] and pos_y < tableau.shape[1]:
+        tableau[pos_x, pos_y] = valeur
         
 @cuda.jit
 def myk_directionsEcoulement(dataMNT, directionsEcoulement, noDataValue):
@@ -82,7 +124,7 @@ def myk_directionsEcoulement(dataMNT, directionsEcoulement, noDataValue):
         voisinage = cuda.local.array(shape = 11,dtype = numba.int32) #0:centre /1-8:voisinage / 9:somme des écarts d'altitude / 10:nbr de cellules d'écoulement
         diff = cuda.local.array(shape = 11,dtype = numba.uint16)
         indice_min = cuda.local.array(shape = 1,dtype = numba.int32)
-        min_voisins = cuda.local.array(shape = 1,dtype = numba.int16)
+        min_voisins = cuda.local.array(shape = 1,dtype = numba.int32)
         indicat_dirEcoul = cuda.local.array(shape = 4,dtype = numba.int32) #0 : somme / 1: max /2: indice du max /3: indice de correction des arrondis /4: indice 2ème niveau de correction des arrondis
         
         
@@ -93,7 +135,13 @@ def myk_directionsEcoulement(dataMNT, directionsEcoulement, noDataValue):
     
         indice_min[0] = 0
         min_voisins[0] = voisinage[0]
+        #Tableaux locaux et cube de la cellule remis à zéro (mémoire non initialisée sur le GPU), comme dans MFD_cpu.repartitionEcoulement
+        for i in range(9):
+            diff[i] = 0
+            directionsEcoulement[pos_x, pos_y, i] = 0
+        diff[9] = 0
         diff[10] = 0
+        indicat_dirEcoul[0] = 0
         #Ensuite on parcours (pour chaque thread) voisinage[0:9] et si l'altitude est supérieure, on remplace la valeur d'altitude par -2
         for i in range(9):
             if voisinage[i] > voisinage[0] and voisinage[i] > 0:
@@ -128,8 +176,9 @@ def myk_directionsEcoulement(dataMNT, directionsEcoulement, noDataValue):
                         indicat_dirEcoul[3] -= 1
 
 @cuda.jit
-def myk_cellulesDrainees(dataMNT, directionsEcoulement, noDataValue, cellDrainees, cellTraitee):
-    
+def myk_cellulesDrainees(dataMNT, directionsEcoulement, noDataValue, cellDrainees, cellTraitee, traiteeAvant):
+    #traiteeAvant : copie de cellTraitee au lancement, seule lue (cellTraitee est modifiée pendant la passe par les autres threads),
+    #comme dans MFD_cpu.myk_cellulesDrainees
     pos_x, pos_y = cuda.grid(2)
     if pos_x < dataMNT.shape[0] and pos_y < dataMNT.shape[1]:
         if dataMNT[pos_x, pos_y]  == noDataValue:
@@ -158,7 +207,7 @@ def myk_cellulesDrainees(dataMNT, directionsEcoulement, noDataValue, cellDrainee
                 else:
                     locIndice[i,2] = i - 4
             
-            test = test_amav(pos_x, pos_y, dimx, dimy, cellTraitee, locIndice, directionsEcoulement)
+            test = test_amav(pos_x, pos_y, dimx, dimy, traiteeAvant, locIndice, directionsEcoulement)
             if test:
                 aireDraineeCelluleActive = 0
                 for i in range(1,9):
@@ -167,7 +216,7 @@ def myk_cellulesDrainees(dataMNT, directionsEcoulement, noDataValue, cellDrainee
                     indice = locIndice[i,2]
                     if x < dimx and y < dimy and x > 0 and y > 0:
                         if directionsEcoulement[x, y, indice] > 0:
-                            aireDraineeCelluleActive += directionsEcoulement[x, y, indice] * 100
+                            aireDraineeCelluleActive += numba.int64(directionsEcoulement[x, y, indice]) * 100
                 cellDrainees[pos_x, pos_y] = 1 + aireDraineeCelluleActive
                 cellTraitee[pos_x, pos_y] = True
     #cuda.atomic.compare_and_swap(cellTraitee, )
@@ -306,265 +355,770 @@ def exutoiresVoisins(voisinage):
     altExut = int((mini1 + mini2) / 2) + 1
     return altExut
 
-@cuda.jit(device=True)
-def voisins(dataMNT, pos_x, pos_y, dimx, dimy, voisinage):
-    #voisinage[0:9] contient soit l'altitude des différents voisins immédiats du thread en cours, soit -1 si la donnée n'existe pas (voisinage[0] correspond au thread, [1] au nord-est, [2] au nord, ... - cf CalculReseauDrainage.pptx)
-    if pos_x != 0 and pos_y != 0 and pos_x != dimx - 1 and pos_y != dimy - 1:       #cas général (intérieur)
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = dataMNT[pos_x + 1, pos_y - 1]    #nord-est
-        voisinage[2] = dataMNT[pos_x, pos_y - 1]        #nord
-        voisinage[3] = dataMNT[pos_x - 1, pos_y - 1]    #nord_ouest
-        voisinage[4] = dataMNT[pos_x - 1, pos_y]        #ouest
-        voisinage[5] = dataMNT[pos_x - 1, pos_y + 1]    #sud-ouest
-        voisinage[6] = dataMNT[pos_x, pos_y + 1]        #sud
-        voisinage[7] = dataMNT[pos_x + 1, pos_y + 1]    #sud-est
-        voisinage[8] = dataMNT[pos_x + 1, pos_y]        #est
-    if pos_x == 0 and pos_y != 0 and pos_y != dimy - 1:                             #cas x = 0 (hors coins)
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = dataMNT[pos_x + 1, pos_y - 1]    #nord-est
-        voisinage[2] = dataMNT[pos_x, pos_y - 1]        #nord
-        voisinage[3] = -1                               #nord_ouest
-        voisinage[4] = -1                               #ouest
-        voisinage[5] = -1                               #sud-ouest
-        voisinage[6] = dataMNT[pos_x, pos_y + 1]        #sud
-        voisinage[7] = dataMNT[pos_x + 1, pos_y + 1]    #sud-est
-        voisinage[8] = dataMNT[pos_x + 1, pos_y]        #est
-    if pos_x != 0 and pos_y == 0 and pos_x != dimx - 1:                             #cas y = 0 (hors coins)
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = -1                               #nord-est
-        voisinage[2] = -1                               #nord
-        voisinage[3] = -1                               #nord_ouest
-        voisinage[4] = dataMNT[pos_x - 1, pos_y]        #ouest
-        voisinage[5] = dataMNT[pos_x - 1, pos_y + 1]    #sud-ouest
-        voisinage[6] = dataMNT[pos_x, pos_y + 1]        #sud
-        voisinage[7] = dataMNT[pos_x + 1, pos_y + 1]    #sud-est
-        voisinage[8] = dataMNT[pos_x + 1, pos_y]        #est
-    if pos_y != 0 and pos_x == dimx - 1 and pos_y != dimy - 1:                      #cas x = max (hors coins)
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = -1                               #nord-est
-        voisinage[2] = dataMNT[pos_x, pos_y - 1]        #nord
-        voisinage[3] = dataMNT[pos_x - 1, pos_y - 1]    #nord_ouest
-        voisinage[4] = dataMNT[pos_x - 1, pos_y]        #ouest
-        voisinage[5] = dataMNT[pos_x - 1, pos_y + 1]    #sud-ouest
-        voisinage[6] = dataMNT[pos_x, pos_y + 1]        #sud
-        voisinage[7] = -1                               #sud-est
-        voisinage[8] = -1                               #est
-    if pos_x != 0 and pos_x != dimx - 1 and pos_y == dimy - 1:                      #cas y = max (hors coins)
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = dataMNT[pos_x + 1, pos_y - 1]    #nord-est
-        voisinage[2] = dataMNT[pos_x, pos_y - 1]        #nord
-        voisinage[3] = dataMNT[pos_x - 1, pos_y - 1]    #nord_ouest
-        voisinage[4] = dataMNT[pos_x - 1, pos_y]        #ouest
-        voisinage[5] = -1                               #sud-ouest
-        voisinage[6] = -1                               #sud
-        voisinage[7] = -1                               #sud-est
-        voisinage[8] = dataMNT[pos_x + 1, pos_y]        #est
-    if pos_x == 0 and pos_y == 0:                                                   #cas coin nord-ouest
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = -1                               #nord-est
-        voisinage[2] = -1                               #nord
-        voisinage[3] = -1                               #nord_ouest
-        voisinage[4] = -1                               #ouest
-        voisinage[5] = -1                               #sud-ouest
-        voisinage[6] = dataMNT[pos_x, pos_y + 1]        #sud
-        voisinage[7] = dataMNT[pos_x + 1, pos_y + 1]    #sud-est
-        voisinage[8] = dataMNT[pos_x + 1, pos_y]        #est
-    if pos_x == 0 and pos_y == dimy - 1:                                            #cas coin sud-ouest
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = dataMNT[pos_x + 1, pos_y - 1]    #nord-est
-        voisinage[2] = dataMNT[pos_x, pos_y - 1]        #nord
-        voisinage[3] = -1                               #nord_ouest
-        voisinage[4] = -1                               #ouest
-        voisinage[5] = -1                               #sud-ouest
-        voisinage[6] = -1                               #sud
-        voisinage[7] = -1                               #sud-est
-        voisinage[8] = dataMNT[pos_x + 1, pos_y]        #est
-    if pos_x == dimx - 1 and pos_y == 0:                                            #cas coin nord-est
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = -1                               #nord-est
-        voisinage[2] = -1                               #nord
-        voisinage[3] = -1                               #nord_ouest
-        voisinage[4] = dataMNT[pos_x - 1, pos_y]        #ouest
-        voisinage[5] = dataMNT[pos_x - 1, pos_y + 1]    #sud-ouest
-        voisinage[6] = dataMNT[pos_x, pos_y + 1]        #sud
-        voisinage[7] = -1                               #sud-est
-        voisinage[8] = -1         
-    if pos_x == dimx - 1 and pos_y == dimy - 1: 
-        voisinage[0] = dataMNT[pos_x, pos_y]            #cellule centre
-        voisinage[1] = -1                               #nord-est
-        voisinage[2] = dataMNT[pos_x, pos_y - 1]        #nord
-        voisinage[3] = dataMNT[pos_x - 1, pos_y - 1]    #nord_ouest
-        voisinage[4] = dataMNT[pos_x - 1, pos_y]        #ouest
-        voisinage[5] = -1                               #sud-ouest
-        voisinage[6] = -1                               #sud
-        voisinage[7] = -1                               #sud-est
-        voisinage[8] = -1                               #est
-    voisinage[9] = 0
-    for i in range(1,9):
-        if voisinage[i] > 0 and voisinage[i] < voisinage[0]:
-            voisinage[9] += 1
-    return voisinage
-
 @cuda.jit(device=True)
 def valRel(diff_i, diff_tot, diff_nbr,conv):
     if conv == 0:
         res = 0
     elif conv == 1:
-        res = (100 * diff_i) / diff_tot
+        res = (100 * numba.int64(diff_i)) / diff_tot
     elif conv == 2:
         res = 0
     return res
 
 
-# Lecture du MNT
-debut = datetime.datetime.now()
-fichier_mnt = gdal.Open("Alti_Dpt10_AOC_Champagne.tif")
-h_mnt = np.array(fichier_mnt.GetRasterBand(1).ReadAsArray())
-NDV = fichier_mnt.GetRasterBand(1).GetNoDataValue()
-#print("NDV : ", NDV)
-#print(h_mnt[0:1,0:5])
-(dim1,dim2) = h_mnt.shape
-#print("...Lecture MNT terminée en : ", datetime.datetime.now() - debut)
-
-# Transfert des données MNT sur le device (on transforme les valeurs flottantes en mètres en valeurs entières en cm)
-d_mnt = cuda.to_device(np.ascontiguousarray(h_mnt * 100, dtype=np.uint32))
-# Allocation des variables sur le device
-d_directionsEcoulement = cuda.device_array_like(np.zeros((dim1,dim2,9), dtype=np.uint8))
-d_mnt_filled = cuda.device_array_like(d_mnt)
-d_mnt_codes_depr = cuda.device_array_like(d_mnt)
-d_mnt_bruite = cuda.device_array_like(d_mnt)
-d_mnt_ind_depr = cuda.device_array_like(d_mnt)
-d_mnt_ind_depr_tot = cuda.device_array_like(d_mnt)
-d_mnt_alt_cretes = cuda.device_array_like(d_mnt)
-d_cellDrainees = cuda.device_array_like(d_mnt)
-d_cellTraitee = cuda.device_array_like(np.zeros((dim1,dim2), dtype=np.bool_))
-
-test_mnt = d_mnt[0:1,0:5].copy_to_host()
-print("NoDataValue sur device : ", test_mnt[0,0])
-
-
-nbrIterations = 1
-amplitudeBruit = 20
-bruitageActif = 1
-
-stats = np.zeros((nbrIterations,10), dtype=np.int64)
-
-
-t1 = datetime.datetime.now()
-
-tpb = 16,16 #threadsperblock
-bpg_x = math.ceil(d_mnt.shape[0] / tpb[0]) #blockspergrid (-->9,7 si action sur la largeur 10 000 du raster)
-bpg_y = math.ceil(d_mnt.shape[1] / tpb[1])
-rng_states_x = create_xoroshiro128p_states(tpb[0] * bpg_x, seed=1)
-rng_states_y = create_xoroshiro128p_states(tpb[1] * bpg_y, seed=1)
-bpg = bpg_x, bpg_y
-
-for iterationsBruitage in range(nbrIterations):
-    # [GPU] - bruitage du MNT
-    t0 = datetime.datetime.now()
-    myk_bruitageMNT[bpg, tpb](d_mnt, d_mnt_bruite, 4284967396, amplitudeBruit, rng_states_x, rng_states_y, bruitageActif)
-    cuda.synchronize()
-    #print("...[GPU] - Comblement des zones dépressionnaires terminé en : ", datetime.datetime.now() - t0)
-    
-    
-    
-    # [GPU] - Calcul des zones dépressionnaires
-    t0 = datetime.datetime.now()
-    myk_comblementDepressions[bpg, tpb](d_mnt_bruite, d_mnt_filled, d_mnt_codes_depr, 4284967396, d_mnt_ind_depr, d_mnt_ind_depr_tot, d_mnt_alt_cretes, d_cellTraitee)
-    cuda.synchronize()
-    #print("...[GPU] - Comblement des zones dépressionnaires terminé en : ", datetime.datetime.now() - t0)
-    
-    h_mnt_ind_depr_tot = d_mnt_ind_depr_tot[0:1,0:10].copy_to_host()
-    #print("Nombre de cellules d'écoulement : ", 9, " : ", h_mnt_ind_depr_tot[0, 9])
-    for i in range(0,1):
-        stats[iterationsBruitage, i] = h_mnt_ind_depr_tot[0, i]
-        #print("Nombre de cellules d'écoulement : ", i, " : ", h_mnt_ind_depr_tot[0, i])
-    
-    for k in range(20):
-        if h_mnt_ind_depr_tot[0,0] > 0:
-            myk_copieMNT[bpg, tpb](d_mnt_filled, d_mnt_bruite) #copie filled vers bruite
-            cuda.synchronize()
-            
-            # [GPU] - Calcul des zones dépressionnaires
-            t0 = datetime.datetime.now()
-            myk_comblementDepressions[bpg, tpb](d_mnt_bruite, d_mnt_filled, d_mnt_codes_depr, 4284967396, d_mnt_ind_depr, d_mnt_ind_depr_tot, d_mnt_alt_cretes, d_cellTraitee)
+#Noyaux à mémoire partagée : chaque bloc de TAILLE_BLOC x TAILLE_BLOC threads charge une seule fois la tuile de HALO x HALO cellules
+#couvrant ses voisinages (lectures coalescées : threads consécutifs d'un warp sur des colonnes consécutives), puis chaque thread lit
+#ses 9 voisins dans la tuile. Lancement avec tpb = (TAILLE_BLOC, TAILLE_BLOC) ; mêmes résultats que les équivalents de MFD_cpu
+TAILLE_BLOC = 16
+HALO = TAILLE_BLOC + 2
+
+
+@cuda.jit(device=True)
+def chargerTuile(dataMNT, tuile, noDataValue, remplacement):
+    #tuile[lx, ly] : altitude (lue en int32) de la cellule (x0 + lx, y0 + ly) du voisinage du bloc, -1 hors du MNT
+    #remplacement >= 0 : valeur lue pour les cellules égales à noDataValue
+    dimx, dimy = dataMNT.shape
+    x0 = cuda.blockIdx.x * TAILLE_BLOC - 1
+    y0 = cuda.blockIdx.y * TAILLE_BLOC - 1
+    for k in range(cuda.threadIdx.x + cuda.threadIdx.y * TAILLE_BLOC, HALO * HALO, TAILLE_BLOC * TAILLE_BLOC):
+        lx = k // HALO
+        ly = k % HALO
+        x = x0 + lx
+        y = y0 + ly
+        if x >= 0 and y >= 0 and x < dimx and y < dimy:
+            valeur = dataMNT[x, y]
+            if remplacement >= 0 and valeur == noDataValue:
+                tuile[lx, ly] = remplacement
+            elif valeur > 2147483647:
+                tuile[lx, ly] = numba.int64(valeur) - 4294967296 #relecture en int32 explicite (voisinage des kernels), identique dans le simulateur CUDA
+            else:
+                tuile[lx, ly] = valeur
+        else:
+            tuile[lx, ly] = -1
+    cuda.syncthreads()
+
+@cuda.jit(device=True)
+def voisinsTuile(tuile, voisinage):
+    #Equivalent de voisins pour la cellule du thread courant, lue dans la tuile partagée
+    lx = cuda.threadIdx.x + 1
+    ly = cuda.threadIdx.y + 1
+    for i in range(9):
+        voisinage[i] = tuile[lx + DX[i], ly + DY[i]]
+    voisinage[9] = 0
+    for i in range(1, 9):
+        if voisinage[i] > 0 and voisinage[i] < voisinage[0]:
+            voisinage[9] += 1
+    return voisinage
+
+@cuda.jit(device=True)
+def repartitionVoisinage(voisinage, diff, repartition):
+    #Répartition de MFD_cpu.repartitionEcoulement à partir d'un voisinage déjà lu
+    for i in range(11):
+        diff[i] = 0
+    for i in range(9):
+        repartition[i] = 0
+    for i in range(9):
+        if voisinage[i] > voisinage[0] and voisinage[i] > 0:
+            voisinage[i] = -2
+    for i in range(9):
+        if voisinage[i] > 0:
+            diff[i] = voisinage[0] - voisinage[i]
+            diff[9] += diff[i]
+            diff[10] += 1
+    somme = 0
+    for i in range(9):
+        if voisinage[i] > 0 and not (diff[9] == 0):
+            repartition[i] = valRel(numba.int64(diff[i]), diff[9], diff[10], 1)
+            somme += int(valRel(numba.int64(diff[i]), diff[9], diff[10], 1))
+    if somme != 100:
+        reste = 100 - somme
+        for passe in range(2):
+            for i in range(1, 9):
+                if repartition[i] != 0 and reste > 0:
+                    repartition[i] += 1
+                    reste -= 1
+    return repartition
+
+@cuda.jit
+def myk_comblementDepressionsPartage(dataMNT, mnt_filled, mnt_codes_depr, noDataValue, mnt_ind_depr, mnt_ind_depr_tot, mnt_alt_cretes, celluleTraitees):
+    #Equivalent de MFD_cpu.myk_comblementDepressions ; les comptes sont faits par bloc en mémoire partagée et ajoutés une fois par bloc
+    #à mnt_ind_depr_tot[0, 0:10], remis à zéro avant le lancement
+    tuile = cuda.shared.array(shape=(HALO, HALO), dtype=numba.int32)
+    comptes = cuda.shared.array(shape=10, dtype=numba.uint32)
+    voisinage = cuda.local.array(shape=10, dtype=numba.int32)
+    voisinage_tourne = cuda.local.array(shape=10, dtype=numba.int32)
+    t = cuda.threadIdx.x + cuda.threadIdx.y * TAILLE_BLOC
+    if t < 10:
+        comptes[t] = 0
+    chargerTuile(dataMNT, tuile, noDataValue, -1)
+    pos_x, pos_y = cuda.grid(2)
+    if pos_x < dataMNT.shape[0] and pos_y < dataMNT.shape[1]:
+        celluleTraitees[pos_x, pos_y] = False
+        mnt_filled[pos_x, pos_y] = dataMNT[pos_x, pos_y]
+        mnt_ind_depr[pos_x, pos_y] = 0
+        if pos_x > 0 or pos_y >= 10:
+            mnt_ind_depr_tot[pos_x, pos_y] = 0
+        voisinsTuile(tuile, voisinage)
+        if voisinage[9] == 0:
+            mnt_filled[pos_x, pos_y] = exutoiresVoisins(voisinage)
+        if dataMNT[pos_x, pos_y] == noDataValue:
+            mnt_filled[pos_x, pos_y] = noDataValue
+            celluleTraitees[pos_x, pos_y] = True
+        else:
+            mnt_codes_depr[pos_x, pos_y] = voisinage[9]
+            mnt_ind_depr[pos_x, pos_y] = 1
+            cuda.atomic.add(comptes, voisinage[9], 1)
+            cuda.atomic.add(comptes, 9, 1)
+        mnt_alt_cretes[pos_x, pos_y] = crete(voisinage, voisinage_tourne)
+    cuda.syncthreads()
+    if t < 10 and comptes[t] > 0:
+        cuda.atomic.add(mnt_ind_depr_tot, (0, t), comptes[t])
+
+@cuda.jit
+def myk_directionsEcoulementPartage(dataMNT, directionsEcoulement, noDataValue):
+    #Equivalent de MFD_cpu.myk_directionsEcoulement (NoData lu comme 99999 et réécrit dans dataMNT) ; les répartitions du bloc sont
+    #rassemblées en mémoire partagée puis écrites ligne par ligne, cases contiguës (cube (dimx, dimy, 9) ou compact (dimx, dimy, 8))
+    tuile = cuda.shared.array(shape=(HALO, HALO), dtype=numba.int32)
+    repartitions = cuda.shared.array(shape=(TAILLE_BLOC, TAILLE_BLOC, 9), dtype=numba.uint8)
+    voisinage = cuda.local.array(shape=10, dtype=numba.int32)
+    diff = cuda.local.array(shape=11, dtype=numba.uint16)
+    repartition = cuda.local.array(shape=9, dtype=numba.uint8)
+    chargerTuile(dataMNT, tuile, noDataValue, 99999)
+    dimx, dimy = dataMNT.shape
+    pos_x, pos_y = cuda.grid(2)
+    if pos_x < dimx and pos_y < dimy:
+        if dataMNT[pos_x, pos_y] == noDataValue:
+            dataMNT[pos_x, pos_y] = 99999
+        voisinsTuile(tuile, voisinage)
+        repartitionVoisinage(voisinage, diff, repartition)
+        for i in range(9):
+            repartitions[cuda.threadIdx.x, cuda.threadIdx.y, i] = repartition[i]
+    cuda.syncthreads()
+    #Toutes les cases sont écrites (case centre du cube à 0 comme dans myk_directionsEcoulement : tableau device non initialisé)
+    nbrCases = directionsEcoulement.shape[2]
+    x0 = cuda.blockIdx.x * TAILLE_BLOC
+    y0 = cuda.blockIdx.y * TAILLE_BLOC
+    for k in range(cuda.threadIdx.x + cuda.threadIdx.y * TAILLE_BLOC, TAILLE_BLOC * TAILLE_BLOC * nbrCases, TAILLE_BLOC * TAILLE_BLOC):
+        lx = k // (TAILLE_BLOC * nbrCases)
+        ly = (k // nbrCases) % TAILLE_BLOC
+        c = k % nbrCases
+        if x0 + lx < dimx and y0 + ly < dimy:
+            directionsEcoulement[x0 + lx, y0 + ly, c] = repartitions[lx, ly, c + 9 - nbrCases]
+
+@cuda.jit
+def myk_cellulesDraineesPartage(dataMNT, directionsEcoulement, noDataValue, cellDrainees, cellTraitee, traiteeAvant):
+    #Equivalent de MFD_cpu.myk_cellulesDrainees ; traiteeAvant : copie de cellTraitee au lancement (les autres blocs modifient
+    #cellTraitee pendant la passe). Poids (cases contiguës) et traiteeAvant du voisinage du bloc sont chargés en mémoire partagée ;
+    #comme dans le noyau d'origine, la ligne 0 et la colonne 0 ne sont pas lues (poids nuls)
+    poids = cuda.shared.array(shape=(HALO, HALO, 9), dtype=numba.uint8)
+    traitees = cuda.shared.array(shape=(HALO, HALO), dtype=numba.boolean)
+    dimx, dimy = dataMNT.shape
+    nbrCases = directionsEcoulement.shape[2]
+    x0 = cuda.blockIdx.x * TAILLE_BLOC - 1
+    y0 = cuda.blockIdx.y * TAILLE_BLOC - 1
+    t = cuda.threadIdx.x + cuda.threadIdx.y * TAILLE_BLOC
+    for k in range(t, HALO * HALO * nbrCases, TAILLE_BLOC * TAILLE_BLOC):
+        lx = k // (HALO * nbrCases)
+        ly = (k // nbrCases) % HALO
+        c = k % nbrCases
+        x = x0 + lx
+        y = y0 + ly
+        if x > 0 and y > 0 and x < dimx and y < dimy:
+            poids[lx, ly, c] = directionsEcoulement[x, y, c]
+        else:
+            poids[lx, ly, c] = 0
+    for k in range(t, HALO * HALO, TAILLE_BLOC * TAILLE_BLOC):
+        x = x0 + k // HALO
+        y = y0 + k % HALO
+        traitees[k // HALO, k % HALO] = not (x > 0 and y > 0 and x < dimx and y < dimy) or traiteeAvant[x, y]
+    cuda.syncthreads()
+    pos_x, pos_y = cuda.grid(2)
+    if pos_x < dimx and pos_y < dimy:
+        if dataMNT[pos_x, pos_y] == noDataValue:
+            cellDrainees[pos_x, pos_y] = 0
+        else:
+            test = True
+            aireDraineeCelluleActive = 0
+            for i in range(1, 9):
+                lx = cuda.threadIdx.x + 1 + DX[i]
+                ly = cuda.threadIdx.y + 1 + DY[i]
+                indice = i + 4 if i <= 4 else i - 4
+                test = test and (traitees[lx, ly] or poids[lx, ly, indice] == 0)
+                if poids[lx, ly, indice] > 0:
+                    aireDraineeCelluleActive += numba.int64(poids[lx, ly, indice]) * 100
+            if test:
+                cellDrainees[pos_x, pos_y] = 1 + aireDraineeCelluleActive
+                cellTraitee[pos_x, pos_y] = True
+
+
+# Noyaux lancés par ReseauDrainage : kernels CUDA de ce fichier ou leurs équivalents CPU (MFD_cpu)
+NOYAUX = ["myk_bruitageMNT", "myk_bruitageCompteur", "myk_comblementDepressions", "myk_copieMNT", "myk_remplir", "myk_directionsEcoulement",
+          "myk_cellulesDrainees"]
+
+
+def choixMoteur(moteur=None):
+    # Choix du moteur de calcul : "gpu", "cpu" ou "auto" (GPU si disponible, sinon CPU multi-coeurs), par défaut variable d'environnement MFD_MOTEUR
+    moteur = moteur or os.environ.get("MFD_MOTEUR", "auto")
+    if moteur == "auto":
+        moteur = "gpu" if cuda.is_available() else "cpu"
+    return moteur
+
+
+def noyaux(moteur):
+    if moteur == "cpu":
+        return {nom: MFD_cpu.lanceur(getattr(MFD_cpu, nom)) for nom in NOYAUX}
+    return {nom: globals()[nom] for nom in NOYAUX}
+
+
+class ReseauDrainage:
+    """Chaîne bruitage / comblement / directions / accumulation / crêtes sur un MNT en cm (uint32)
+
+    Les tableaux de travail sont alloués une seule fois et réutilisés d'un MNT à l'autre (réalloués seulement si la
+    taille change) et d'une itération de bruitage à l'autre. Les étapes sont calculées à la demande : cretes() ne
+    lance que le bruitage et la détection des dépressions, aireDrainee() enchaîne toutes les étapes nécessaires,
+    et une étape déjà faite pour l'itération courante n'est pas relancée.
+    """
+    def __init__(self, moteur=None, formatDirections="cube", amplitudeBruit=20, bruitageActif=1, generateurBruit="compteur", seed=1,
+                 methodeComblement="priorityFlood", nbrPassesComblement=20, epsilonComblement=1, methodeAccumulation="topologique",
+                 tailleTuileAccumulation=1024, tailleBlocMasque=None, resolutionPlats=False, methodeDirections="noyau",
+                 routage="lineaire", exposantRoutage=1.1, typePoids="pourcentage", memoirePartagee=False, cache=None, profil=None,
+                 tpb=(16, 16)):
+        #formatDirections : "cube" (dim1, dim2, 9) sur le device, "compact" (dim1, dim2, 8) ou "csr" (liste des récepteurs) sur l'hôte
+        #generateurBruit : "compteur" : bruit indépendant par cellule, reproductible quel que soit le moteur / "xoroshiro" : états par ligne et par colonne
+        #methodeComblement : "priorityFlood" : comblement complet en une passe / "exutoires" : jusqu'à nbrPassesComblement passes de myk_comblementDepressions
+        #epsilonComblement : pente minimale (en cm) imposée dans les zones comblées, 0 pour un comblement à plat
+        #methodeAccumulation : "topologique" : accumulation complète dans l'ordre amont-aval / "noyau" : une passe de myk_cellulesDrainees
+        #                      "tuiles" : même résultat que "topologique", par tuiles de tailleTuileAccumulation en parallèle (directions cube ou compact)
+        #tailleBlocMasque : None : NoData repéré par sa valeur comme dans la boucle d'origine / taille (multiple de 8) des blocs du masque de
+        #                   validité compacté (MFD_masque) : en CPU seulement, bruitage et directions sautent les blocs entièrement NoData ; en
+        #                   GPU aucun bloc n'est sauté, seule la réécriture du MNT par les directions est supprimée (comme en CPU)
+        #resolutionPlats : directions définies sur les zones plates (MFD_plats, Barnes et al. 2014), utile avec un comblement à plat
+        #                  ("exutoires" ou epsilonComblement = 0) : toute cellule valide non terminale a un récepteur
+        #methodeDirections : "noyau" : myk_directionsEcoulement / "vectorisee" : même répartition calculée sur les plans décalés du MNT
+        #                    (MFD_voisinage.directionsVectorisees, sur l'hôte), sans branchement par cellule
+        #routage : "lineaire" : répartition de myk_directionsEcoulement / "d8", "dinf", "freeman" ou "quinn" (MFD_routage, sur l'hôte,
+        #          pentes corrigées de la distance) ; exposantRoutage : exposant des pentes de "freeman" et "quinn"
+        #typePoids : "pourcentage" (uint8, somme 100) / "fixe16" (uint16, somme 65535) ou "float32" (somme 1), normalisés en une passe
+        #            par MFD_routage sur l'hôte ; accumulation "topologique" ou "tuiles" (cf MFD_directions.TYPES_POIDS)
+        #memoirePartagee : en GPU, noyaux à tuiles en mémoire partagée pour les dépressions, les directions et myk_cellulesDrainees
+        #                  (mêmes résultats que le moteur CPU, tpb = (TAILLE_BLOC, TAILLE_BLOC)) ; sans effet en CPU
+        #cache : MFD_cache.CacheRaster des résultats intermédiaires (None : pas de cache)
+        self.moteur = choixMoteur(moteur)
+        self.noyaux = noyaux(self.moteur)
+        self.formatDirections = formatDirections
+        self.amplitudeBruit = amplitudeBruit
+        self.bruitageActif = bruitageActif
+        self.generateurBruit = generateurBruit
+        self.seed = seed
+        self.methodeComblement = methodeComblement
+        self.nbrPassesComblement = nbrPassesComblement
+        self.epsilonComblement = epsilonComblement
+        self.methodeAccumulation = methodeAccumulation
+        self.tailleTuileAccumulation = tailleTuileAccumulation
+        self.tailleBlocMasque = tailleBlocMasque
+        self.resolutionPlats = resolutionPlats
+        if methodeDirections not in ("noyau", "vectorisee"):
+            raise ValueError("Méthode de calcul des directions inconnue : " + methodeDirections)
+        self.methodeDirections = methodeDirections
+        self.routage = routage
+        self.exposantRoutage = exposantRoutage
+        if typePoids not in MFD_directions.TYPES_POIDS:
+            raise ValueError("Type de poids inconnu : %s (%s)" % (typePoids, ", ".join(MFD_directions.TYPES_POIDS)))
+        if typePoids != "pourcentage" and methodeAccumulation == "noyau":
+            raise ValueError("myk_cellulesDrainees n'accepte que des pourcentages : typePoids " + typePoids)
+        if formatDirections != "cube" and methodeAccumulation == "noyau":
+            raise ValueError("myk_cellulesDrainees n'accepte que des directions en cube : formatDirections " + formatDirections)
+        self.typePoids = typePoids
+        self.memoirePartagee = memoirePartagee and self.moteur == "gpu"
+        if self.memoirePartagee:
+            if tuple(tpb) != (TAILLE_BLOC, TAILLE_BLOC):
+                raise ValueError("Les noyaux à mémoire partagée sont compilés pour tpb = (%d, %d)" % (TAILLE_BLOC, TAILLE_BLOC))
+            self.noyaux.update(myk_comblementDepressions=myk_comblementDepressionsPartage, myk_directionsEcoulement=myk_directionsEcoulementPartage,
+                               myk_cellulesDrainees=myk_cellulesDraineesPartage)
+        self.cache = cache
+        self.profil = profil if profil is not None else MFD_profil.Profil(self.synchroniser)
+        self.tpb = tpb
+        self.forme = None
+        self.h_mnt = None
+        self.iteration = None
+        self.faites = set()
+        if cache is not None:
+            #Sources des modules de calcul, kernels GPU de ce fichier compris
+            self.versionMFD = MFD_cache.versionCode(__file__, MFD_cpu.__file__, MFD_comblement.__file__, MFD_accumulation.__file__, MFD_directions.__file__,
+                                                    MFD_voisinage.__file__, MFD_aleatoire.__file__, MFD_plats.__file__, MFD_routage.__file__,
+                                                    MFD_masque.__file__, MFD_altitudes.__file__, MFD_cretes.__file__)
+
+    # Transferts hôte / device, sans effet en CPU
+    def versDevice(self, tableau):
+        return cuda.to_device(tableau) if self.moteur == "gpu" else tableau
+
+    def allouerComme(self, tableau):
+        #Tableau à zéro sur les deux moteurs (cuda.device_array_like laisserait la mémoire non initialisée)
+        return cuda.to_device(np.zeros_like(tableau)) if self.moteur == "gpu" else np.zeros_like(tableau)
+
+    def versHote(self, tableau):
+        return tableau.copy_to_host() if self.moteur == "gpu" else tableau.copy()
+
+    def copierVers(self, tableau_hote, d_tableau):
+        if self.moteur == "gpu":
+            d_tableau.copy_to_device(np.ascontiguousarray(tableau_hote))
+        else:
+            d_tableau[...] = tableau_hote
+
+    def synchroniser(self):
+        if self.moteur == "gpu":
             cuda.synchronize()
-            #print("...[GPU] - Comblement des zones dépressionnaires terminé en : ", datetime.datetime.now() - t0)
-    
-            h_mnt_ind_depr_tot = d_mnt_ind_depr_tot[0:1,0:10].copy_to_host()
-            
-            #print("Nombre de cellules d'écoulement : ", 9, " : ", h_mnt_ind_depr_tot[0, 9])
-            for i in range(0,1):
-                stats[iterationsBruitage, i] = h_mnt_ind_depr_tot[0, i]
-                if k == 19:
-                    print("Nombre de cellules d'écoulement : ", i, " : ", h_mnt_ind_depr_tot[0, i])
-            
-    
-    
-    
-    # [GPU] - Calcul des directions d'écoulement
-    t0 = datetime.datetime.now()
-    myk_directionsEcoulement[bpg, tpb](d_mnt_bruite, d_directionsEcoulement, 27108)
-    cuda.synchronize()
-    #print("...[GPU] - Calcul des directions d'écoulement terminé en : ", datetime.datetime.now() - t0)
-    
-    # [GPU] - Calcul du nombre de cellules drainées
-    t0 = datetime.datetime.now()
-    myk_cellulesDrainees[bpg, tpb](d_mnt_bruite, d_directionsEcoulement, 4284967396, d_cellDrainees, d_cellTraitee)
-    cuda.synchronize()
-    print("...[GPU] - Calcul des cellules drainées terminé en : ", datetime.datetime.now() - t0)
-    
-    
-    
-print("...[GPU] - Boucle complète de", nbrIterations, "itérations terminée en :", datetime.datetime.now() - t1)
 
-'''
-for i in range(10):
-    print("Nombre de cellules d'écoulement : ", i, " : ", int(stats[:, i].mean()))
+    def etatsAleatoires(self, n, seed):
+        return create_xoroshiro128p_states(n, seed=seed) if self.moteur == "gpu" else MFD_cpu.creerEtatsAleatoires(n, seed)
+
+    def allouer(self, dim1, dim2):
+        # Allocation des variables sur le device
+        self.forme = (dim1, dim2)
+        if self.formatDirections == "cube":
+            self.d_directionsEcoulement = self.allouerComme(np.zeros((dim1,dim2,9), dtype=MFD_directions.TYPES_POIDS[self.typePoids][0]))
+        elif self.formatDirections == "compact":
+            self.d_directionsEcoulement = MFD_directions.directionsCompactes(dim1, dim2, self.typePoids)
+        else:
+            self.d_directionsEcoulement = None
+        modele = np.zeros((dim1,dim2), dtype=np.uint32)
+        self.d_mnt = self.allouerComme(modele) if self.moteur == "gpu" else None
+        self.d_mnt_filled = self.allouerComme(modele)
+        self.d_mnt_codes_depr = self.allouerComme(modele)
+        self.d_mnt_bruite = self.allouerComme(modele)
+        self.d_mnt_ind_depr = self.allouerComme(modele)
+        #Comptes des dépressions dans mnt_ind_depr_tot[0, 0:10] : au moins 10 colonnes, même pour un MNT plus étroit
+        self.d_mnt_ind_depr_tot = self.allouerComme(np.zeros((dim1, max(dim2, 10)), dtype=np.uint32))
+        self.d_mnt_alt_cretes = self.allouerComme(modele)
+        self.d_cellDrainees = self.allouerComme(np.zeros((dim1,dim2), dtype=np.float64))
+        self.d_cellTraitee = self.allouerComme(np.zeros((dim1,dim2), dtype=np.bool_))
+        self.d_cellTraiteeAvant = self.allouerComme(np.zeros((dim1,dim2), dtype=np.bool_)) if self.moteur == "gpu" else None
+        self.bpg = (math.ceil(dim1 / self.tpb[0]), math.ceil(dim2 / self.tpb[1])) #blockspergrid
+        self.rng_states_x = self.etatsAleatoires(self.tpb[0] * self.bpg[0], seed=self.seed)
+        self.rng_states_y = self.etatsAleatoires(self.tpb[1] * self.bpg[1], seed=self.seed)
+
+    def charger(self, mnt, noDataValue=4284967396, codage=None, masque=None):
+        #Nouveau MNT (cm, uint32) : les tableaux sont réutilisés si la taille n'a pas changé, les résultats précédents sont invalidés
+        #codage : Codage MFD_altitudes du MNT ; un MNT déjà en uint32 (lireMNT(travail=True)) est utilisé tel quel, un type compact
+        #(uint16, int32 : stockage seulement) est élargi dans le tableau de travail uint32 (NoData : 4284967396)
+        #masque : masque de validité compacté (MFD_masque.masqueBande), calculé à partir de noDataValue s'il n'est pas donné
+        if self.forme != mnt.shape:
+            self.allouer(*mnt.shape)
+        self.codage = codage
+        if codage is not None and mnt.dtype != np.uint32:
+            self.h_mnt = MFD_altitudes.versTravail(mnt, codage, self.h_mnt if self.h_mnt is not None and self.h_mnt.shape == mnt.shape else None)
+            mnt, noDataValue = self.h_mnt, MFD_altitudes.NODATA_TRAVAIL
+        #myk_directionsEcoulement lit comme 99999 les cellules égales à 27108, comme dans la boucle d'origine (MNT en cm) ; avec un
+        #autre codage ou avec le masque, 27108 est une altitude ordinaire : valeur jamais atteinte, le MNT n'est pas modifié
+        self.noDataDirections = 27108 if (codage is None or codage is MFD_altitudes.CODAGE_CM) and self.tailleBlocMasque is None else 4294967295
+        if self.tailleBlocMasque is not None and self.moteur == "cpu":
+            self.masque = masque if masque is not None else MFD_masque.masqueValidite(mnt, noDataValue)
+            self.blocs = MFD_masque.blocsValides(self.masque, self.tailleBlocMasque)
+        self.nbrCellules = mnt.shape[0] * mnt.shape[1]
+        self.tailleMNT = self.nbrCellules * 4
+        self.profil.debut("transfert")
+        if self.moteur == "gpu":
+            self.copierVers(mnt, self.d_mnt)
+        else:
+            self.d_mnt = mnt #en CPU, le tableau (éventuellement mappé en mémoire) est utilisé sans copie
+        self.profil.fin(self.tailleMNT if self.moteur == "gpu" else 0, self.nbrCellules)
+        self.noDataValue = noDataValue
+        self.stats = np.zeros(10, dtype=np.int64)
+        self.iteration = None
+        self.faites = set()
+        if self.cache is not None:
+            self.empreinteMNT = MFD_cache.empreinteTableau(mnt)
+        return self
+
+    def _iteration(self, iteration):
+        if iteration != self.iteration:
+            self.iteration = iteration
+            self.faites = set()
+            self._cles(iteration)
+
+    def _cles(self, iteration):
+        if self.cache is not None:
+            # Clés des étapes dans le cache : chaque étape dépend du MNT, du code et des paramètres des étapes amont
+            #Le moteur, les noyaux à mémoire partagée et le masque (qui supprime la réécriture du MNT par les directions) sont dans la clé de
+            #la première étape, donc dans celles de toutes les étapes suivantes
+            self.cleComblement = self.cache.cle(self.empreinteMNT, self.versionMFD, "comblement", self.moteur, self.memoirePartagee, self.tailleBlocMasque,
+                                                self.amplitudeBruit, self.bruitageActif, self.generateurBruit, self.seed, iteration, self.tpb,
+                                                self.methodeComblement, self.epsilonComblement, self.nbrPassesComblement)
+            self.cleDirections = self.cache.cle(self.cleComblement, "directions", self.formatDirections, self.noDataDirections, self.resolutionPlats, self.methodeDirections,
+                                                self.routage, self.exposantRoutage, self.typePoids)
+            self.cleAccumulation = self.cache.cle(self.cleDirections, "accumulation", self.methodeAccumulation)
+
+    def bruitage(self, iteration=0):
+        self._iteration(iteration)
+        if "bruitage" in self.faites:
+            return
+        bpg, tpb = self.bpg, self.tpb
+        # [GPU] - bruitage du MNT
+        self.profil.debut("bruitage", iteration)
+        if self.generateurBruit == "compteur" and self.tailleBlocMasque is not None and self.moteur == "cpu":
+            MFD_masque.myk_bruitageBlocs(self.d_mnt, self.d_mnt_bruite, self.noDataValue, self.amplitudeBruit, self.seed, iteration, self.bruitageActif,
+                                         self.masque, self.blocs, self.tailleBlocMasque)
+        elif self.generateurBruit == "compteur":
+            self.noyaux["myk_bruitageCompteur"][bpg, tpb](self.d_mnt, self.d_mnt_bruite, self.noDataValue, self.amplitudeBruit, self.seed, iteration, self.bruitageActif, 0, 0)
+        else:
+            self.noyaux["myk_bruitageMNT"][bpg, tpb](self.d_mnt, self.d_mnt_bruite, self.noDataValue, self.amplitudeBruit, self.rng_states_x, self.rng_states_y, self.bruitageActif)
+        self.profil.fin(2 * self.tailleMNT, self.nbrCellules)
+        self.faites.add("bruitage")
+
+    def depressions(self, iteration=0):
+        self._iteration(iteration)
+        if "depressions" in self.faites:
+            return
+        self.bruitage(iteration)
+        # [GPU] - Calcul des zones dépressionnaires
+        self.profil.debut("depressions", iteration)
+        self._noyauDepressions()
+        self.profil.fin(6 * self.tailleMNT + self.nbrCellules, self.nbrCellules)
+        self.stats[:] = self.versHote(self.d_mnt_ind_depr_tot[0:1,0:10])[0]
+        self.faites.add("depressions")
+
+    def _noyauDepressions(self):
+        #Les comptes s'ajoutent à mnt_ind_depr_tot[0, 0:10] (atomiques, par cellule ou par bloc) : remise à zéro avant le lancement
+        self.copierVers(np.zeros((1, 10), dtype=np.uint32), self.d_mnt_ind_depr_tot[0:1, 0:10])
+        self.noyaux["myk_comblementDepressions"][self.bpg, self.tpb](self.d_mnt_bruite, self.d_mnt_filled, self.d_mnt_codes_depr, self.noDataValue, self.d_mnt_ind_depr,
+                                                                     self.d_mnt_ind_depr_tot, self.d_mnt_alt_cretes, self.d_cellTraitee)
+
+    def comblement(self, iteration=0):
+        self._iteration(iteration)
+        if "comblement" in self.faites:
+            return
+        entree = self.cache.charger(self.cleComblement) if self.cache is not None else None
+        if entree is not None:
+            # Bruitage et comblement relus dans le cache
+            self.profil.debut("cacheComblement", iteration)
+            self.copierVers(entree["mnt_bruite"], self.d_mnt_bruite)
+            self.copierVers(entree["mnt_filled"], self.d_mnt_filled)
+            self.copierVers(entree["mnt_codes_depr"], self.d_mnt_codes_depr)
+            self.copierVers(entree["mnt_alt_cretes"], self.d_mnt_alt_cretes)
+            self.stats[:] = entree["stats"]
+            self.profil.fin(4 * self.tailleMNT, self.nbrCellules)
+            self.faites.update(("bruitage", "depressions", "comblement"))
+            return
+        self.depressions(iteration)
+        bpg, tpb = self.bpg, self.tpb
+        if self.methodeComblement == "priorityFlood":
+            # [CPU] - Comblement de toutes les dépressions en une passe (Priority-Flood)
+            self.profil.debut("priorityFlood", iteration)
+            h_mnt_bruite = self.versHote(self.d_mnt_bruite)
+            h_mnt_filled = np.empty_like(h_mnt_bruite)
+            h_mnt_codes_depr = np.zeros_like(h_mnt_bruite)
+            h_mnt_ind_depr_tot = MFD_comblement.comblementPriorityFlood(h_mnt_bruite, h_mnt_filled, h_mnt_codes_depr, self.noDataValue, self.epsilonComblement)
+            self.copierVers(h_mnt_filled, self.d_mnt_filled)
+            self.copierVers(h_mnt_codes_depr, self.d_mnt_codes_depr)
+            self.noyaux["myk_copieMNT"][bpg, tpb](self.d_mnt_filled, self.d_mnt_bruite) #copie filled vers bruite
+            self.profil.fin(5 * self.tailleMNT, self.nbrCellules)
+            self.stats[0] = h_mnt_ind_depr_tot[0, 0]
+        else:
+            for k in range(self.nbrPassesComblement):
+                if self.stats[0] > 0:
+                    self.profil.debut("passeComblement", iteration)
+                    self.noyaux["myk_copieMNT"][bpg, tpb](self.d_mnt_filled, self.d_mnt_bruite) #copie filled vers bruite
+                    self.synchroniser()
+                    # [GPU] - Calcul des zones dépressionnaires
+                    self._noyauDepressions()
+                    self.profil.fin(8 * self.tailleMNT + self.nbrCellules, self.nbrCellules)
+                    self.stats[:] = self.versHote(self.d_mnt_ind_depr_tot[0:1,0:10])[0]
+        if self.cache is not None:
+            self.cache.enregistrer(self.cleComblement, mnt_bruite=self.versHote(self.d_mnt_bruite), mnt_filled=self.versHote(self.d_mnt_filled),
+                                   mnt_codes_depr=self.versHote(self.d_mnt_codes_depr), mnt_alt_cretes=self.versHote(self.d_mnt_alt_cretes), stats=self.stats)
+        self.faites.add("comblement")
+
+    def directions(self, iteration=0):
+        self._iteration(iteration)
+        if "directions" in self.faites:
+            return
+        entree = self.cache.charger(self.cleDirections) if self.cache is not None else None
+        if entree is not None:
+            if self.formatDirections == "csr":
+                self.d_directionsEcoulement = (entree["offsets"], entree["recepteurs"], entree["poids"])
+            else:
+                self.copierVers(entree["directionsEcoulement"], self.d_directionsEcoulement)
+            self.faites.add("directions")
+            return
+        self.comblement(iteration)
+        # [GPU] - Calcul des directions d'écoulement
+        self.profil.debut("directions", iteration)
+        if self.routage != "lineaire" or self.typePoids != "pourcentage":
+            self._routageHote()
+        elif self.methodeDirections == "vectorisee":
+            self._directionsVectorisees()
+        elif self.formatDirections != "csr" and self.tailleBlocMasque is not None and self.moteur == "cpu":
+            MFD_masque.myk_directionsBlocs(self.d_mnt_bruite, self.d_directionsEcoulement, self.masque, self.blocs, self.tailleBlocMasque)
+        elif self.formatDirections == "cube":
+            self.noyaux["myk_directionsEcoulement"][self.bpg, self.tpb](self.d_mnt_bruite, self.d_directionsEcoulement, self.noDataDirections)
+        elif self.formatDirections == "compact":
+            MFD_cpu.myk_directionsEcoulement(self.versHote(self.d_mnt_bruite), self.d_directionsEcoulement, self.noDataDirections)
+        else:
+            self.d_directionsEcoulement = MFD_directions.directionsCSR(self.versHote(self.d_mnt_bruite))
+        if self.resolutionPlats:
+            self._plats()
+        self.profil.fin(self.tailleMNT + 9 * self.nbrCellules, self.nbrCellules)
+        if self.cache is not None:
+            if self.formatDirections == "csr":
+                offsets, recepteurs, poids = self.d_directionsEcoulement
+                self.cache.enregistrer(self.cleDirections, offsets=offsets, recepteurs=recepteurs, poids=poids)
+            else:
+                self.cache.enregistrer(self.cleDirections, directionsEcoulement=self.versHote(self.d_directionsEcoulement))
+        self.faites.add("directions")
+
+    def _directionsVectorisees(self):
+        #Directions de myk_directionsEcoulement par plans décalés ; comme le noyau, les cellules égales à noDataDirections sont d'abord
+        #réécrites dans le MNT comme valant 99999
+        h_mnt_bruite = self.versHote(self.d_mnt_bruite)
+        h_mnt_bruite[h_mnt_bruite == self.noDataDirections] = 99999
+        self.copierVers(h_mnt_bruite, self.d_mnt_bruite)
+        plans = MFD_voisinage.plansVoisins(h_mnt_bruite)
+        if self.formatDirections == "compact" or (self.formatDirections == "cube" and self.moteur == "cpu"):
+            MFD_voisinage.directionsVectorisees(plans, self.d_directionsEcoulement)
+        else:
+            directions = MFD_voisinage.directionsVectorisees(plans, MFD_directions.directionsCompactes(*self.forme))
+            if self.formatDirections == "csr":
+                self.d_directionsEcoulement = MFD_directions.cubeVersCSR(directions)
+            else:
+                cube = np.zeros(self.forme + (9,), dtype=np.uint8)
+                cube[:, :, 1:] = directions
+                self.copierVers(cube, self.d_directionsEcoulement)
+
+    def _routageHote(self):
+        #Directions du modèle de routage choisi (MFD_routage), calculées sur l'hôte puis mises au format demandé
+        h_mnt_bruite = self.versHote(self.d_mnt_bruite)
+        if self.formatDirections == "compact" or (self.formatDirections == "cube" and self.moteur == "cpu"):
+            MFD_routage.directionsRoutage(h_mnt_bruite, self.d_directionsEcoulement, self.routage, self.exposantRoutage)
+            return
+        directions = MFD_directions.directionsCompactes(*self.forme, self.typePoids)
+        MFD_routage.directionsRoutage(h_mnt_bruite, directions, self.routage, self.exposantRoutage)
+        if self.formatDirections == "csr":
+            self.d_directionsEcoulement = MFD_directions.cubeVersCSR(directions)
+        else:
+            cube = np.zeros(self.forme + (9,), dtype=directions.dtype)
+            cube[:, :, 1:] = directions
+            self.copierVers(cube, self.d_directionsEcoulement)
+
+    def _plats(self):
+        #Directions des zones plates du MNT comblé (MNT tel que lu par les directions) ; retourne (nbr de plats, nbr de cellules)
+        h_mnt_bruite = self.versHote(self.d_mnt_bruite)
+        if self.formatDirections == "csr":
+            compact = MFD_directions.directionsCompactes(*self.forme, self.typePoids)
+            MFD_directions.csrVersCompact(*self.d_directionsEcoulement, compact, 0, self.forme[0])
+            resultat = MFD_plats.resoudrePlats(h_mnt_bruite, compact)
+            self.d_directionsEcoulement = MFD_directions.cubeVersCSR(compact)
+        elif self.formatDirections == "compact":
+            resultat = MFD_plats.resoudrePlats(h_mnt_bruite, self.d_directionsEcoulement)
+        else:
+            h_directionsEcoulement = self.versHote(self.d_directionsEcoulement)
+            resultat = MFD_plats.resoudrePlats(h_mnt_bruite, h_directionsEcoulement)
+            self.copierVers(h_directionsEcoulement, self.d_directionsEcoulement)
+        return resultat
+
+    def accumulation(self, iteration=0):
+        self._iteration(iteration)
+        if "accumulation" in self.faites:
+            return
+        # Calcul du nombre de cellules drainées
+        entree = self.cache.charger(self.cleAccumulation) if self.cache is not None else None
+        if entree is not None:
+            self.copierVers(entree["cellDrainees"], self.d_cellDrainees)
+            self.faites.add("accumulation")
+            return
+        self.directions(iteration)
+        self.comblement(iteration) #MNT comblé, si les directions viennent du cache
+        self.profil.debut("accumulation", iteration)
+        if self.methodeAccumulation in ("topologique", "tuiles"):
+            h_cellDrainees = self.versHote(self.d_cellDrainees)
+            if self.formatDirections == "csr":
+                offsets, recepteurs, poids = self.d_directionsEcoulement
+                MFD_accumulation.accumulationCSR(self.versHote(self.d_mnt_bruite), offsets, recepteurs, poids, self.noDataValue, h_cellDrainees)
+            else:
+                h_directionsEcoulement = self.versHote(self.d_directionsEcoulement) if self.formatDirections == "cube" else self.d_directionsEcoulement
+                if self.methodeAccumulation == "tuiles":
+                    MFD_accumulation.accumulationParTuiles(self.versHote(self.d_mnt_bruite), h_directionsEcoulement, self.noDataValue, h_cellDrainees,
+                                                           self.tailleTuileAccumulation)
+                else:
+                    MFD_accumulation.accumulationTopologique(self.versHote(self.d_mnt_bruite), h_directionsEcoulement, self.noDataValue, h_cellDrainees)
+            self.copierVers(h_cellDrainees, self.d_cellDrainees)
+        elif self.moteur == "gpu":
+            #myk_cellulesDrainees n'écrit que les cellules dont l'amont est traité : les autres restent à 0, pas à la valeur de l'itération précédente
+            self.noyaux["myk_remplir"][self.bpg, self.tpb](self.d_cellDrainees, 0)
+            self.noyaux["myk_copieMNT"][self.bpg, self.tpb](self.d_cellTraitee, self.d_cellTraiteeAvant)
+            self.noyaux["myk_cellulesDrainees"][self.bpg, self.tpb](self.d_mnt_bruite, self.d_directionsEcoulement, self.noDataValue, self.d_cellDrainees, self.d_cellTraitee,
+                                                                    self.d_cellTraiteeAvant)
+        else:
+            #MFD_cpu.myk_cellulesDrainees copie lui-même cellTraitee au lancement
+            self.noyaux["myk_remplir"][self.bpg, self.tpb](self.d_cellDrainees, 0)
+            self.noyaux["myk_cellulesDrainees"][self.bpg, self.tpb](self.d_mnt_bruite, self.d_directionsEcoulement, self.noDataValue, self.d_cellDrainees, self.d_cellTraitee)
+        self.profil.fin(self.tailleMNT + 17 * self.nbrCellules, self.nbrCellules)
+        if self.cache is not None:
+            self.cache.enregistrer(self.cleAccumulation, cellDrainees=self.versHote(self.d_cellDrainees))
+        self.faites.add("accumulation")
+
+    def modifier(self, l0, c0, valeurs, iteration=0):
+        #Remplace le MNT (mêmes unités que le MNT chargé) sur la fenêtre [l0, l0 + valeurs.shape[0][ x [c0, c0 + valeurs.shape[1][
+        #En CPU, avec le bruit "compteur", le comblement "priorityFlood" et les directions cube ou compact, et si l'accumulation de
+        #l'itération est déjà calculée : comblement, directions, codes, crêtes et aires drainées sont mis à jour localement (MFD_incremental)
+        #et le nbr de cellules recalculées par étape est retourné ; sinon toutes les étapes seront recalculées à la demande (retour None)
+        l1, c1 = l0 + valeurs.shape[0], c0 + valeurs.shape[1]
+        if self.moteur == "gpu":
+            self.d_mnt[l0:l1, c0:c1].copy_to_device(np.ascontiguousarray(valeurs))
+        else:
+            if not self.d_mnt.flags.writeable:
+                self.d_mnt = np.array(self.d_mnt) #MNT mappé en lecture seule (MFD_raster.mntCm)
+            self.d_mnt[l0:l1, c0:c1] = valeurs
+        if self.cache is not None:
+            self.empreinteMNT = MFD_cache.empreinteTableau(self.d_mnt)
+            self._cles(self.iteration)
+        incremental = (self.moteur == "cpu" and self.generateurBruit == "compteur" and self.methodeComblement == "priorityFlood"
+                       and self.formatDirections != "csr" and self.methodeAccumulation != "noyau" and not self.resolutionPlats
+                       and self.routage == "lineaire" and self.typePoids == "pourcentage"
+                       and self.iteration == iteration and "accumulation" in self.faites)
+        if not incremental:
+            self.iteration = None
+            self.faites = set()
+            return None
+
+        self.profil.debut("modification", iteration)
+        dim1, dim2 = self.forme
+        bruit = (self.amplitudeBruit, self.seed, iteration, self.bruitageActif)
+        recalculees = MFD_incremental.miseAJourComblement(self.d_mnt, self.d_mnt_filled, self.d_directionsEcoulement, self.noDataValue,
+                                                          self.epsilonComblement, bruit, l0, l1, c0, c1)
+        self.d_mnt_bruite.reshape(-1)[recalculees] = self.d_mnt_filled.reshape(-1)[recalculees]
+        fenetre = MFD_incremental.cellulesFenetre(l0, l1, c0, c1, dim1, dim2)
+        voisines = MFD_incremental.voisinage1(np.concatenate((recalculees, fenetre)), dim1, dim2)
+        MFD_incremental.codesLocaux(self.d_mnt_filled, self.d_mnt_codes_depr, self.noDataValue, voisines)
+        changees, anciennes = MFD_incremental.directionsLocales(self.d_mnt_bruite, self.d_directionsEcoulement, voisines)
+        nbrAval = MFD_incremental.accumulationAval(self.d_mnt_bruite, self.d_directionsEcoulement, self.noDataValue, self.d_cellDrainees,
+                                                   fenetre, changees, anciennes)
+
+        #Crêtes du MNT bruité (avant comblement) sur la fenêtre et sa bordure, le bruit étant recalculé sur une bordure de 2 cellules
+        hl0, hl1, hc0, hc1 = max(l0 - 2, 0), min(l1 + 2, dim1), max(c0 - 2, 0), min(c1 + 2, dim2)
+        bruite = np.empty((hl1 - hl0, hc1 - hc0), dtype=np.uint32)
+        MFD_cpu.myk_bruitageCompteur(self.d_mnt[hl0:hl1, hc0:hc1], bruite, self.noDataValue, self.amplitudeBruit, self.seed, iteration,
+                                     self.bruitageActif, hl0, hc0)
+        cretes, _ = MFD_cretes.cretesVectorisees(bruite)
+        bl0, bl1, bc0, bc1 = max(l0 - 1, 0), min(l1 + 1, dim1), max(c0 - 1, 0), min(c1 + 1, dim2)
+        self.d_mnt_alt_cretes[bl0:bl1, bc0:bc1] = cretes[bl0 - hl0:bl1 - hl0, bc0 - hc0:bc1 - hc0].view(np.uint32)
+        self.profil.fin(0, recalculees.shape[0] + nbrAval)
+        return {"comblement": recalculees.shape[0], "directions": changees.shape[0], "accumulation": nbrAval}
+
+    # Résultats sur l'hôte : seules les étapes nécessaires sont calculées
+    def cretes(self, iteration=0):
+        #Altitude des lignes de crête (0 ailleurs, 99999 n'est que la valeur NoData déclarée du COG) ; en mode "exutoires", crêtes de la dernière passe de comblement comme dans la boucle d'origine
+        self._iteration(iteration)
+        if self.methodeComblement == "priorityFlood" and "comblement" not in self.faites:
+            self.depressions(iteration)
+        else:
+            self.comblement(iteration)
+        return self.versHote(self.d_mnt_alt_cretes)
+
+    def mntComble(self, iteration=0):
+        self.comblement(iteration)
+        return self.versHote(self.d_mnt_filled)
+
+    def codesDepressions(self, iteration=0):
+        self.comblement(iteration)
+        return self.versHote(self.d_mnt_codes_depr)
+
+    def directionsEcoulement(self, iteration=0):
+        #Cube, tableau compact ou triplet CSR selon formatDirections
+        self.directions(iteration)
+        if self.formatDirections == "cube":
+            return self.versHote(self.d_directionsEcoulement)
+        return self.d_directionsEcoulement
+
+    def aireDrainee(self, iteration=0):
+        self.accumulation(iteration)
+        return self.versHote(self.d_cellDrainees)
+
+    def _directionsGrille(self, iteration=0):
+        #Directions sur l'hôte en cube ou format compact (le format CSR est décodé au format compact)
+        directions = self.directionsEcoulement(iteration)
+        if self.formatDirections == "csr":
+            compact = MFD_directions.directionsCompactes(*self.forme, self.typePoids)
+            MFD_directions.csrVersCompact(*directions, compact, 0, self.forme[0])
+            directions = compact
+        return directions
+
+    def bilanMasse(self, iteration=0):
+        #Contrôle de conservation de l'accumulation : (aire sortant aux cellules sans récepteur, nbr de cellules valides)
+        cellDrainees = self.aireDrainee(iteration)
+        return MFD_accumulation.bilanMasse(self.versHote(self.d_mnt_bruite), self.directionsEcoulement(iteration), self.noDataValue, cellDrainees)
 
-h_directionsEcoulement = d_directionsEcoulement.copy_to_host()    
+    def reseau(self, seuil, iteration=0):
+        #Réseau hydrographique des cellules drainant au moins seuil cellules : tronçons, ordres de Strahler (cf MFD_reseau)
+        cellDrainees = self.aireDrainee(iteration)
+        return MFD_reseau.reseauHydrographique(cellDrainees, self._directionsGrille(iteration), seuil)
 
-'''
-'''
-# Ecriture du fichier de sortie
-h_mnt_filled = mnt_codes_depr.copy_to_host()
+    def delimitation(self, iteration=0):
+        #Moteur de délimitation des bassins versants (index des donneurs construit une fois, cf MFD_bassins)
+        return MFD_bassins.Delimitation(self._directionsGrille(iteration))
 
-debut = datetime.datetime.now()
-driver = gdal.GetDriverByName("GTiff")
-outdata = driver.Create("mnt_filled_4.tif", dim2, dim1, 1, gdal.GDT_Int32)
-outdata.SetGeoTransform(fichier_mnt.GetGeoTransform())##sets same geotransform as input
-outdata.SetProjection(fichier_mnt.GetProjection())##sets same projection as input
-outdata.GetRasterBand(1).WriteArray(h_mnt_filled)
-outdata.GetRasterBand(1).SetNoDataValue(99999)##if you want these values transparent
-outdata.FlushCache() ##saves to disk!!
-print("...Ecriture fichier sortie terminée en : ", datetime.datetime.now() - debut)
-'''
 
+if __name__ == "__main__":
+    nbrIterations = 1
+    fichierDirections = None #fichier GTiff 8 bandes des directions d'écoulement (None : pas d'écriture)
+    repertoireCache = None #répertoire du cache disque des résultats intermédiaires (None : pas de cache)
+    budgetCache = 20 * 2**30 #taille maximale du cache en octets, les entrées les moins récemment utilisées sont supprimées au-delà
+    cache = MFD_cache.CacheRaster(repertoireCache, budgetCache) if repertoireCache is not None else None
 
-# Ecriture du fichier de sortie
-h_mnt_alt_cretes = d_mnt_alt_cretes.copy_to_host()
+    reseau = ReseauDrainage(formatDirections="cube", amplitudeBruit=20, bruitageActif=1, generateurBruit="compteur", seed=1,
+                            methodeComblement="priorityFlood", nbrPassesComblement=20, epsilonComblement=1, methodeAccumulation="topologique",
+                            cache=cache)
+    # Mesure des temps par étape ; rapports JSON, CSV et chronologie Chrome si la variable d'environnement MFD_PROFIL est définie
+    profil = reseau.profil
+    print("Moteur de calcul : ", reseau.moteur)
 
-debut = datetime.datetime.now()
-driver = gdal.GetDriverByName("GTiff")
-outdata = driver.Create("mnt_lignesCretes4.tif", dim2, dim1, 1, gdal.GDT_Int32)
-outdata.SetGeoTransform(fichier_mnt.GetGeoTransform())##sets same geotransform as input
-outdata.SetProjection(fichier_mnt.GetProjection())##sets same projection as input
-outdata.GetRasterBand(1).WriteArray(h_mnt_alt_cretes)
-outdata.GetRasterBand(1).SetNoDataValue(99999)##if you want these values transparent
-outdata.FlushCache() ##saves to disk!!
-print("...Ecriture fichier sortie terminée en : ", datetime.datetime.now() - debut)
+    # Lecture du MNT
+    profil.debut("lecture")
+    # MNT converti en cm (uint32) par blocs dans un fichier .npy annexe mappé en mémoire, reconverti seulement si le GeoTIFF a changé
+    fichier_mnt, h_mnt, noDataValue = MFD_raster.mntCm("Alti_Dpt10_AOC_Champagne.tif")
+    NDV = fichier_mnt.GetRasterBand(1).GetNoDataValue()
+    #print("NDV : ", NDV)
+    #print(h_mnt[0:1,0:5])
+    (dim1,dim2) = h_mnt.shape
+    nbrCellules = dim1 * dim2
+    tailleMNT = h_mnt.nbytes
+    profil.fin(tailleMNT, nbrCellules)
+    #print("...Lecture MNT terminée en : ", datetime.datetime.now() - debut)
 
+    # Transfert des données MNT sur le device (en CPU, le tableau mappé est utilisé sans copie) et allocation des variables
+    reseau.charger(h_mnt, noDataValue)
 
+    test_mnt = reseau.versHote(reseau.d_mnt[0:1,0:5])
+    print("NoDataValue sur device : ", test_mnt[0,0])
 
-'''
-# Récupération des résultats
-t0 = datetime.datetime.now()
-#directionEcoul = directionsEcoulement.copy_to_host()
-print("...Récupération des résultats terminée en : ", datetime.datetime.now() - t0)
-'''
+    stats = np.zeros((nbrIterations,10), dtype=np.int64)
+    t1 = datetime.datetime.now()
+    for iterationsBruitage in range(nbrIterations):
+        t0 = datetime.datetime.now()
+        reseau.accumulation(iterationsBruitage)
+        stats[iterationsBruitage] = reseau.stats
+        print("...Calcul des cellules drainées terminé en : ", datetime.datetime.now() - t0)
+        sortie, aireValide = reseau.bilanMasse(iterationsBruitage)
+        print("...Bilan de masse : aire sortante", sortie, "/ cellules valides", aireValide, "- écart relatif", abs(sortie - aireValide) / max(aireValide, 1))
 
+    print("...[GPU] - Boucle complète de", nbrIterations, "itérations terminée en :", datetime.datetime.now() - t1)
 
+    '''
+    for i in range(10):
+        print("Nombre de cellules d'écoulement : ", i, " : ", int(stats[:, i].mean()))
+    '''
 
+    # Ecriture du fichier de sortie
+    h_mnt_alt_cretes = reseau.cretes(nbrIterations - 1)
 
+    profil.debut("ecriture")
+    MFD_raster.ecrireCOG("mnt_lignesCretes4.tif", fichier_mnt, h_mnt_alt_cretes.view(np.int32), 99999) #COG tuilé et compressé, encodage multi-thread
+    duree = profil.fin(tailleMNT, nbrCellules)
+    print("...Ecriture fichier sortie terminée en : ", datetime.timedelta(seconds=duree))
 
+    if fichierDirections is not None:
+        profil.debut("ecritureDirections")
+        MFD_tuiles.ecrireDirections(fichierDirections, fichier_mnt, reseau.directionsEcoulement(nbrIterations - 1))
+        profil.fin(8 * nbrCellules, nbrCellules)
 
+    profil.afficher()
+    profil.exporter()
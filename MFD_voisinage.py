@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Voisinage 3x3 des cellules du MNT, commun à MFD.py, MFD_v2.py et MFD_v3.py
+
+- voisins / voisinsDevice : lecture du voisinage d'une cellule (version CPU
+  njit et fonction device CUDA compilées à partir du même code) ;
+- plansVoisins : les 9 plans décalés du MNT entier, vues sur un MNT bordé
+  une seule fois par une sentinelle, sans copie ni test de bord par cellule ;
+- fenetres : découpage en tuiles avec halo (MFD_tuiles, MFD_accumulation),
+  sans dépendance à GDAL.
+
+Numérotation des voisins : 0:centre, 1:nord-est, 2:nord, 3:nord-ouest,
+4:ouest, 5:sud-ouest, 6:sud, 7:sud-est, 8:est (cf CalculReseauDrainage.pptx).
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+from __future__ import division
+import numpy as np
+import numba
+from numba import cuda, njit
+
+#Décalages (x, y) des voisins 0 à 8
+DX = np.array([0, 1, 0, -1, -1, -1, 0, 1, 1], dtype=np.int64)
+DY = np.array([0, -1, -1, -1, 0, 1, 1, 1, 0], dtype=np.int64)
+
+
+def _voisins(dataMNT, pos_x, pos_y, dimx, dimy, voisinage):
+    #voisinage[0:9] contient soit l'altitude des différents voisins immédiats, soit -1 si la donnée n'existe pas
+    #voisinage[9] : nbr de cellules voisines valides (> 0) inférieures au centre
+    #Les altitudes uint32 au-delà de 2**31 (NoData) sont relues en négatif, comme par la conversion implicite du code compilé,
+    #explicitement pour le simulateur CUDA (numpy refuse la conversion avec débordement)
+    for i in range(9):
+        x = pos_x + DX[i]
+        y = pos_y + DY[i]
+        if x >= 0 and y >= 0 and x < dimx and y < dimy:
+            altitude = numba.int64(dataMNT[x, y])
+            voisinage[i] = altitude - 4294967296 if altitude > 2147483647 else altitude
+        else:
+            voisinage[i] = -1
+    voisinage[9] = 0
+    for i in range(1, 9):
+        if voisinage[i] > 0 and voisinage[i] < voisinage[0]:
+            voisinage[9] += 1
+    return voisinage
+
+
+voisins = njit(_voisins)
+voisinsDevice = cuda.jit(device=True)(_voisins)
+
+
+def fenetres(dim1, dim2, tailleTuile, halo=1):
+    #Génère pour chaque tuile (l0, l1, c0, c1) la zone utile et (hl0, hl1, hc0, hc1) la zone lue, halo compris
+    for l0 in range(0, dim1, tailleTuile):
+        for c0 in range(0, dim2, tailleTuile):
+            l1 = min(l0 + tailleTuile, dim1)
+            c1 = min(c0 + tailleTuile, dim2)
+            yield (l0, l1, c0, c1), (max(l0 - halo, 0), min(l1 + halo, dim1), max(c0 - halo, 0), min(c1 + halo, dim2))
+
+
+def plansVoisins(mnt, sentinelle=-1):
+    #Retourne la liste des 9 plans (dimx, dimy) : plans[i][x, y] = altitude du voisin i de (x, y), sentinelle hors du MNT
+    #Les entiers non signés sont relus en entiers signés de même taille, comme dans les tableaux voisinage des kernels
+    if mnt.dtype.kind == "u":
+        mnt = mnt.view(np.dtype("i%d" % mnt.dtype.itemsize))
+    borde = np.pad(mnt, 1, mode="constant", constant_values=sentinelle)
+    fenetres = np.lib.stride_tricks.sliding_window_view(borde, (3, 3))
+    return [fenetres[:, :, 1 + DX[i], 1 + DY[i]] for i in range(9)]
+
+
+def nbrVoisinsInferieurs(plans):
+    #Equivalent vectorisé de voisinage[9] (codes de dépression)
+    centre = plans[0]
+    compte = np.zeros(centre.shape, dtype=np.uint8)
+    for i in range(1, 9):
+        compte += (plans[i] > 0) & (plans[i] < centre)
+    return compte
+
+
+def directionsVectorisees(plans, directionsEcoulement, noDataValue=None):
+    #Equivalent vectorisé de myk_directionsEcoulement (cube à 9 cases ou tableau compact à 8 cases)
+    #Comme dans le kernel, les cellules égales à noDataValue sont lues comme valant 99999
+    if noDataValue is not None:
+        noDataValue = np.array([noDataValue], dtype=np.int64).astype(plans[0].dtype)[0]
+        plans = [np.where(p == noDataValue, 99999, p) for p in plans]
+    centre = plans[0].astype(np.int64)
+    diff = []
+    for i in range(9):
+        recepteur = (plans[i] > 0) & (plans[i] <= centre)
+        diff.append(np.where(recepteur, centre - plans[i], 0).astype(np.uint16))
+    diffTot = np.zeros(centre.shape, dtype=np.uint16)
+    for i in range(9):
+        diffTot += diff[i]
+    actif = diffTot != 0
+    diviseur = np.where(actif, diffTot, 1)
+    pourcentages = [np.where(actif, 100 * diff[i].astype(np.int64) / diviseur, 0).astype(np.int64) for i in range(9)]
+    repartition = [p.astype(np.uint8) for p in pourcentages]
+
+    #Correction des arrondis : +1 sur les cases non nulles dans l'ordre 1 à 8, en deux passes au plus
+    somme = np.zeros(centre.shape, dtype=np.int64)
+    for i in range(9):
+        somme += pourcentages[i]
+    reste = 100 - somme
+    nbrNonNuls = np.zeros(centre.shape, dtype=np.int64)
+    for i in range(1, 9):
+        nbrNonNuls += repartition[i] != 0
+    rang = np.zeros(centre.shape, dtype=np.int64)
+    premier = directionsEcoulement.shape[2] - 8
+    for i in range(1, 9):
+        nonNul = repartition[i] != 0
+        ajout = nonNul & (rang < reste)
+        ajout2 = nonNul & (rang + nbrNonNuls < reste)
+        directionsEcoulement[:, :, i - 1 + premier] = repartition[i] + ajout + ajout2
+        rang += nonNul
+    return directionsEcoulement
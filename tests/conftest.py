@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+#Modules du dépôt importables depuis tests/ (scripts à plat à la racine)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Conservation de la masse de l'accumulation : l'aire sortant aux cellules
+sans récepteur égale le nbr de cellules valides (MFD_accumulation.bilanMasse)
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+import pytest
+import MFD_benchmark
+import MFD_v3
+
+NODATA = 4284967396
+#Tolérance relative : sommes de poids exactes en entiers, arrondis float32 sinon
+TOLERANCES = {"pourcentage": 1e-9, "fixe16": 1e-9, "float32": 1e-5}
+
+
+@pytest.fixture(scope="module", params=["fractal", "trous"])
+def mnt(request):
+    return MFD_benchmark.genererMNT(request.param, 96, seed=2)
+
+
+@pytest.mark.parametrize("typePoids", ["pourcentage", "fixe16", "float32"])
+@pytest.mark.parametrize("formatDirections", ["cube", "compact", "csr"])
+@pytest.mark.parametrize("methodeAccumulation", ["topologique", "tuiles"])
+@pytest.mark.parametrize("routage", ["lineaire", "freeman"])
+def test_conservation(mnt, typePoids, formatDirections, methodeAccumulation, routage):
+    reseau = MFD_v3.ReseauDrainage(moteur="cpu", formatDirections=formatDirections, methodeAccumulation=methodeAccumulation,
+                                   tailleTuileAccumulation=32, routage=routage, typePoids=typePoids)
+    reseau.charger(mnt, NODATA)
+    sortie, aireValide = reseau.bilanMasse()
+    assert aireValide > 0
+    assert sortie == pytest.approx(aireValide, rel=TOLERANCES[typePoids])
+
+
+@pytest.mark.parametrize("forme", [(6, 8), (1, 5), (12, 3)])
+@pytest.mark.parametrize("methodeAccumulation", ["topologique", "noyau"])
+def test_petitsMNT(forme, methodeAccumulation):
+    #MNT de moins de 10 colonnes : les comptes des dépressions (stats) ont leur propre place
+    mnt = MFD_benchmark.genererMNT("cuvettes", 16, seed=2)[:forme[0], :forme[1]].copy()
+    reseau = MFD_v3.ReseauDrainage(moteur="cpu", methodeComblement="exutoires", methodeAccumulation=methodeAccumulation)
+    reseau.charger(mnt, NODATA)
+    reseau.aireDrainee()
+    assert reseau.stats[9] == mnt.size
+    if methodeAccumulation == "topologique":
+        sortie, aireValide = reseau.bilanMasse()
+        assert sortie == pytest.approx(aireValide, rel=1e-9)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Accumulation par tuiles sur plats résolus (MFD_plats) : récepteur et donneur
+ont la même altitude, la propagation aux frontières doit rester en une seule
+visite par cellule et donner le même résultat que l'ordre topologique
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+import numpy as np
+import pytest
+import MFD_accumulation
+import MFD_benchmark
+import MFD_v3
+
+NODATA = 4284967396
+
+
+def plateau(n):
+    #Plateau à 500 m bordé d'une pente vers le bord nord
+    mnt = np.full((n, n), 50000, dtype=np.uint32)
+    mnt[0, :] = 49000
+    return mnt
+
+
+@pytest.mark.parametrize("mnt, amplitudeBruit", [(plateau(22), 0), (plateau(64), 0), (MFD_benchmark.genererMNT("cuvettes", 70, seed=2), 20)],
+                         ids=["plateau22", "plateau64", "cuvettes70"])
+@pytest.mark.parametrize("tailleTuile", [4, 16])
+def test_tuilesPlats(mnt, amplitudeBruit, tailleTuile):
+    aires = {}
+    for methode in ["topologique", "tuiles"]:
+        reseau = MFD_v3.ReseauDrainage(moteur="cpu", methodeAccumulation=methode, tailleTuileAccumulation=tailleTuile,
+                                       resolutionPlats=True, epsilonComblement=0, amplitudeBruit=amplitudeBruit)
+        reseau.charger(mnt.copy(), NODATA)
+        aires[methode] = reseau.aireDrainee()
+        if methode == "tuiles":
+            sortie, aireValide = reseau.bilanMasse()
+            assert sortie == pytest.approx(aireValide, rel=1e-9)
+            #Une seule visite par cellule à l'étape de propagation
+            aire = np.zeros(mnt.shape, dtype=np.float64)
+            visites = MFD_accumulation.accumulationParTuiles(reseau.versHote(reseau.d_mnt_bruite), reseau._directionsGrille(),
+                                                             reseau.noDataValue, aire, tailleTuile)
+            assert visites <= mnt.size
+            np.testing.assert_allclose(aire, aires["tuiles"], rtol=1e-9)
+    np.testing.assert_allclose(aires["tuiles"], aires["topologique"], rtol=1e-9)
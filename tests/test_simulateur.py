@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Parité des noyaux CUDA de MFD_v3.py (moteur "gpu") avec le moteur CPU
+(MFD_cpu), étape par étape. Le moteur "gpu" tourne dans un processus fils,
+avec le simulateur CUDA de numba (NUMBA_ENABLE_CUDASIM=1, sauf si la variable
+est déjà définie : NUMBA_ENABLE_CUDASIM=0 pour un vrai GPU) ; le moteur CPU
+tourne dans le processus de test, sans simulateur.
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+from numba import cuda
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import MFD_aleatoire
+import MFD_benchmark
+import MFD_v3
+
+NODATA = 4284967396
+#Tailles multiple et non multiple du bloc de 16 x 16 threads, MNT de moins de 10 colonnes ; "trous" : cellules NoData
+MNTS = [("cuvettes", (32, 32)), ("trous", (40, 37)), ("cuvettes", (12, 3))]
+CONFIGURATIONS = {
+    "origine": dict(methodeAccumulation="noyau"),
+    "partagee": dict(memoirePartagee=True, methodeAccumulation="noyau"),
+    "partageeExutoires": dict(memoirePartagee=True, methodeComblement="exutoires"),
+}
+ETAPES = ["bruitage", "cretes", "stats", "comblement", "codes", "directions", "aire", "aire1"]
+#Bruit à compteur : graine, réalisation, amplitude
+BRUIT = (3, 2, 20)
+
+
+@cuda.jit
+def myk_bruits(bruits, seed, realisation, amplitudeBruit, l0, c0):
+    pos_x, pos_y = cuda.grid(2)
+    if pos_x < bruits.shape[0] and pos_y < bruits.shape[1]:
+        bruits[pos_x, pos_y] = MFD_aleatoire.bruitCelluleDevice(seed, realisation, l0 + pos_x, c0 + pos_y, amplitudeBruit)
+
+
+def bruits(moteur, forme, l0, c0):
+    #Bruit des cellules [l0, l0 + forme[0][ x [c0, c0 + forme[1][ du MNT complet : bruitCellule (njit) ou bruitCelluleDevice (noyau)
+    seed, realisation, amplitudeBruit = BRUIT
+    if moteur == "cpu":
+        return np.array([[MFD_aleatoire.bruitCellule(seed, realisation, l0 + x, c0 + y, amplitudeBruit) for y in range(forme[1])]
+                         for x in range(forme[0])], dtype=np.int64)
+    d_bruits = cuda.to_device(np.zeros(forme, dtype=np.int64))
+    myk_bruits[(-(-forme[0] // 16), -(-forme[1] // 16)), (16, 16)](d_bruits, seed, realisation, amplitudeBruit, l0, c0)
+    return d_bruits.copy_to_host()
+
+
+def processusFils(*arguments):
+    #Lance ce fichier dans un processus fils avec le simulateur (sauf NUMBA_ENABLE_CUDASIM déjà défini) et relit ses résultats
+    fichier = arguments[0]
+    env = dict(os.environ, NUMBA_ENABLE_CUDASIM=os.environ.get("NUMBA_ENABLE_CUDASIM", "1"))
+    subprocess.run([sys.executable, __file__] + [str(a) for a in arguments], env=env, check=True)
+    with np.load(fichier) as resultats:
+        return dict(resultats)
+
+
+def etapes(moteur, terrain, forme, nom):
+    mnt = MFD_benchmark.genererMNT(terrain, max(forme), seed=2)[:forme[0], :forme[1]].copy()
+    reseau = MFD_v3.ReseauDrainage(moteur=moteur, **CONFIGURATIONS[nom])
+    reseau.charger(mnt, NODATA)
+    reseau.bruitage()
+    resultats = {"bruitage": reseau.versHote(reseau.d_mnt_bruite)}
+    resultats["cretes"] = reseau.cretes()
+    resultats["stats"] = reseau.stats.copy()
+    resultats["comblement"] = reseau.mntComble()
+    resultats["codes"] = reseau.codesDepressions()
+    resultats["directions"] = reseau.directionsEcoulement()
+    resultats["aire"] = reseau.aireDrainee()
+    #Itération suivante sur les mêmes tableaux : rien ne doit rester de la précédente
+    resultats["aire1"] = reseau.aireDrainee(1)
+    return resultats
+
+
+@pytest.fixture(scope="module", params=[(terrain, forme, nom) for terrain, forme in MNTS for nom in CONFIGURATIONS],
+                ids=["%s%dx%d-%s" % ((terrain,) + forme + (nom,)) for terrain, forme in MNTS for nom in CONFIGURATIONS])
+def resultats(request, tmp_path_factory):
+    terrain, forme, nom = request.param
+    gpu = processusFils(tmp_path_factory.mktemp("simulateur") / "gpu.npz", "reseau", forme[0], forme[1], terrain, nom)
+    return etapes("cpu", terrain, forme, nom), gpu
+
+
+@pytest.mark.parametrize("etape", ETAPES)
+def test_parite(resultats, etape):
+    cpu, gpu = resultats
+    assert np.array_equal(gpu[etape], cpu[etape])
+
+
+@pytest.mark.parametrize("l0, c0", [(0, 0), (8, 5), (1000, 37)])
+def test_bruit(tmp_path, l0, c0):
+    #Mêmes valeurs sur CPU et GPU, et sur une fenêtre décalée que dans le MNT complet (découpage en tuiles)
+    forme = (24, 24)
+    gpu = processusFils(tmp_path / "bruit.npz", "bruit", forme[0], forme[1], l0, c0)["bruits"]
+    assert np.array_equal(gpu, bruits("cpu", forme, l0, c0))
+    assert np.array_equal(gpu[3:, 2:], bruits("cpu", (forme[0] - 3, forme[1] - 2), l0 + 3, c0 + 2))
+    assert gpu.min() >= -BRUIT[2] and gpu.max() <= BRUIT[2] and np.unique(gpu).size > 10
+
+
+if __name__ == "__main__":
+    #Processus fils : résultats du moteur "gpu" enregistrés dans sys.argv[1]
+    fichier, mode, dim1, dim2 = sys.argv[1:5]
+    if mode == "bruit":
+        np.savez(fichier, bruits=bruits("gpu", (int(dim1), int(dim2)), int(sys.argv[5]), int(sys.argv[6])))
+    else:
+        np.savez(fichier, **etapes("gpu", sys.argv[5], (int(dim1), int(dim2)), sys.argv[6]))
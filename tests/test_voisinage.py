@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Parité des directions vectorisées (MFD_voisinage.directionsVectorisees) avec
+myk_directionsEcoulement
+
+@author: manuel.collongues
+Cerema / Laboratoire de Nancy / ERTD
+"""
+
+import numpy as np
+import pytest
+import MFD_benchmark
+import MFD_cpu
+import MFD_v3
+import MFD_voisinage
+
+NODATA = 4284967396
+
+
+@pytest.fixture(scope="module", params=["fractal", "trous", "cuvettes", "plat"])
+def mnt(request):
+    mnt = MFD_benchmark.genererMNT(request.param, 80, seed=3)
+    mnt[10:12, 20:30] = 27108 #valeur lue comme 99999 par le noyau
+    return mnt
+
+
+@pytest.mark.parametrize("nbrCases", [9, 8])
+def test_parite_noyau(mnt, nbrCases):
+    attendu = np.zeros(mnt.shape + (nbrCases,), dtype=np.uint8)
+    MFD_cpu.myk_directionsEcoulement(mnt.copy(), attendu, 27108)
+    directions = np.zeros_like(attendu)
+    MFD_voisinage.directionsVectorisees(MFD_voisinage.plansVoisins(mnt), directions, 27108)
+    assert np.array_equal(directions, attendu)
+
+
+@pytest.mark.parametrize("formatDirections", ["cube", "compact", "csr"])
+@pytest.mark.parametrize("tailleBlocMasque", [None, 64])
+def test_parite_reseau(mnt, formatDirections, tailleBlocMasque):
+    #Référence : myk_directionsEcoulement sur le cube (MNT réécrit comme dans le noyau), quel que soit le format du chemin vectorisé
+    resultats = []
+    for methode, formatReference in (("noyau", "cube"), ("vectorisee", formatDirections)):
+        reseau = MFD_v3.ReseauDrainage(moteur="cpu", formatDirections=formatReference, tailleBlocMasque=tailleBlocMasque, methodeDirections=methode)
+        reseau.charger(mnt, NODATA)
+        resultats.append((reseau._directionsGrille()[:, :, -8:], reseau.aireDrainee(), reseau.versHote(reseau.d_mnt_bruite)))
+    for attendu, obtenu in zip(*resultats):
+        assert np.array_equal(attendu, obtenu)